@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic database of projects, in the format of pm.
+
+The same seed always gives the same database. Projects are spread over
+every type of contract, move forward through the statuses (sometimes
+back), and have histories of a few to a few dozen actions over months.
+
+Usage: python3 bench/generate.py 10000 database/db.json --seed 1
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings
+
+
+STATUSES = list(settings.PROGRESS)
+
+NAMES = [
+	'Sanofi', 'Pfizer', 'Novartis', 'Roche', 'GSK', 'BMS', 'J&J', 'Merck', 'Bayer',
+	'Servier', 'Ipsen', 'Takeda', 'Amgen', 'Biogen', 'AbbVie', 'Lilly', 'Astellas'
+]
+PIS = ['Dupont', 'Martin', 'Bernard', 'Thomas', 'Petit', 'Robert', 'Richard', 'Durand', '']
+WORDS = [
+	'meeting', 'with', 'the', 'partner', 'draft', 'sent', 'to', 'legal', 'waiting', 'for',
+	'answer', 'budget', 'validated', 'by', 'university', 'call', 'scheduled', 'comments',
+	'received', 'on', 'contract', 'signature', 'in', 'progress', 'follow', 'up', 'PI'
+]
+
+
+def comment(rand):
+	if rand.random() < 0.2:
+		return '-'
+	return ' '.join(rand.choice(WORDS) for _ in range(rand.randint(2, 14))).capitalize()
+
+
+def project(rand, id, start, end):
+	"""Return a project in JSON format, with the fields derived from its history"""
+	date = start + datetime.timedelta(seconds=rand.randint(0, int((end - start).total_seconds())))
+	step = 0
+	history = []
+	# Most histories are short, some are long
+	for node in range(1, min(int(rand.expovariate(1 / 6)) + 2, 60) + 1):
+		history.append({
+			'node': node,
+			'status': STATUSES[step],
+			'date': date.isoformat(),
+			'comment': comment(rand) if node > 1 else '-'
+		})
+		if STATUSES[step] == 'Done':
+			break
+		# Days until the next action
+		date += datetime.timedelta(days=min(int(rand.lognormvariate(2.5, 1)), 365),
+								   seconds=rand.randint(0, 86399))
+		move = rand.random()
+		if move < 0.35:
+			step = min(step + 1, len(STATUSES) - 1)
+		elif move < 0.40:
+			step = max(step - 1, 0)
+	money = int(rand.lognormvariate(4, 1))
+	return {
+		'id': id,
+		'name': rand.choice(NAMES) + ' ' + str(id),
+		'type': rand.choice(settings.TYPE_OF_CONTRACTS),
+		'money': money,
+		'money_year': rand.randint(0, money),
+		'pi': rand.choice(PIS),
+		'ref': 'C{0:06d}'.format(id) if rand.random() < 0.7 else '',
+		'summary': comment(rand) if rand.random() < 0.3 else '',
+		'history': history,
+		'first_date': history[0]['date'],
+		'last_date': history[-1]['date'],
+		'status': history[-1]['status'],
+		'done': 'Done' in [hist['status'] for hist in history]
+	}
+
+
+def generate(size, seed=1, years=10):
+	"""Return the database of size projects"""
+	rand = random.Random(seed)
+	end = datetime.datetime(2024, 1, 1)
+	start = end - datetime.timedelta(days=365 * years)
+	return {'projects': [project(rand, id, start, end) for id in range(1, size + 1)]}
+
+
+def write(path, size, seed=1):
+	with open(path, 'w') as db:
+		json.dump(generate(size, seed), db, sort_keys=True, indent=4)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Generate a synthetic database")
+	parser.add_argument('size', type=int, help="number of projects")
+	parser.add_argument('path', help="path of the database to write")
+	parser.add_argument('--seed', type=int, default=1)
+	args = parser.parse_args()
+	write(args.path, args.size, args.seed)
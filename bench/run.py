@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of pm on synthetic databases (see generate.py).
+
+Each operation is timed on databases of 1k, 10k and 100k projects, as the
+best of several runs. The results are written as JSON and compared with a
+baseline saved before a change:
+
+	python3 bench/run.py --save-baseline
+	(change the code)
+	python3 bench/run.py
+
+The command fails if an operation is slower than the baseline by more
+than the threshold.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+import lib.pmlib as pmlib
+import generate
+
+try:
+	import lib.export as export
+except ImportError as error:
+	# docxtpl and xlsxwriter are needed by the reports only
+	export = None
+	export_error = error
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SIZES = [1000, 10000, 100000]
+
+
+class Context:
+	"""Database and workflow shared by the benchmarks of one size"""
+
+	def __init__(self, source, directory):
+		self.source = source
+		self.directory = directory
+		self.path = os.path.join(directory, 'db.json')
+		self.reset()
+
+
+	def reset(self):
+		"""Fresh copy of the database, without cache"""
+		for name in os.listdir(self.directory):
+			os.remove(os.path.join(self.directory, name))
+		shutil.copy(self.source, self.path)
+		self.workflow = None
+
+
+	def fresh(self):
+		"""New workflow, without the views and indexes built by a previous run"""
+		self.workflow = pmlib.Workflow(self.path, journal=False, cache=True)
+
+
+
+def bench_init_json(context):
+	# The cache is not written either, to time the same load each run
+	pmlib.Workflow(context.path, journal=False, cache=False)
+
+
+def bench_init_cache(context):
+	pmlib.Workflow(context.path, journal=False, cache=True)
+
+
+def bench_status_api(context):
+	context.workflow.status_api(all=True)
+
+
+def bench_history_api(context):
+	rand = random.Random(1)
+	ids = list(context.workflow.by_id)
+	for id in rand.sample(ids, min(100, len(ids))):
+		context.workflow.history_api(id)
+
+
+def bench_stats(context):
+	context.workflow.stats_api()
+
+
+def bench_as_of(context):
+	# Dashboard and stats at each month-end of a year, from the workflow loaded
+	for month in range(1, 13):
+		snapshot = context.workflow.as_of(datetime.datetime(2020, month, 1))
+		snapshot.status_api(all=True)
+		snapshot.stats_api()
+
+
+def bench_save(context):
+	# A single project changed, as after pm commit
+	project = context.workflow.find_project(1)
+	project.touch()
+	context.workflow.save()
+
+
+def bench_report_context(context):
+	export.report_context(context.workflow, all=True)
+
+
+def bench_report_excel(context):
+	export.report_excel(context.workflow, all=True, force=True)
+
+
+BENCHMARKS = [
+	('init_json', bench_init_json, False),
+	('init_cache', bench_init_cache, False),
+	('status_api', bench_status_api, False),
+	('history_api', bench_history_api, False),
+	('stats', bench_stats, False),
+	('as_of', bench_as_of, False),
+	('save', bench_save, False),
+	('report_context', bench_report_context, True),
+	('report_excel', bench_report_excel, True)
+]
+
+
+def timed(function, context, repeat):
+	"""Best wall time of repeat runs, each one on a fresh workflow"""
+	best = None
+	for _ in range(repeat):
+		# Not timed, every run builds its views and indexes as the first one
+		context.fresh()
+		start = time.perf_counter()
+		function(context)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def run(sizes, repeat, seed, data_dir, only=None):
+	"""Return the results {size: {benchmark: seconds}}"""
+	results = {}
+	for size in sizes:
+		source = os.path.join(data_dir, 'db_{0}_{1}.json'.format(size, seed))
+		if not os.path.exists(source):
+			print("Generating {0} projects...".format(size))
+			generate.write(source, size, seed)
+		directory = tempfile.mkdtemp(prefix='pm-bench-')
+		try:
+			context = Context(source, directory)
+			# The reports are written in the temporary directory and not opened
+			settings.DIR = directory
+			if export:
+				export.open_file = lambda path: None
+			# Warm the binary cache
+			pmlib.Workflow(context.path, journal=False, cache=True)
+			results[str(size)] = {}
+			for name, function, needs_export in BENCHMARKS:
+				if only and name not in only:
+					continue
+				if needs_export and export is None:
+					print("{0:>7} {1:<16} skipped ({2})".format(size, name, export_error))
+					continue
+				seconds = timed(function, context, 1 if size >= 100000 else repeat)
+				results[str(size)][name] = seconds
+				print("{0:>7} {1:<16} {2:>10.4f} s".format(size, name, seconds))
+		finally:
+			shutil.rmtree(directory, ignore_errors=True)
+	return results
+
+
+def compare(results, baseline, threshold):
+	"""Display the ratio to the baseline, return the number of regressions"""
+	regressions = 0
+	print("-" * 60)
+	print("{0:>7} {1:<16} {2:>10} {3:>10} {4:>7}".format('size', 'benchmark', 'baseline', 'now', 'ratio'))
+	for size, timings in results.items():
+		for name, seconds in timings.items():
+			before = baseline.get(size, {}).get(name)
+			if not before:
+				continue
+			ratio = seconds / before
+			flag = ''
+			if ratio > 1 + threshold:
+				flag = '  SLOWER'
+				regressions += 1
+			elif ratio < 1 - threshold:
+				flag = '  faster'
+			print("{0:>7} {1:<16} {2:>10.4f} {3:>10.4f} {4:>6.2f}x{5}".format(
+				size, name, before, seconds, ratio, flag)
+			)
+	print("-" * 60)
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmarks of pm")
+	parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+						help="numbers of projects of the databases")
+	parser.add_argument('--only', nargs='+', default=None,
+						choices=[name for name, function, needs_export in BENCHMARKS],
+						help="run only these benchmarks")
+	parser.add_argument('--repeat', type=int, default=3,
+						help="runs of each benchmark, the best is kept (1 for 100k projects)")
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'pm-bench-data'),
+						help="directory of the generated databases, kept between runs")
+	parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results.json'))
+	parser.add_argument('--baseline', default=os.path.join(BENCH_DIR, 'baseline.json'))
+	parser.add_argument('--save-baseline', action='store_true', default=False,
+						help="save the results as the baseline")
+	parser.add_argument('--threshold', type=float, default=0.2,
+						help="slowdown ratio reported as a regression")
+	args = parser.parse_args()
+
+	os.makedirs(args.data, exist_ok=True)
+	results = run(args.sizes, args.repeat, args.seed, args.data, args.only)
+	report = {
+		'date': datetime.datetime.now().isoformat(),
+		'python': platform.python_version(),
+		'machine': platform.machine(),
+		'seed': args.seed,
+		'results': results
+	}
+	path = args.baseline if args.save_baseline else args.output
+	with open(path, 'w') as output:
+		json.dump(report, output, sort_keys=True, indent=4)
+	print("Results written in {0}".format(path))
+
+	if not args.save_baseline and os.path.exists(args.baseline):
+		with open(args.baseline, 'r') as saved:
+			baseline = json.load(saved)['results']
+		if compare(results, baseline, args.threshold):
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,118 @@
+"""
+Single pass aggregation engine used by the statistics.
+"""
+
+
+class Aggregation:
+	"""
+	Aggregation computes counters and sums of metrics over projects in one
+	pass, grouped by dimensions and by periods.
+	"""
+
+	def __init__(self, dimensions, metrics, periods=None, span=None, index=None):
+		"""
+		Initialization of the instance
+		- dimensions: dict name -> function(project) returning the group;
+		- metrics: dict name -> function(project) returning the value to sum;
+		- periods: list of (start_date, end_date), a project is counted in
+		  every period overlapping its span;
+		- span: function(project) returning the (first_date, last_date);
+		- index: IntervalIndex of the projects spans, used to find the projects
+		  of each period instead of testing every project.
+		Dimensions and metrics can be given as lists of names when the groups
+		are computed elsewhere and added with merge.
+		"""
+		self.dimensions = list(dimensions)
+		self.metrics = list(metrics)
+		if isinstance(dimensions, dict):
+			self.dimension_functions = [dimensions[name] for name in self.dimensions]
+			self.metric_functions = [metrics[name] for name in self.metrics]
+		self.periods = periods
+		self.span = span
+		self.index = index
+		self.groups = {}
+
+
+	def run(self, projects=None):
+		"""Aggregate the projects, or the projects of the index by period"""
+		if self.index is not None:
+			return self.run_index()
+		for project in projects:
+			if self.periods:
+				first_date, last_date = self.span(project)
+				indexes = [
+					index for index, (start_date, end_date) in enumerate(self.periods) \
+					if start_date <= last_date and end_date >= first_date
+				]
+				if not indexes:
+					continue
+			else:
+				indexes = [0]
+			key = tuple(function(project) for function in self.dimension_functions)
+			values = [function(project) for function in self.metric_functions]
+			for index in indexes:
+				self.add((index,) + key, values)
+		return self
+
+
+	def run_index(self):
+		"""Aggregate the projects found in the index for each period"""
+		rows = {}
+		for index, (start_date, end_date) in enumerate(self.periods):
+			for project in self.index.overlap(start_date, end_date):
+				row = rows.get(project)
+				if row is None:
+					row = rows[project] = (
+						tuple(function(project) for function in self.dimension_functions),
+						[function(project) for function in self.metric_functions]
+					)
+				self.add((index,) + row[0], row[1])
+		return self
+
+
+	def add(self, key, values):
+		"""Add the metrics of one project to a group"""
+		self.merge(key, 1, values)
+
+
+	def merge(self, key, count, values):
+		"""Add the count and the sums of metrics of several projects to a group"""
+		group = self.groups.get(key)
+		if group is None:
+			self.groups[key] = [count] + list(values)
+		else:
+			group[0] += count
+			for index, value in enumerate(values, 1):
+				group[index] += value
+
+
+	def select(self, where):
+		"""Return the groups matching the dimensions given in where"""
+		period = where.pop('period', None)
+		filters = [
+			(self.dimensions.index(name) + 1, value) for name, value in where.items()
+		]
+		for key, group in self.groups.items():
+			if period is not None and key[0] != period:
+				continue
+			if all(key[index] == value for index, value in filters):
+				yield group
+
+
+	def count(self, **where):
+		"""Number of projects matching where"""
+		return sum(group[0] for group in self.select(where))
+
+
+	def sum(self, metric, **where):
+		"""Sum of the metric over the projects matching where"""
+		index = self.metrics.index(metric) + 1
+		return sum(group[index] for group in self.select(where))
+
+
+	def average(self, metric, **where):
+		"""Average of the metric over the projects matching where"""
+		count = self.count(**dict(where))
+		if not count:
+			return 0.0
+		return self.sum(metric, **where) / count
@@ -0,0 +1,64 @@
+"""
+Binary snapshot cache of the database.
+
+The projects are stored pre-parsed (native dates, sorted histories), with
+their JSON fragment in the database, in a pickle file next to the
+database. Each project is pickled apart, so the entries of the projects
+changed can be replaced without decoding the others. The cache is keyed on the modification time, the size and the
+hash of the database file, so a stale or corrupt cache is simply ignored
+and the database is read from JSON.
+"""
+
+import hashlib
+import os
+import pickle
+
+
+class Cache:
+	"""
+	Cache is the sidecar binary copy of a JSON database.
+	"""
+
+	VERSION = 4
+	# Bytes of the database hashed at once
+	BLOCK = 1 << 20
+
+	def __init__(self, path, db_path):
+		"""Initialization of the instance"""
+		self.path = path
+		self.db_path = db_path
+
+
+	def key(self):
+		"""Fingerprint of the database file"""
+		stat = os.stat(self.db_path)
+		digest = hashlib.sha1()
+		with open(self.db_path, 'rb') as db:
+			# By blocks, the database is not held in memory twice
+			for block in iter(lambda: db.read(self.BLOCK), b''):
+				digest.update(block)
+		return (self.VERSION, stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+
+
+	def load(self):
+		"""Return the cached data, or None if the cache is stale or corrupt"""
+		try:
+			with open(self.path, 'rb') as cache:
+				key, data = pickle.load(cache)
+			if key != self.key():
+				return None
+			return data
+		except Exception:
+			return None
+
+
+	def store(self, data):
+		"""Write the data in the cache for the current database file"""
+		try:
+			tmp_path = self.path + '.tmp'
+			with open(tmp_path, 'wb') as cache:
+				pickle.dump((self.key(), data), cache, pickle.HIGHEST_PROTOCOL)
+			os.replace(tmp_path, self.path)
+		except OSError:
+			# The cache is only an optimization
+			pass
@@ -0,0 +1,138 @@
+"""
+Resident pm process keeping the workflow in memory.
+
+The daemon listens on a Unix domain socket. The pm command line forwards
+its arguments to the daemon when it is running, and prints the output sent
+back, so a command does not pay for loading the workflow. Commands are
+executed one at a time, which serializes the writes to the database.
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import traceback
+
+import settings
+
+
+# Commands executed by the daemon when it is running
+FORWARDED = [
+	'status', 'stats', 'funnel', 'search', 'history', 'add', 'rm', 'commit', 'update', 'check', 'checkpoint'
+]
+
+
+def available():
+	return hasattr(socket, 'AF_UNIX')
+
+
+def connect(path):
+	"""Return a socket connected to the daemon, or None if no daemon is running"""
+	if not available() or not os.path.exists(path):
+		return None
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		client.connect(path)
+	except OSError:
+		client.close()
+		return None
+	return client
+
+
+def request(client, message):
+	"""Send a message to the daemon and return its answer"""
+	with client:
+		client.sendall(json.dumps(message).encode('utf-8') + b'\n')
+		answer = client.makefile('rb').readline()
+	return json.loads(answer.decode('utf-8')) if answer else None
+
+
+def forward(argv, path=settings.DAEMON_SOCKET):
+	"""Execute the command in the daemon and return its output, or None if no daemon is running"""
+	client = connect(path)
+	if client is None:
+		return None
+	answer = request(client, {'argv': argv})
+	return answer['output'] if answer else None
+
+
+def stop(path=settings.DAEMON_SOCKET):
+	"""Stop the daemon, return False if no daemon is running"""
+	client = connect(path)
+	if client is None:
+		return False
+	request(client, {'stop': True})
+	return True
+
+
+def serve(load, run, parser, path=settings.DAEMON_SOCKET):
+	"""
+	Answer the commands sent on the socket until the daemon is stopped.
+	- load: function returning the workflow;
+	- run: function(args, workflow) executing a command;
+	- parser: parser of the command line arguments.
+	"""
+	if not available():
+		raise OSError("The daemon needs Unix domain sockets")
+	if connect(path) is not None:
+		raise OSError("A daemon is already running on {0}".format(path))
+	if os.path.exists(path):
+		# Socket left by a daemon that did not stop properly
+		os.remove(path)
+
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	server.bind(path)
+	server.listen(16)
+	daemon = Daemon(load, run, parser)
+	try:
+		while True:
+			connection, _ = server.accept()
+			with connection:
+				message = connection.makefile('rb').readline()
+				if not message:
+					continue
+				message = json.loads(message.decode('utf-8'))
+				if message.get('stop'):
+					connection.sendall(b'{}\n')
+					break
+				output = daemon.execute(message['argv'])
+				connection.sendall(json.dumps({'output': output}).encode('utf-8') + b'\n')
+	finally:
+		server.close()
+		os.remove(path)
+
+
+
+class Daemon:
+	"""
+	Daemon executes the commands on the workflow kept in memory.
+	"""
+
+	def __init__(self, load, run, parser):
+		"""Initialization of the instance"""
+		self.load = load
+		self.run = run
+		self.parser = parser
+		self.workflow = self.load()
+
+
+	def execute(self, argv):
+		"""Execute a command and return its output"""
+		# Reload when the database was changed by another process
+		if self.workflow.file_stamp() != self.workflow.stamp:
+			self.workflow = self.load()
+
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+			try:
+				args = self.parser.parse_args(argv)
+				self.run(args, self.workflow)
+			except SystemExit:
+				# Error or help of the argument parser
+				pass
+			except Exception:
+				traceback.print_exc(file=output)
+				# The workflow in memory may be half modified
+				self.workflow = self.load()
+		return output.getvalue()
@@ -1,53 +1,56 @@
 from docxtpl import DocxTemplate
-import jinja2
+import docx
 import settings
+import lib.timing as timing
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import hashlib
+import io
+import json
 import os
+import re
 import xlsxwriter
 
 
-def report_context(workflow, all=False):
+def report_context(workflow, all=False, detail=False):
 	"""
 	Function to generate the context elements to be insert in a nice report.
+	With detail, the history of each project is added, with the whole comments.
 	"""
 	projects_context = []
-	now = datetime.now()
-	workflow.sort_projects(key='status')
-
-	projects = workflow.projects
+	now = workflow.today()
+	workflow.hydrate()
+	projects, projects_done = workflow.sort_projects(key='status')
 	if all:
-		projects += workflow.projects_done
+		projects = projects + projects_done
 
 	for project in projects:
-		# Progress bar
-		cell1 = cell2 = cell3 = cell4 = cell5 = cell6 = 'ffffff'
+		# Progress bar: one colored cell per step reached
 		progress = len(settings.PROGRESS[project.history[-1]['status']])
-		if progress > 0:
-			cell1 = settings.WORD_COLOR_CELL
-		if progress > 1:
-			cell2 = settings.WORD_COLOR_CELL
-		if progress > 2:
-			cell3 = settings.WORD_COLOR_CELL
-		if progress > 3:
-			cell4 = settings.WORD_COLOR_CELL
-		if progress > 4:
-			cell5 = settings.WORD_COLOR_CELL
-		if progress > 5:
-			cell6 = settings.WORD_COLOR_CELL
+		cells = [
+			settings.WORD_COLOR_CELL if step < progress else 'ffffff' for step in range(6)
+		]
 
 		# Context
 		projects_context_temp = {
+			'id': project.id,
 			'name': project.name,
 			'type': project.type.replace('&', 'n'),
+			'status': project.status,
+			'pi': project.pi,
 			'euro': project.money if project.money > 0 else '-',
-			'comment': project.history[-1]['comment'],
-			'cell1': cell1,
-			'cell2': cell2,
-			'cell3': cell3,
-			'cell4': cell4,
-			'cell5': cell5,
-			'cell6': cell6
+			'comment': project.history[-1]['comment']
 		}
+		for step, cell in enumerate(cells, 1):
+			projects_context_temp['cell' + str(step)] = cell
+		if detail:
+			projects_context_temp['history'] = [{
+				'node': hist['node'],
+				'date': hist['date'].strftime('%d/%m/%Y'),
+				'status': hist['status'],
+				'comment': hist['comment']
+			} for hist in project.history]
 
 		projects_context.append(projects_context_temp)
 
@@ -59,32 +62,229 @@ def report_context(workflow, all=False):
 	return context
 
 
+# Sections of the report: name of the section of a project, and order of the sections
+TYPES = {type.replace('&', 'n'): index for index, type in enumerate(settings.TYPE_OF_CONTRACTS)}
+SECTIONS = {
+	'status': (lambda project: project['status'], lambda name: -len(settings.PROGRESS[name])),
+	'type': (lambda project: project['type'], lambda name: (TYPES.get(name, len(TYPES)), name)),
+	'pi': (lambda project: project['pi'] or '-', lambda name: name)
+}
+
+
+def report_sections(context, split):
+	"""Split the context of the report in a list of (name, context) by status, type or PI"""
+	section_name, section_order = SECTIONS[split]
+	sections = {}
+	for project in context['projects']:
+		sections.setdefault(section_name(project), []).append(project)
+	return [
+		(name, dict(context, section=name, projects=sections[name]))
+		for name in sorted(sections, key=section_order)
+	]
+
+
+def render_section(template, context, detail=False):
+	"""Render the template with a context and return the document (in a worker process)"""
+	tpl = DocxTemplate(template)
+	tpl.render(context)
+	output = io.BytesIO()
+	tpl.save(output)
+	if not detail:
+		return output.getvalue()
+	document = docx.Document(io.BytesIO(output.getvalue()))
+	add_history(document, context['projects'])
+	output = io.BytesIO()
+	document.save(output)
+	return output.getvalue()
+
 
-def report_word(workflow, all=False):
+def add_history(document, projects):
+	"""Add a table of the history of each project at the end of the document"""
+	document.add_page_break()
+	for project in projects:
+		document.add_paragraph().add_run('#{0} {1}'.format(project['id'], project['name'])).bold = True
+		table = document.add_table(rows=1, cols=4)
+		for cell, title in zip(table.rows[0].cells, ['Node', 'Date', 'Status', 'Comment']):
+			cell.text = title
+		for hist in project['history']:
+			cells = table.add_row().cells
+			cells[0].text = str(hist['node'])
+			cells[1].text = hist['date']
+			cells[2].text = hist['status']
+			cells[3].text = hist['comment']
+
+
+def merge_documents(sections):
+	"""Merge the rendered documents of the sections in a single document, each one after its name"""
+	master = None
+	for name, content in sections:
+		document = docx.Document(io.BytesIO(content))
+		if master is None:
+			master = document
+			# Name of the first section at the top of the document
+			label = master.add_paragraph()
+			label.add_run(name).bold = True
+			master.element.body[0].addprevious(label._p)
+			continue
+		master.add_page_break()
+		master.add_paragraph().add_run(name).bold = True
+		# The elements are added before the last section properties of the master
+		end = master.element.body[-1]
+		for element in document.element.body:
+			if element.tag.endswith('}sectPr'):
+				continue
+			end.addprevious(copy.deepcopy(element))
+	return master
+
+
+def report_word(workflow, all=False, split=None, files=False, detail=False, force=False):
 	"""
 	Function to generate a word report.
+	- split: 'status', 'type' or 'pi', renders one section per value in parallel;
+	- files: writes one file per section instead of merging them;
+	- detail: adds the history of each project after the projects;
+	- force: generates the report even if the same report was already generated.
 	"""
-	now = datetime.now()
+	# Named after the month of the report, or of the snapshot (see Workflow.as_of)
+	now = workflow.today()
 	# Get context
-	context = report_context(workflow, all=all)
+	with timing.phase('report_context'):
+		context = report_context(workflow, all=all, detail=detail)
+	template = settings.DIR + '/' + settings.WORD_TEMPLATE
 
-	# Generate template
-	tpl = DocxTemplate(settings.DIR + '/' + settings.WORD_TEMPLATE)
-	tpl.render(context)
-	
 	# Make directory if it does not exist yet
 	if not os.path.exists(settings.DIR + "/Reports"):
 		os.makedirs(settings.DIR + "/Reports")
 
 	# Generate file name and save the doc
 	file_name = settings.DIR + '/Reports/Suivi_SC_' + str(now.month) + '_' + str(now.year) + '.docx'
-	tpl.save(file_name)
-	
+	sections = report_sections(context, split) if split else [('', context)]
+	if files and len(sections) > 1:
+		root = file_name[:-len('.docx')]
+		outputs = [root + '_' + re.sub(r'[^\w-]', '_', name) + '.docx' for name, section in sections]
+		# Fingerprint of the set of files
+		file_name = root + '_' + split + '.docx'
+	else:
+		outputs = [file_name]
+
+	# Same projects, template and options as the report already generated
+	key = fingerprint(context['projects'], file_hash(template), split, len(outputs), detail)
+	if not force and cached(file_name, key):
+		print("No change since the last report.")
+	elif len(sections) == 1:
+		with timing.phase('render_word'):
+			content = render_section(template, sections[0][1], detail)
+		with timing.phase('write'):
+			with open(file_name, 'wb') as output:
+				output.write(content)
+		store_fingerprint(file_name, key, outputs)
+	else:
+		# Sections are rendered in parallel
+		with timing.phase('render_word'), ProcessPoolExecutor() as executor:
+			contents = list(executor.map(
+				render_section, [template] * len(sections),
+				[section for name, section in sections], [detail] * len(sections)
+			))
+		with timing.phase('write'):
+			if len(outputs) > 1:
+				for output_name, content in zip(outputs, contents):
+					with open(output_name, 'wb') as output:
+						output.write(content)
+			else:
+				merge_documents(
+					[(name, content) for (name, section), content in zip(sections, contents)]
+				).save(file_name)
+		store_fingerprint(file_name, key, outputs)
+
+	if len(outputs) > 1:
+		print("{0} files in {1}/Reports.".format(len(outputs), settings.DIR))
+		return
+
 	# Open the word file
 	open_file(file_name)
 	print("Done.")
 
 
+def fingerprint(*parts):
+	"""Hash of the data of a report"""
+	data = json.dumps(parts, sort_keys=True, default=str)
+	return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def file_hash(path):
+	with open(path, 'rb') as content:
+		return hashlib.sha256(content.read()).hexdigest()
+
+
+def fingerprint_path(file_name):
+	"""Fingerprint of a report, stored next to it"""
+	return file_name + settings.REPORT_FINGERPRINT_EXT
+
+
+def cached(file_name, key):
+	"""True if the report was generated with the same fingerprint and its files still exist"""
+	try:
+		with open(fingerprint_path(file_name), 'r') as stored:
+			stored = json.load(stored)
+	except (OSError, ValueError):
+		return False
+	return stored['fingerprint'] == key and all(os.path.exists(path) for path in stored['files'])
+
+
+def store_fingerprint(file_name, key, files):
+	with open(fingerprint_path(file_name), 'w') as stored:
+		json.dump({
+			'fingerprint': key,
+			'date': datetime.now().isoformat(),
+			'files': files
+		}, stored)
+
+
+def cached_reports():
+	"""Return the list of (file name, fingerprint data) of the reports generated"""
+	directory = settings.DIR + '/Reports'
+	if not os.path.exists(directory):
+		return []
+	reports = []
+	for name in sorted(os.listdir(directory)):
+		if name.endswith(settings.REPORT_FINGERPRINT_EXT):
+			path = directory + '/' + name
+			try:
+				with open(path, 'r') as stored:
+					reports.append((path[:-len(settings.REPORT_FINGERPRINT_EXT)], json.load(stored)))
+			except (OSError, ValueError):
+				continue
+	return reports
+
+
+def list_reports():
+	"""Display the reports generated"""
+	for file_name, stored in cached_reports():
+		missing = [path for path in stored['files'] if not os.path.exists(path)]
+		print("{0:<35} {1:<10} {2}  {3} file(s){4}".format(
+			os.path.basename(file_name),
+			datetime.strftime(datetime.strptime(stored['date'][:10], '%Y-%m-%d'), '%d/%m/%Y'),
+			stored['fingerprint'][:12], len(stored['files']),
+			', missing' if missing else ''
+		))
+
+
+def prune_reports(days):
+	"""Delete the reports generated more than days ago, and the fingerprints of reports deleted"""
+	limit = datetime.now().timestamp() - days * 86400
+	removed = 0
+	for file_name, stored in cached_reports():
+		date = datetime.strptime(stored['date'][:19], '%Y-%m-%dT%H:%M:%S').timestamp()
+		missing = not all(os.path.exists(path) for path in stored['files'])
+		if date < limit or missing:
+			for path in stored['files']:
+				if os.path.exists(path):
+					os.remove(path)
+			os.remove(fingerprint_path(file_name))
+			removed += 1
+	print("{0} report(s) removed.".format(removed))
+
+
 def open_file(file_path):
 	"""Function to open a file with the default application and based on the OS platform"""
 	if os.name == 'posix':
@@ -93,72 +293,125 @@ def open_file(file_path):
 		os.system("start " + file_path)
 
 
-def report_excel(workflow, all=False):
+# Excel labels in French
+STATUS_TRANSLATE = {
+	'Start': '1 - Prospection',
+	'Progr': '2 - Programme scientifique',
+	'Budge': '3 - Budget',
+	'Contr': '4 - Négociation contrat',
+	'Sign':  '5 - Signature / Suivi',
+	'Done':  '6 - Signé'
+}
+CONTRACTS_TRANSLATE = {
+	'R&D':  'Collab R&D',
+	'aR&D': 'Collab R&D',
+	'Lic':  'Licence',
+	'aLic': 'Licence',
+	'MTA':  'Collab R&D'
+}
+
+
+def report_excel(workflow, all=False, force=False):
 	"""Function to make a report of the current projects on a Excel sheet"""
 
 	# Initi and start excel sheet
-	now = datetime.now()
+	now = workflow.today()
+	if not os.path.exists(settings.DIR + "/Reports"):
+		os.makedirs(settings.DIR + "/Reports")
 	path_name = settings.DIR + '/Reports/Suivi_SC_Excel_' + str(now.month) + '_' + str(now.year) + '.xlsx'
-	wb = xlsxwriter.Workbook(path_name)
-	ws = wb.add_worksheet()
 
 	# Sorts projects and get data
-	workflow.sort_projects(key='name')
-	projects = workflow.projects
+	workflow.hydrate()
+	projects, projects_done = workflow.sort_projects(key='name')
 	if all:
-		projects += workflow.projects_done
-
-	# Headers
-	ws.write(0, 0, "Person in charge")
-	ws.write(0, 1, "Type of contract")
-	ws.write(0, 2, "Company")
-	ws.write(0, 3, "Summary")
-	ws.write(0, 4, "-")
-	ws.write(0, 5, "-")
-	ws.write(0, 6, "-")
-	ws.write(0, 7, "PI")
-	ws.write(0, 8, "Status")
-	ws.write(0, 9, "EUR 1st year")
-	ws.write(0, 10, "EUR pot.")
-	ws.write(0, 11, "Ref")
-
-
-	# Loop over projects
-	row = 1
-	col = 0
-	for project in projects:
+		projects = projects + projects_done
 
-		# Convert to French
-		status_translate = {
-			'Start': '1 - Prospection',
-			'Progr': '2 - Programme scientifique',
-			'Budge': '3 - Budget',
-			'Contr': '4 - Négociation contrat',
-			'Sign':  '5 - Signature / Suivi'
-		}
-		contracts_translate = {
-			'R&D':  'Collab R&D',
-			'aR&D': 'Collab R&D',
-			'Lic':  'Licence',
-			'aLic': 'Licence',
-			'MTA':  'Collab R&D'
-		}
+	# Same projects as the report already generated (the stats use all projects)
+	key = fingerprint(
+		'excel', all,
+		[project.pack() for project in workflow.projects + workflow.projects_done]
+	)
+	if not force and cached(path_name, key):
+		print("No change since the last report.")
+	else:
+		# Rows are written to disk as soon as the next one starts, in order
+		wb = xlsxwriter.Workbook(path_name, {'constant_memory': True})
+		date_format = wb.add_format({'num_format': 'dd/mm/yyyy'})
 
-		# Write in the excel sheet
-		ws.write(row, col, "Sylvain CARLIOZ")
-		ws.write(row, col + 1, contracts_translate[project.type])
-		ws.write(row, col + 2, project.name)
-		ws.write(row, col + 3, project.summary)
-		ws.write(row, col + 7, project.pi)
-		ws.write(row, col + 8, status_translate[project.history[-1]['status']])
-		ws.write(row, col + 9, project.money_year * 1000)
-		ws.write(row, col + 10, project.money * 1000)
-		ws.write(row, col + 11, project.ref)
-		row += 1
-
-	# Close excel sheet
-	wb.close()
+		with timing.phase('render_excel'):
+			excel_dashboard(wb.add_worksheet('Dashboard'), projects)
+			# Every project, whether the dashboard has the done ones or not
+			excel_history(wb.add_worksheet('History'), workflow.projects + workflow.projects_done, date_format)
+			excel_stats(wb.add_worksheet('Stats'), workflow)
+
+			# Close excel sheet
+			wb.close()
+		store_fingerprint(path_name, key, [path_name])
 
 	# Open with default app
 	open_file(path_name)
-	print("Done.")
\ No newline at end of file
+	print("Done.")
+
+
+def excel_dashboard(ws, projects):
+	"""Write the last status of each project"""
+	ws.write_row(0, 0, [
+		"Person in charge", "Type of contract", "Company", "Summary", "-", "-", "-",
+		"PI", "Status", "EUR 1st year", "EUR pot.", "Ref"
+	])
+	for row, project in enumerate(projects, 1):
+		ws.write_row(row, 0, [
+			"Sylvain CARLIOZ",
+			CONTRACTS_TRANSLATE.get(project.type, project.type),
+			project.name,
+			project.summary,
+			None, None, None,
+			project.pi,
+			STATUS_TRANSLATE[project.status],
+			project.money_year * 1000,
+			project.money * 1000,
+			project.ref
+		])
+
+
+def excel_history(ws, projects, date_format):
+	"""Write every node of the history of the projects"""
+	ws.write_row(0, 0, ["Id", "Company", "Type of contract", "Node", "Date", "Status", "Comment"])
+	row = 1
+	for project in sorted(projects, key=lambda k: k.id):
+		contract = CONTRACTS_TRANSLATE.get(project.type, project.type)
+		for hist in project.history:
+			ws.write_row(row, 0, [project.id, project.name, contract, hist['node']])
+			ws.write_datetime(row, 4, hist['date'], date_format)
+			ws.write_row(row, 5, [STATUS_TRANSLATE[hist['status']], hist['comment']])
+			row += 1
+
+
+def excel_stats(ws, workflow):
+	"""Write the statistics of each year"""
+	ws.write_row(0, 0, [
+		"Year", "Projects", "Signed", "Active", "Licenses", "R&D",
+		"EUR signed", "EUR in nego", "EUR invoiced", "EUR per project", "Days to signature"
+	])
+	first_date, last_date = workflow.intervals.min_start(), workflow.intervals.max_end()
+	if first_date is None:
+		return
+	periods = [
+		(datetime(year, 1, 1), datetime(year, 12, 31, 23, 59, 59))
+		for year in range(first_date.year, last_date.year + 1)
+	]
+	# All years are computed in one pass
+	for row, context in enumerate(workflow.stats_periods(periods), 1):
+		ws.write_row(row, 0, [
+			context['start_date'].year,
+			context['nb_projects'],
+			context['nb_done_projects'],
+			context['nb_active_projects'],
+			context['nb_license'],
+			context['nb_rnd'],
+			context['total_money_done'] * 1000,
+			context['total_money_ongoing'] * 1000,
+			context['total_money_year'] * 1000,
+			round(context['cash_per_project'] * 1000),
+			round(context['time_to_done'])
+		])
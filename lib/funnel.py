@@ -0,0 +1,180 @@
+"""
+Analytics of the path of the projects through the statuses, with NumPy.
+
+The history of every project is converted once into flat arrays (project,
+status code in the order of settings.PROGRESS, date in seconds), and the
+time in each status, the conversion from a status to the next ones and the
+drop-off are computed on the arrays, without a loop over the history.
+"""
+
+import datetime
+
+import numpy
+
+import settings
+
+
+STATUSES = list(settings.PROGRESS)
+DONE = STATUSES.index('Done')
+DAY = 86400
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class Funnel:
+	"""
+	Funnel holds the history of the projects as arrays.
+	"""
+
+	def __init__(self, projects):
+		"""Initialization of the instance with the projects"""
+		codes = {status: code for code, status in enumerate(STATUSES)}
+		projects = self.projects = [project for project in projects if project.history]
+		nodes = [hist for project in projects for hist in project.history]
+		lengths = numpy.fromiter(
+			(len(project.history) for project in projects), numpy.int64, len(projects)
+		)
+
+		# Project, status code and date in seconds of each node
+		self.project = numpy.repeat(numpy.arange(len(projects)), lengths)
+		self.status = numpy.fromiter(
+			(codes[hist['status']] for hist in nodes), numpy.int64, len(nodes)
+		)
+		# Faster than a conversion of the datetimes by NumPy
+		self.date = numpy.fromiter(
+			((hist['date'] - EPOCH).total_seconds() for hist in nodes), numpy.float64, len(nodes)
+		)
+		# First node of each project
+		self.starts = numpy.cumsum(lengths) - lengths
+
+		# Names of the groups, and group of each project as an index in the names
+		self.groups = {}
+
+
+	def __len__(self):
+		return len(self.starts)
+
+
+	def group(self, name, function):
+		"""Return the names of the groups and the group of each project, computed by function"""
+		if name not in self.groups:
+			self.groups[name] = numpy.unique(
+				numpy.array([function(project) for project in self.projects], dtype=str),
+				return_inverse=True
+			)
+		return self.groups[name]
+
+
+	def furthest(self):
+		"""Furthest status code reached by each project (statuses may go back)"""
+		if not len(self.starts):
+			return numpy.zeros(0, dtype=numpy.int64)
+		return numpy.maximum.reduceat(self.status, self.starts)
+
+
+	def stages(self):
+		"""
+		Return (status code, days) of each stay in a status: consecutive
+		nodes with the same status are one stay, ended by the next status.
+		The stays not ended yet (last status of a project) are left out.
+		"""
+		change = numpy.ones(len(self.status), dtype=bool)
+		change[1:] = (self.status[1:] != self.status[:-1]) | (self.project[1:] != self.project[:-1])
+		stays = numpy.flatnonzero(change)
+		ended = self.project[stays[1:]] == self.project[stays[:-1]]
+		days = (self.date[stays[1:]] - self.date[stays[:-1]])[ended] / DAY
+		return self.status[stays[:-1]][ended], days
+
+
+	def time_in_stage(self):
+		"""Number, median and 90th percentile of the days spent in each status"""
+		codes, days = self.stages()
+		rows = []
+		for code, status in enumerate(STATUSES[:DONE]):
+			selected = days[codes == code]
+			rows.append({
+				'status': status,
+				'count': len(selected),
+				'median': float(numpy.median(selected)) if len(selected) else 0.0,
+				'p90': float(numpy.percentile(selected, 90)) if len(selected) else 0.0
+			})
+		return rows
+
+
+	def time_to_done(self):
+		"""Days from the first action to the first Done of each project done"""
+		if not len(self.starts):
+			return numpy.zeros(0)
+		done = numpy.where(self.status == DONE, self.date, numpy.inf)
+		first_done = numpy.minimum.reduceat(done, self.starts)
+		reached = first_done != numpy.inf
+		return (first_done[reached] - self.date[self.starts][reached]) / DAY
+
+
+	@staticmethod
+	def reached(furthest, groups=None, size=1):
+		"""
+		Number of projects having reached each status, per group if given:
+		an array of size groups x statuses.
+		"""
+		statuses = len(STATUSES)
+		if groups is None:
+			groups = numpy.zeros(len(furthest), dtype=numpy.int64)
+		counts = numpy.bincount(
+			groups * statuses + furthest, minlength=size * statuses
+		).reshape(size, statuses)
+		# Reaching a status counts for every status before it
+		return counts[:, ::-1].cumsum(axis=1)[:, ::-1]
+
+
+	def conversion(self):
+		"""Projects reaching each status, conversion from the previous one and drop-off"""
+		reached = self.reached(self.furthest())[0]
+		rows = []
+		for code, status in enumerate(STATUSES):
+			previous = reached[code - 1] if code else reached[0]
+			rows.append({
+				'status': status,
+				'reached': int(reached[code]),
+				'conversion': float(reached[code] / previous) if previous else 0.0,
+				# Projects which did not go further (still there, or stopped)
+				'drop_off': int(reached[code] - reached[code + 1]) if code < DONE else 0
+			})
+		return rows
+
+
+	def by_group(self, name, function):
+		"""
+		Number of projects, share reaching each status and median time to
+		done, per group of function(project) (type of contract, PI...).
+		"""
+		furthest = self.furthest()
+		names, groups = self.group(name, function)
+		reached = self.reached(furthest, groups, len(names))
+		to_done = self.time_to_done()
+		# Projects done, in the order of to_done
+		done_groups = groups[furthest == DONE]
+		rows = []
+		for index, group in enumerate(names):
+			count = int(reached[index, 0])
+			days = to_done[done_groups == index]
+			rows.append({
+				'group': str(group),
+				'count': count,
+				'reached': [float(value / count) if count else 0.0 for value in reached[index]],
+				'time_to_done': float(numpy.median(days)) if len(days) else 0.0
+			})
+		return rows
+
+
+	def context(self, by, function):
+		"""Return the context of the funnel dashboard, with the drop-off per group of by"""
+		to_done = self.time_to_done()
+		return {
+			'nb_projects': len(self),
+			'nb_nodes': len(self.status),
+			'time_in_stage': self.time_in_stage(),
+			'conversion': self.conversion(),
+			'time_to_done': float(numpy.median(to_done)) if len(to_done) else 0.0,
+			'by': by,
+			'groups': self.by_group(by, function)
+		}
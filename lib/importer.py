@@ -0,0 +1,221 @@
+"""
+Bulk import of projects and actions from CSV or JSON lines.
+
+Each row is an operation named after the pm command doing the same:
+- add: new project (name, type, money, and optionally id, money_year, pi,
+  summary, ref, date of the start);
+- commit: new action on the project id (status, comment, date);
+- amend: change of the node of the project id, or of its last node
+  (status, comment, date);
+- delete: removal of the node of the project id, or of its last node;
+- update: change of the information of the project id (name, type, money,
+  money_year, pi, summary, ref);
+- rm: removal of the project id.
+
+Rows are validated and applied in memory one by one, and persisted at once
+at the end. A bad row cancels the whole import.
+"""
+
+import csv
+import datetime
+import json
+
+import settings
+from lib.project import Project
+
+
+OPERATIONS = ['add', 'commit', 'amend', 'delete', 'update', 'rm']
+
+COLUMNS = [
+	'op', 'id', 'node', 'name', 'type', 'money', 'money_year', 'pi', 'summary', 'ref',
+	'status', 'date', 'comment'
+]
+
+PROJECT_FIELDS = ['name', 'type', 'money', 'money_year', 'pi', 'summary', 'ref']
+
+
+class RowError(ValueError):
+	"""Invalid row of an import"""
+
+	def __init__(self, line, message):
+		super().__init__("line {0}: {1}".format(line, message))
+		self.line = line
+
+
+
+def read(file, format):
+	"""Yield the (line, row) of a CSV or JSON lines file, empty values removed"""
+	if format == 'csv':
+		reader = csv.DictReader(file)
+		try:
+			for row in reader:
+				yield reader.line_num, {
+					key: value.strip() for key, value in row.items() \
+					if key and value is not None and value.strip()
+				}
+		except csv.Error as error:
+			raise RowError(reader.line_num, str(error))
+	else:
+		for line, text in enumerate(file, 1):
+			if not text.strip():
+				continue
+			try:
+				row = json.loads(text)
+			except ValueError:
+				raise RowError(line, "invalid JSON")
+			if not isinstance(row, dict):
+				raise RowError(line, "a JSON object is expected")
+			yield line, {key: value for key, value in row.items() if value not in (None, '')}
+
+
+def run(workflow, rows):
+	"""Apply the rows to the workflow in a single transaction, return the number of rows"""
+	importer = Importer(workflow)
+	with workflow.transaction():
+		for line, row in rows:
+			record = importer.record(line, row)
+			try:
+				workflow.apply(record)
+			except (TypeError, ValueError) as error:
+				# Value not caught by the validation of the row
+				raise RowError(line, error)
+			workflow.commit(record)
+			importer.count += 1
+	return importer.count
+
+
+
+class Importer:
+	"""
+	Importer converts the rows to the mutation records of the workflow.
+	"""
+
+	def __init__(self, workflow):
+		"""Initialization of the instance"""
+		self.workflow = workflow
+		self.count = 0
+		self.next_id = workflow.next_id()
+
+
+	def record(self, line, row):
+		"""Return the record of a row, or raise RowError"""
+		unknown = [key for key in row if key not in COLUMNS]
+		if unknown:
+			raise RowError(line, "unknown column {0}".format(', '.join(unknown)))
+		op = row.get('op')
+		if op not in OPERATIONS:
+			raise RowError(line, "op must be {0}".format(', '.join(OPERATIONS)))
+		if op == 'add':
+			return self.add(line, row)
+
+		project = self.workflow.find_project(self.integer(line, row, 'id'))
+		if project is None:
+			raise RowError(line, "project #{0} not found".format(row['id']))
+		if op == 'rm':
+			return {'op': 'rm', 'id': project.id}
+		if op == 'update':
+			params = self.fields(line, row)
+			if not params:
+				raise RowError(line, "nothing to update")
+			return {'op': 'update', 'id': project.id, 'params': params}
+		if op == 'commit':
+			return {
+				'op': 'add_action', 'id': project.id,
+				'status': self.status(line, row) or project.status,
+				'comment': str(row.get('comment', '-')),
+				'date': self.date(line, row).isoformat()
+			}
+
+		# Operations on a node, the last one by default
+		node = self.integer(line, row, 'node') if 'node' in row else project.history[-1]['node']
+		if node not in project.nodes:
+			raise RowError(line, "node {0} not found in project #{1}".format(node, project.id))
+		if op == 'delete':
+			if len(project.history) == 1:
+				raise RowError(line, "the only node of project #{0} cannot be deleted".format(project.id))
+			return {'op': 'rm_action', 'id': project.id, 'node': node}
+		params = {}
+		if 'status' in row:
+			params['status'] = self.status(line, row)
+		if 'comment' in row:
+			params['comment'] = str(row['comment'])
+		if 'date' in row:
+			params['date'] = self.date(line, row).isoformat()
+		if not params:
+			raise RowError(line, "nothing to amend")
+		return {'op': 'update_action', 'id': project.id, 'node': node, 'params': params}
+
+
+	def add(self, line, row):
+		"""Record of a new project"""
+		for key in ['name', 'type', 'money']:
+			if key not in row:
+				raise RowError(line, "{0} is missing".format(key))
+		if 'id' in row:
+			id = self.integer(line, row, 'id')
+			if self.workflow.find_project(id) is not None:
+				raise RowError(line, "project #{0} already exists".format(id))
+		else:
+			id = self.next_id
+		self.next_id = max(self.next_id, id + 1)
+		fields = self.fields(line, row)
+		project = Project(
+			fields.pop('name'), fields.pop('type'), fields.pop('money'), id=id,
+			history=[{
+				'node': 1, 'status': 'Start', 'date': self.date(line, row), 'comment': '-'
+			}], **fields
+		)
+		return {'op': 'add_project', 'project': project.dumps()}
+
+
+	def fields(self, line, row):
+		"""Information of the project given in the row"""
+		fields = {}
+		for key in PROJECT_FIELDS:
+			if key not in row:
+				continue
+			if key in ['money', 'money_year']:
+				fields[key] = self.integer(line, row, key)
+			else:
+				fields[key] = str(row[key])
+		if 'type' in fields and fields['type'] not in settings.TYPE_OF_CONTRACTS:
+			raise RowError(line, "type of contract must be {0}".format(
+				', '.join(settings.TYPE_OF_CONTRACTS))
+			)
+		return fields
+
+
+	@staticmethod
+	def integer(line, row, key):
+		try:
+			return int(row[key])
+		except KeyError:
+			raise RowError(line, "{0} is missing".format(key))
+		except (TypeError, ValueError):
+			raise RowError(line, "{0} must be an integer".format(key))
+
+
+	@staticmethod
+	def status(line, row):
+		status = row.get('status', '')
+		if status and status not in settings.PROGRESS:
+			raise RowError(line, "status must be {0}".format(', '.join(settings.PROGRESS)))
+		return status
+
+
+	@staticmethod
+	def date(line, row):
+		"""Date of the row, in ISO format or dd/mm/yyyy, now by default"""
+		date = row.get('date')
+		if not date:
+			return datetime.datetime.now()
+		try:
+			if '/' in str(date):
+				return datetime.datetime.strptime(date, '%d/%m/%Y')
+			value = datetime.datetime.fromisoformat(date)
+			if value.tzinfo is not None:
+				# The dates of the database are local, without a time zone
+				raise ValueError("time zone")
+			return value
+		except (TypeError, ValueError):
+			raise RowError(line, "invalid date {0}".format(date))
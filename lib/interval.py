@@ -0,0 +1,121 @@
+"""
+Interval index over the active span of the projects.
+"""
+
+import bisect
+
+
+class IntervalIndex:
+	"""
+	IntervalIndex finds the intervals overlapping a range of dates.
+
+	Intervals are kept sorted by start date, with a tree of the maximum end
+	date over the sorted intervals, so a query only visits the branches
+	containing a match: it takes O((k + 1) log n) for k matches.
+	"""
+
+	def __init__(self, intervals=()):
+		"""Initialization of the instance with a list of (key, start, end)"""
+		self.spans = {}
+		self.starts = []
+		self.ends = []
+		self.keys = []
+		for key, start, end in sorted(intervals, key=lambda k: k[1]):
+			self.spans[key] = (start, end)
+			self.starts.append(start)
+			self.ends.append(end)
+			self.keys.append(key)
+		self.tree = None
+
+
+	def __len__(self):
+		return len(self.keys)
+
+
+	def __contains__(self, key):
+		return key in self.spans
+
+
+	def add(self, key, start, end):
+		"""Add the interval of key"""
+		if key in self.spans:
+			self.remove(key)
+		position = bisect.bisect_right(self.starts, start)
+		self.starts.insert(position, start)
+		self.ends.insert(position, end)
+		self.keys.insert(position, key)
+		self.spans[key] = (start, end)
+		self.tree = None
+
+
+	def remove(self, key):
+		"""Remove the interval of key"""
+		start, end = self.spans.pop(key)
+		position = bisect.bisect_left(self.starts, start)
+		while self.keys[position] != key:
+			position += 1
+		del self.starts[position]
+		del self.ends[position]
+		del self.keys[position]
+		self.tree = None
+
+
+	def update(self, key, start, end):
+		"""Change the interval of key"""
+		if self.spans.get(key) != (start, end):
+			self.add(key, start, end)
+
+
+	def build(self):
+		"""Build the tree of maximum end dates"""
+		size = 1
+		while size < len(self.ends):
+			size *= 2
+		tree = [None] * (2 * size)
+		tree[size:size + len(self.ends)] = self.ends
+		for node in range(size - 1, 0, -1):
+			left, right = tree[2 * node], tree[2 * node + 1]
+			if left is None or (right is not None and right > left):
+				left = right
+			tree[node] = left
+		self.size = size
+		self.tree = tree
+
+
+	def overlap(self, start, end):
+		"""Return the keys whose interval overlaps [start, end], sorted by start"""
+		if not self.keys:
+			return []
+		if self.tree is None:
+			self.build()
+		# Only the intervals starting before the end can overlap
+		limit = bisect.bisect_right(self.starts, end)
+		keys = []
+		self.collect(1, 0, self.size, limit, start, keys)
+		return keys
+
+
+	def collect(self, node, low, high, limit, start, keys):
+		"""Append the keys of the subtree ending after start"""
+		if low >= limit or self.tree[node] is None or self.tree[node] < start:
+			return
+		if node >= self.size:
+			keys.append(self.keys[low])
+			return
+		middle = (low + high) // 2
+		self.collect(2 * node, low, middle, limit, start, keys)
+		self.collect(2 * node + 1, middle, high, limit, start, keys)
+
+
+	def min_start(self):
+		"""First date of all intervals"""
+		return self.starts[0] if self.starts else None
+
+
+	def max_end(self):
+		"""Last date of all intervals"""
+		if not self.keys:
+			return None
+		if self.tree is None:
+			self.build()
+		return self.tree[1]
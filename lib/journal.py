@@ -0,0 +1,49 @@
+"""
+Append-only journal of the mutations made on the database.
+
+Each mutation is written as a single JSON line in a log file stored next to
+the database snapshot. The workflow replays the log on top of the snapshot
+when it is loaded, and compacts it back into the snapshot on checkpoint.
+"""
+
+import json
+import os
+
+
+class Journal:
+	"""
+	Journal is the log of the records not yet merged in the snapshot.
+	"""
+
+	def __init__(self, path):
+		"""Initialization of the instance"""
+		self.path = path
+
+
+	def records(self):
+		"""Return the list of records stored in the log"""
+		records = []
+		if not os.path.exists(self.path):
+			return records
+		with open(self.path, 'r') as log:
+			for line in log:
+				try:
+					records.append(json.loads(line))
+				except ValueError:
+					# Last line truncated by a crash during an append
+					break
+		return records
+
+
+	def append(self, record):
+		"""Write a record at the end of the log, a record is written entirely or not at all"""
+		with open(self.path, 'a') as log:
+			log.write(json.dumps(record, sort_keys=True) + '\n')
+			log.flush()
+			os.fsync(log.fileno())
+
+
+	def clear(self):
+		"""Remove the log once merged in the snapshot"""
+		if os.path.exists(self.path):
+			os.remove(self.path)
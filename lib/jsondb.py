@@ -0,0 +1,283 @@
+"""
+Read and write the JSON database project by project.
+
+The database is handled as a list of JSON fragments, one per project, so
+projects can be decoded only when needed and written back verbatim when
+they were not modified. The text produced is the same as
+json.dump(data, sort_keys=True, indent=4).
+"""
+
+import datetime
+import io
+import json
+from json.encoder import encode_basestring_ascii as encode_string
+import re
+
+
+WHITESPACE = re.compile(r'\s*')
+INDENT = ' ' * 4
+
+# Start of the projects array, and of each project in it, in the text written by dump
+PROJECTS = b'\n' + INDENT.encode() + b'"projects": ['
+MARK = b'\n' + INDENT.encode() * 2 + b'{'
+CLOSE = b'\n' + INDENT.encode() + b']'
+BLOCK = 1 << 16
+TEXT_PROJECTS, TEXT_MARK, TEXT_CLOSE = PROJECTS.decode(), MARK.decode(), CLOSE.decode()
+
+# Key of the project at the start of a line, the keys of the history are indented deeper
+FIELD = re.compile(r'\n {12}"(\w+)": ')
+
+decoder = json.JSONDecoder()
+
+
+def scan(text):
+	"""
+	Split the text of the database.
+	Return the top level data without the projects, and the list of
+	(fragment, project) for each project.
+	"""
+	data, positions = parse(text)
+	return data, [(text[start:end], project) for start, end, project in positions]
+
+
+def parse(text):
+	"""
+	Decode the text of the database.
+	Return the top level data without the projects, and the list of
+	(start, end, project) for each project.
+	"""
+	data = {}
+	projects = []
+	index = skip(text, 0)
+	expect(text, index, '{')
+	index = skip(text, index + 1)
+	while text[index] != '}':
+		key, index = decoder.raw_decode(text, index)
+		index = skip(text, index)
+		expect(text, index, ':')
+		index = skip(text, index + 1)
+		if key == 'projects':
+			index = scan_projects(text, index, projects)
+		else:
+			data[key], index = decoder.raw_decode(text, index)
+		index = skip(text, index)
+		if text[index] == ',':
+			index = skip(text, index + 1)
+	return data, projects
+
+
+def diff(old, new):
+	"""
+	Compare two versions of a database written by dump, as bytes.
+	Return the top level data of new, and the fragments of the projects of
+	old and of new between the first and the last difference, or None if
+	the texts are not laid out as dump writes them.
+	"""
+	bounds = [array(text) for text in [old, new]]
+	if None in bounds:
+		return None
+	(old_start, old_end), (new_start, new_end) = bounds
+	data = outside(new, new_start, new_end)
+	if data is None:
+		return None
+
+	old_size, new_size = old_end - old_start, new_end - new_start
+	prefix = common(old, new, old_start, new_start, min(old_size, new_size))
+	if prefix == old_size == new_size:
+		return data, [], []
+	suffix = common(old, new, old_end, new_end, min(old_size, new_size) - prefix, reverse=True)
+	# From the last project starting before the first difference, to the
+	# first project starting after the last difference
+	first = max(old.rfind(MARK, old_start, old_start + prefix) - old_start, 0)
+	fragments = []
+	for text, (start, end) in zip([old, new], bounds):
+		last = text.find(MARK, end - suffix, end)
+		region = text[start + first:last if last >= 0 else end]
+		fragments.append([
+			'{' + piece.rstrip(b',').decode('utf-8') for piece in region.split(MARK)[1:]
+		])
+	return data, fragments[0], fragments[1]
+
+
+def array(text):
+	"""
+	Start and end of the content of the projects array in the text of a
+	database written by dump, as str or bytes, or None if the text is not
+	laid out as dump writes it.
+	"""
+	projects, close = (PROJECTS, CLOSE) if isinstance(text, bytes) else (TEXT_PROJECTS, TEXT_CLOSE)
+	start = text.find(projects)
+	if start < 0:
+		return None
+	start += len(projects)
+	# The lines of a project are indented deeper than its first and last ones
+	end = start if text.startswith(close[-1:], start) else text.rfind(close)
+	if end < start:
+		return None
+	return start, end
+
+
+def outside(text, start, end):
+	"""Top level data of the text without the projects array from start to end, or None"""
+	try:
+		data = json.loads(text[:start] + text[end:].lstrip())
+	except ValueError:
+		return None
+	data.pop('projects', None)
+	return data
+
+
+def locate(text):
+	"""
+	Find the projects in the text of the database without decoding them.
+	Return the top level data without the projects, and the (start, end) of
+	the fragment of each project. A text not laid out as dump writes it is
+	decoded entirely.
+	"""
+	bounds = array(text)
+	data = outside(text, *bounds) if bounds else None
+	positions = []
+	if data is not None:
+		index, end = bounds
+		while index < end:
+			if not text.startswith(TEXT_MARK, index):
+				data = None
+				break
+			following = text.find(TEXT_MARK, index + 1, end)
+			if following < 0:
+				positions.append((index + len(TEXT_MARK) - 1, end))
+				break
+			if text[following - 1] != ',':
+				data = None
+				break
+			# Without the comma between two projects
+			positions.append((index + len(TEXT_MARK) - 1, following - 1))
+			index = following
+	if data is None:
+		data, projects = parse(text)
+		positions = [(start, end) for start, end, project in projects]
+	return data, positions
+
+
+def fields(text, start, end, keys):
+	"""
+	Values of the keys of the project text[start:end] written by dump,
+	decoded without the rest of the project. Keys not found are left out.
+	"""
+	values = {}
+	for match in FIELD.finditer(text, start, end):
+		if match.group(1) in keys:
+			values[match.group(1)] = decoder.raw_decode(text, match.end())[0]
+	return values
+
+
+def common(first, second, first_start, second_start, size, reverse=False):
+	"""
+	Length of the common part of first from first_start and of second from
+	second_start, at most size, or until these positions if reverse.
+	"""
+	def same(start, stop):
+		if reverse:
+			return first[first_start - stop:first_start - start] == \
+				second[second_start - stop:second_start - start]
+		return first[first_start + start:first_start + stop] == \
+			second[second_start + start:second_start + stop]
+	# Compared by blocks, then by bisection in the block which differs
+	length = 0
+	while length < size and same(length, min(length + BLOCK, size)):
+		length = min(length + BLOCK, size)
+	low, high = length, min(length + BLOCK, size)
+	while low < high:
+		middle = (low + high + 1) // 2
+		if same(length, middle):
+			low = middle
+		else:
+			high = middle - 1
+	return low
+
+
+def scan_projects(text, index, projects):
+	"""Append the (start, end, project) of the projects array to projects"""
+	expect(text, index, '[')
+	index = skip(text, index + 1)
+	while text[index] != ']':
+		project, end = decoder.raw_decode(text, index)
+		projects.append((index, end, project))
+		index = skip(text, end)
+		if text[index] == ',':
+			index = skip(text, index + 1)
+	return index + 1
+
+
+def skip(text, index):
+	return WHITESPACE.match(text, index).end()
+
+
+def expect(text, index, char):
+	if text[index:index + 1] != char:
+		raise ValueError("Invalid database: expected {0!r} at position {1}".format(
+			char, index)
+		)
+
+
+def encode(project):
+	"""
+	Convert a project in JSON format to its fragment in the database, the
+	dates given as datetime written in ISO format.
+	"""
+	return encode_value(project, INDENT * 2)
+
+
+def encode_value(value, indent):
+	"""
+	Text of json.dumps(value, sort_keys=True, indent=4), its lines after the
+	first indented by indent. Written here, json encodes in Python only
+	with an indent.
+	"""
+	if value.__class__ is str:
+		return encode_string(value)
+	if value.__class__ is int:
+		return int.__repr__(value)
+	if isinstance(value, datetime.datetime):
+		return '"' + value.isoformat() + '"'
+	inner = indent + INDENT
+	if isinstance(value, dict) and value:
+		return '{\n' + ',\n'.join(
+			inner + encode_string(key) + ': ' + encode_value(item, inner) \
+			for key, item in sorted(value.items())
+		) + '\n' + indent + '}'
+	if isinstance(value, (list, tuple)) and value:
+		return '[\n' + ',\n'.join(
+			inner + encode_value(item, inner) for item in value
+		) + '\n' + indent + ']'
+	return json.dumps(value)
+
+
+def dump(data, fragments, db):
+	"""Write the database with the projects given as an iterable of fragments to the file db"""
+	data = dict(data)
+	data['projects'] = None
+	db.write('{\n')
+	for index, key in enumerate(sorted(data)):
+		if index:
+			db.write(',\n')
+		db.write(INDENT + json.dumps(key) + ': ')
+		if key != 'projects':
+			db.write(json.dumps(data[key], sort_keys=True, indent=4).replace('\n', '\n' + INDENT))
+		else:
+			# Fragments are spliced in the output one by one, as they come
+			db.write('[')
+			separator = '\n'
+			for fragment in fragments:
+				db.write(separator + INDENT * 2)
+				db.write(fragment)
+				separator = ',\n'
+			db.write(']' if separator == '\n' else '\n' + INDENT + ']')
+	db.write('\n}')
+
+
+def dumps(data, fragments):
+	"""Return the text of the database with the projects given as fragments"""
+	output = io.StringIO()
+	dump(data, fragments, output)
+	return output.getvalue()
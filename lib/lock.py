@@ -0,0 +1,76 @@
+"""
+Advisory lock of the database shared by several pm processes.
+
+The lock is taken on a file next to the database, with fcntl on Unix and
+msvcrt on Windows. It is only respected by the pm processes.
+"""
+
+import contextlib
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	import msvcrt
+
+
+class FileLock:
+	"""
+	FileLock is a reentrant lock of a file, exclusive or shared.
+	"""
+
+	def __init__(self, path):
+		"""Initialization of the instance"""
+		self.path = path
+		self.file = None
+		self.depth = 0
+
+
+	def acquire(self, shared=False):
+		"""Wait for the lock, shared between the readers or exclusive"""
+		if self.depth == 0:
+			self.file = open(self.path, 'a+')
+			if fcntl:
+				fcntl.flock(self.file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+			else:
+				# No shared lock on Windows
+				self.file.seek(0)
+				while True:
+					try:
+						msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+						break
+					except OSError:
+						# Still locked after 10 seconds
+						continue
+		self.depth += 1
+
+
+	def release(self):
+		self.depth -= 1
+		if self.depth == 0:
+			if fcntl:
+				fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+			else:
+				self.file.seek(0)
+				msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+			self.file.close()
+			self.file = None
+
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+
+	def __exit__(self, *exc):
+		self.release()
+
+
+	@contextlib.contextmanager
+	def shared(self):
+		"""Context manager of the shared lock, the lock kept if already held"""
+		self.acquire(shared=True)
+		try:
+			yield self
+		finally:
+			self.release()
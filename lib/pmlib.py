@@ -3,91 +3,590 @@ This module include all class objects used
 for the management project system MP.
 """
 
-import json
-import datetime
+import contextlib
 import copy
+import csv
+import datetime
+import heapq
+import json
+import os
 
 # Load settings of the lib
 import settings
+from lib.journal import Journal
+from lib.lock import FileLock
+from lib.project import Project, parse_date
+from lib.storage import JsonStorage
+from lib.aggregate import Aggregation
+from lib.interval import IntervalIndex
+from lib.views import SortedView
+from lib.series import Series
+from lib.search import SearchIndex
+import lib.search as search
+import lib.series as series
+import lib.query as query
+import lib.render as render
+import lib.timing as timing
+
 
 class Workflow:
 	"""
 	Workflow is the interface that manages all projects.
 	"""
 
-	def __init__(self, db_path):
+	def __init__(self, db_path, journal=settings.JOURNAL, cache=settings.CACHE,
+				 lazy=False, storage=None):
 		"""Initialization of the instance"""
 		# Attributes
 		self.db_path = db_path
-		with open(self.db_path, 'r') as db:
-			self.json = json.load(db)
-		self.projects = []
-		self.projects_done = []
+		self.storage = storage or JsonStorage(self.db_path, cache=cache)
+		self._projects = []
+		self._projects_done = []
+
+		# Lazy mode: projects are built only when a command needs them
+		self.lazy = lazy
+		self.index = {}			# Light description of every project by id
+		self.by_id = {}			# Projects built, by id
+
+		# Interval index of the projects spans, built on first use
+		self._intervals = None
+
+		# Sorted views of the projects loaded by key, built on first use
+		self.views = {}
+
+		# Rollups of the projects per period, by unit, read or built on first
+		# use, and the key of the stamp and units of the rollups stored
+		self.rollups = {}
+		self.rollups_stored = None
+
+		# Arrays of the histories for the funnel, built on first use
+		self._funnel = None
+
+		# Inverted index of the texts, read on first use
+		self._search = None
+
+		# Date of the projects of a snapshot (see as_of), None for the current ones
+		self.as_of_date = None
+
+		# Journal of the mutations not yet merged in the database
+		self.journal = Journal(self.db_path + settings.JOURNAL_EXT)
+		self.journaling = journal and self.storage.JOURNAL
+		self.journal_size = 0
+
+		# Records of the transaction in progress, persisted together
+		self.batch = None
+
+		# Lock shared with the other processes writing the database, and
+		# mutations not written yet, applied again if the database changed
+		self.lock = FileLock(self.db_path + settings.LOCK_EXT)
+		self.pending = []
 
 		# Load
-		for project in self.json['projects']:
-			project_history_sorted = sorted(
-				project['history'], key=lambda k: k['date']
-			)
-			project_obj = Project(
-				project['name'], project['type'], project['money'],
-				id=project['id'], history=project_history_sorted,
-				money_year=project['money_year'], pi=project['pi'],
-				summary=project['summary'], ref=project['ref']
+		self.reload()
+
+
+	@property
+	def projects(self):
+		self.hydrate()
+		return self._projects
+
+
+	@projects.setter
+	def projects(self, projects):
+		self._projects = projects
+
+
+	@property
+	def projects_done(self):
+		self.hydrate()
+		return self._projects_done
+
+
+	@projects_done.setter
+	def projects_done(self, projects):
+		self._projects_done = projects
+
+
+	def load(self):
+		"""Read the projects, or only their index in lazy mode, from the storage"""
+		if self.lazy:
+			self.json, self.index = self.storage.load_index()
+		else:
+			self.json, self._projects = self.storage.load()
+			self.by_id = {project.id: project for project in self._projects}
+		self.seq = self.json.get('journal_seq', 0)
+
+
+	@property
+	def intervals(self):
+		"""Interval index of the span (first and last date) of each project"""
+		if self._intervals is None:
+			self._intervals = IntervalIndex([
+				(project,) + project.span() for project in self.projects + self.projects_done
+			])
+		return self._intervals
+
+
+	def reindex(self, project):
+		"""Update the indexes after a change of the project"""
+		if self._intervals is not None:
+			self._intervals.update(project, *project.span())
+		for view in self.views.values():
+			view.update(project)
+		for rollup in self.rollups.values():
+			rollup.update(project)
+		self._funnel = None
+		if self._search is not None:
+			self._search.update(project)
+
+		# Move the project between ongoing and done projects
+		if project.done:
+			source, target = self._projects, self._projects_done
+		else:
+			source, target = self._projects_done, self._projects
+		if project in source:
+			source.remove(project)
+			target.append(project)
+		if self.lazy:
+			self.index[project.id]['done'] = project.done
+
+
+	def hydrate(self, id=None, done=None):
+		"""
+		Build the projects not loaded yet (lazy mode): only the project id,
+		only the projects done or ongoing, or all of them.
+		"""
+		if not self.lazy or len(self.by_id) == len(self.index):
+			return
+		if id is not None:
+			ids = [id] if id in self.index and id not in self.by_id else []
+		else:
+			ids = [
+				project_id for project_id, entry in self.index.items() \
+				if project_id not in self.by_id \
+				and (done is None or entry['done'] == done)
+			]
+		if not ids:
+			return
+		with timing.phase('hydrate'):
+			self.build(ids)
+
+
+	def build(self, ids):
+		"""Add the projects of ids read from the storage"""
+		for project in self.storage.fetch(ids):
+			self.by_id[project.id] = project
+			if not self.index[project.id]['done']:
+				self._projects.append(project)
+			else:
+				self._projects_done.append(project)
+			for view in self.views.values():
+				view.add(project)
+			for rollup in self.rollups.values():
+				rollup.add(project)
+		self._funnel = None
+
+
+	def as_of(self, date):
+		"""
+		Return a copy of the workflow with the projects as they were at date,
+		to read only: the last action of each project at date is found by
+		bisection in its history. Projects started after date are left out.
+		"""
+		self.hydrate()
+		snapshot = copy.copy(self)
+		projects = [project.as_of(date) for project in self._projects + self._projects_done]
+		snapshot._projects = [project for project in projects if project is not None]
+		snapshot._projects_done = []
+		snapshot.classify()
+		snapshot.lazy = False
+		snapshot.index = {}
+		snapshot.by_id = {project.id: project for project in snapshot._projects + snapshot._projects_done}
+		snapshot._intervals = None
+		snapshot.views = {}
+		snapshot.rollups = {}
+		snapshot._funnel = None
+		snapshot._search = None
+		snapshot.pending = []
+		snapshot.as_of_date = date
+		return snapshot
+
+
+	def today(self):
+		"""Date the dashboards are computed at: now, or the date of the snapshot"""
+		return self.as_of_date or datetime.datetime.now()
+
+
+	def classify(self):
+		"""Split projects between ongoing and done"""
+		projects = self._projects + self._projects_done
+		self._projects = []
+		self._projects_done = []
+		for project in projects:
+			if not project.done:
+				self._projects.append(project)
+			else:
+				self._projects_done.append(project)
+
+
+	def replay(self):
+		"""Apply the records of the journal on top of the database"""
+		for record in self.journal.records():
+			if record['seq'] <= self.seq:
+				# Already merged in the database by a checkpoint
+				continue
+			self.apply(record)
+			self.seq = record['seq']
+			self.journal_size += 1
+
+
+	def apply(self, record):
+		"""Apply a mutation record to the projects in memory"""
+		if record['op'] == 'batch':
+			for item in record['records']:
+				self.apply(item)
+			return
+		if record['op'] == 'add_project':
+			# The record is left as is, it may still be written in the journal
+			history = [dict(hist) for hist in record['project']['history']]
+			project = Project.loads(dict(record['project'], history=history))
+			project.touch()
+			self.append(project)
+			return
+
+		project = self.find_project(record['id'])
+		if not project:
+			return
+		if record['op'] == 'rm':
+			self.remove(project)
+			return
+		if record['op'] == 'add_action':
+			project.add_action(
+				record['status'], record['comment'], date=parse_date(record['date'])
 			)
-			if 'Done' not in [hist['status'] for hist in project['history']]:
-				self.projects.append(project_obj)
+		elif record['op'] == 'rm_action':
+			project.del_action(record['node'])
+		elif record['op'] == 'update_action':
+			params = dict(record['params'])
+			if 'date' in params:
+				params['date'] = parse_date(params['date'])
+			project.update_action(record['node'], params)
+		elif record['op'] == 'update':
+			for key, value in record['params'].items():
+				setattr(project, key, value)
+			project.touch()
+		self.reindex(project)
+
+
+	def commit(self, record):
+		"""Persist a mutation, either in the journal or in the database"""
+		if self.batch is not None:
+			# Persisted at the end of the transaction
+			self.batch.append(record)
+			return
+		self.persist([record])
+
+
+	def persist(self, records):
+		"""
+		Write the mutations in the journal, or the database, under the lock.
+		If another process changed the database since it was read, it is read
+		again and the mutations are applied on top of it.
+		"""
+		self.pending += records
+		with self.lock:
+			self.refresh()
+			if not self.journaling or \
+				self.journal_size + len(self.pending) >= settings.JOURNAL_CHECKPOINT:
+				self.save()
+				return
+			if len(self.pending) == 1:
+				record = self.pending[0]
+			else:
+				# A single line of the journal, replayed entirely or not at all
+				record = {'op': 'batch', 'records': self.pending}
+			self.seq += 1
+			record['seq'] = self.seq
+			self.journal.append(record)
+			self.journal_size += 1
+			before, self.stamp = self.stamp, self.file_stamp()
+			self.log_changes(before, self.record_ids(self.pending))
+			self.pending = []
+
+
+	@contextlib.contextmanager
+	def transaction(self):
+		"""
+		Persist all the mutations made in the block at once, or none of them
+		if an exception is raised: the projects are then read again.
+		"""
+		self.batch = []
+		try:
+			yield self
+		except BaseException:
+			self.batch = None
+			self.reload()
+			raise
+		records, self.batch = self.batch, None
+		if records:
+			self.persist(records)
+
+
+	def file_stamp(self):
+		"""Modification time and size of the database and of its journal"""
+		stamp = []
+		for path in [self.db_path, self.journal.path]:
+			try:
+				stat = os.stat(path)
+				stamp.append((stat.st_mtime_ns, stat.st_size))
+			except OSError:
+				stamp.append(None)
+		return stamp
+
+
+	def reload(self):
+		"""Discard the changes in memory and read the projects again"""
+		self._projects = []
+		self._projects_done = []
+		self.index = {}
+		self.by_id = {}
+		self._intervals = None
+		self.views = {}
+		self.rollups = {}
+		self.rollups_stored = None
+		self._funnel = None
+		self._search = None
+		self.journal_size = 0
+		self.pending = []
+		with timing.phase('load'):
+			with self.lock.shared():
+				self.stamp = self.file_stamp()
+				with timing.phase('read'):
+					self.load()
+				with timing.phase('replay'):
+					self.replay()
+			self.classify()
+
+
+	def refresh(self):
+		"""
+		Read the projects again if another process changed the database, and
+		apply the pending mutations on top of them.
+		"""
+		if self.file_stamp() == self.stamp:
+			return
+		pending = self.pending
+		self.reload()
+		self.pending = pending
+		ids = {}
+		for record in pending:
+			self.renumber(record, ids)
+			self.apply(record)
+
+
+	@classmethod
+	def record_ids(cls, records):
+		"""Ids of the projects changed by the records"""
+		ids = set()
+		for record in records:
+			if record['op'] == 'batch':
+				ids |= cls.record_ids(record['records'])
+			elif record['op'] == 'add_project':
+				ids.add(record['project']['id'])
 			else:
-				self.projects_done.append(project_obj)
+				ids.add(record['id'])
+		return ids
+
+
+	def log_changes(self, before, ids):
+		"""Note the projects changed for the search index and the rollups, if stored"""
+		for path in [self.db_path + settings.SEARCH_EXT, self.db_path + settings.SERIES_EXT]:
+			if os.path.exists(path):
+				search.log(path + settings.JOURNAL_EXT, before, self.stamp, ids)
+
+
+	def renumber(self, record, ids):
+		"""Give a new id to a pending project whose id was taken by another process"""
+		if record['op'] == 'add_project':
+			id = record['project']['id']
+			if id in self.index or id in self.by_id:
+				ids[id] = record['project']['id'] = self.next_id()
+		elif record.get('id') in ids:
+			record['id'] = ids[record['id']]
+
+
+	def checkpoint(self):
+		"""Compact the journal in a new snapshot of the database"""
+		self.save()
+
+
+	# Sort keys of the projects, the largest first except for id and name
+	SORTS = {
+		'date': (lambda project: project.last_date, True),
+		'status': (lambda project: len(settings.PROGRESS[project.status]), True),
+		'name': (lambda project: project.name, False),
+		'ref': (lambda project: project.ref, True),
+		'id': (lambda project: project.id, False)
+	}
+
+	def sort_key(self, key):
+		"""Return the function giving the value of key of a project, and whether the largest are first"""
+		return self.SORTS.get(key, (lambda project: getattr(project, key), True))
+
+
+	def view(self, key):
+		"""Sorted view of the projects loaded (see hydrate) on key"""
+		view = self.views.get(key)
+		if view is None:
+			function, reverse = self.sort_key(key)
+			view = self.views[key] = SortedView(
+				function, reverse, self._projects + self._projects_done
+			)
+		return view
 
 
 	def sort_projects(self, key='date'):
-		def sort(k):
-			if key == 'date':
-				return k.history[-1]['date']
-			if key == 'status':
-				return len(settings.PROGRESS[k.history[-1]['status']])
-			if key == 'name':
-				return k.name
-			if key == 'ref':
-				return k.ref
-			if key == 'id':
-				return k.id
-			else:
-				return getattr(k, key)
-		self.projects = sorted(
-			self.projects, key=sort, reverse=key not in ['id', 'name']
-		)
-		self.projects_done = sorted(
-			self.projects_done, key=sort, reverse=key not in ['id', 'name']
-		)
+		"""Return the ongoing and the done projects loaded, sorted on key"""
+		with timing.phase('sort'):
+			view = self.view(key)
+			return (
+				[project for project in view if not project.done],
+				[project for project in view if project.done]
+			)
+
+
+	def append(self, project):
+		"""Add a new project to the workflow"""
+		self._projects.append(project)
+		self.by_id[project.id] = project
+		if self.lazy:
+			self.index[project.id] = {
+				'id': project.id, 'name': project.name,
+				'type': project.type, 'done': False
+			}
+		self.reindex(project)
+
+
+	def remove(self, project):
+		"""Remove a project from the workflow"""
+		for project_data in [self._projects, self._projects_done]:
+			if project in project_data:
+				project_data.remove(project)
+		if self._intervals is not None and project in self._intervals:
+			self._intervals.remove(project)
+		for view in self.views.values():
+			view.remove(project)
+		for rollup in self.rollups.values():
+			rollup.remove(project.id)
+		self._funnel = None
+		if self._search is not None:
+			self._search.remove(project.id)
+		self.by_id.pop(project.id, None)
+		if self.lazy:
+			self.index.pop(project.id, None)
+
+
+	def replace(self, records, removed=()):
+		"""
+		Build again the projects of the (fragment, project in JSON format)
+		read from the database, and remove the projects of the ids removed.
+		"""
+		for id in removed:
+			project = self.by_id.get(id)
+			if project is not None:
+				self.remove(project)
+		for fragment, record in records:
+			project = Project.loads(record)
+			if not project.dirty:
+				project.fragment = fragment
+			previous = self.by_id.get(project.id)
+			if previous is not None:
+				self.remove(previous)
+			self.append(project)
 
 
 	def find_project(self, id):
 		"""Return the project found in the workflow"""
-		projects = self.projects + self.projects_done
-		for project in projects:
-			if project.id == id:
-				return project
-
+		if self.lazy:
+			self.hydrate(id)
+		return self.by_id.get(id)
+
+
+	def select(self, all=None, key='status', where=None, top=None, limit=None, offset=0):
+		"""
+		Return the projects of the dashboard sorted on key: the ongoing ones,
+		or all of them with the done ones first, matching the conditions of
+		where (see lib/query.py), only the top first ones if given, and the
+		limit projects from offset if a limit is given.
+		"""
+		# Build and sort projects
+		self.hydrate(done=None if all else False)
+		if not where and top is None:
+			projects, projects_done = self.sort_projects(key=key)
+			# All projects vs ongoing projects only
+			selected = projects_done + projects if all else projects
+		else:
+			view = self.view(key)
+			projects = self.filter(where or [], all=all)
+			# Done projects first, then in the order of the view
+			if view.reverse:
+				order = lambda project: (project.done, view.entries[project])
+			else:
+				order = lambda project: (not project.done, view.entries[project])
+			if top is not None:
+				# Partial selection, the other projects are not sorted
+				first = heapq.nlargest if view.reverse else heapq.nsmallest
+				selected = first(top, projects, key=order)
+			else:
+				selected = sorted(projects, key=order, reverse=view.reverse)
+		if limit is not None or offset:
+			selected = selected[offset:None if limit is None else offset + limit]
+		return selected
+
+
+	def filter(self, conditions, all=None):
+		"""
+		Return the projects loaded matching the conditions (see lib/query.py),
+		the done ones only with all. The candidates are the projects found by
+		bisection in the view of the most selective condition.
+		"""
+		keys = {}
+		candidates = None
+		for key, op, value in conditions:
+			keys[key] = self.sort_key(key)[0]
+			if op not in query.RANGES:
+				continue
+			view = self.view(key)
+			start, stop = view.bounds(
+				low=value if op in ['=', '>', '>='] else None,
+				high=value if op in ['=', '<', '<='] else None,
+				include_low=op != '>', include_high=op != '<'
+			)
+			if candidates is None or stop - start < len(candidates):
+				candidates = view.projects[start:stop]
+		if candidates is None:
+			candidates = self._projects + self._projects_done
+		return [
+			project for project in candidates \
+			if (all or not project.done) and query.test(conditions, keys, project)
+		]
 
-	def status_api(self, all=None, key='status'):
-		"""List all the projects ongoing and returns a context"""
 
-		# Sort projects
-		self.sort_projects(key=key)
-		
-		# All projects vs ongoing projects only
-		if all:
-			temp_projects = self.projects_done + self.projects
-		else:
-			temp_projects = self.projects
+	def status_api(self, all=None, key='status', limit=None, offset=0, where=None, top=None):
+		"""
+		List all the projects ongoing and returns a context, of the limit
+		projects from offset if a limit is given.
+		"""
+		temp_projects = self.select(
+			all=all, key=key, where=where, top=top, limit=limit, offset=offset
+		)
+		now = self.today()
 
 		context = []
 		# Display projects
 		for project in temp_projects:
 			project_last_node = project.history[-1]
-			time_bet_action = (datetime.datetime.now() - project_last_node['date']).days + 1
+			time_bet_action = (now - project.last_date).days + 1
 
 			# Trunc comment if too long (>settings.WIDTH)
 			comment = self.truncate(project_last_node['comment'])
@@ -95,7 +594,7 @@ class Workflow:
 			# Color
 			color = ''
 			end_color = ''
-			if all and project.history[-1]["status"] == 'Done':
+			if all and project.status == 'Done':
 				color = '\033[92m'
 				end_color = '\033[0m'
 			else:
@@ -107,11 +606,9 @@ class Workflow:
 				'id': project.id,
 				'name': project.name[:12],
 				'type': project.type,
-				'status': project_last_node['status'],
-				'progress': settings.PROGRESS[project_last_node['status']],
-				'date': datetime.datetime.strftime(
-					project_last_node['date'], '%d/%m/%Y'
-				),
+				'status': project.status,
+				'progress': settings.PROGRESS[project.status],
+				'date': datetime.datetime.strftime(project.last_date, '%d/%m/%Y'),
 				'comment':comment,
 				'color': color,
 				'end_color': end_color,
@@ -125,82 +622,147 @@ class Workflow:
 		return context
 
 
-	def status(self, all=None, key='status', extended=False):
+	def status(self, all=None, key='status', extended=False, limit=None, offset=0,
+			   where=None, top=None):
 		"""Display all the status dashboard"""
-		print("-" * settings.WIDTH)
+		lines = self.status_lines(
+			all=all, key=key, extended=extended, limit=limit, offset=offset, where=where, top=top
+		)
+		with timing.phase('render'):
+			render.write(lines)
+
+
+	def status_lines(self, all=None, key='status', extended=False, limit=None, offset=0,
+					 where=None, top=None):
+		"""Return the lines of the status dashboard"""
+		lines = ["-" * settings.WIDTH]
 		
 		# Load context 
-		context = self.status_api(all=all, key=key)
+		with timing.phase('status_api'):
+			context = self.status_api(
+				all=all, key=key, limit=limit, offset=offset, where=where, top=top
+			)
+		if self.as_of_date:
+			lines.append("  As of {0}".format(self.as_of_date.strftime('%d/%m/%Y')))
+			lines.append("-" * settings.WIDTH)
 		for project_context in context:
 			if not extended:
-				print("{color}#{id:<2} {name:<12}  {type:<4} |{progress:<6}| " \
+				lines.append("{color}#{id:<2} {name:<12}  {type:<4} |{progress:<6}| " \
 					  "{comment}{end_color}".format(**project_context))
 			else:
-				print("{color}#{id:<2} {name:<12}  {type:<4} {status:<5} |{progress:<6}| " \
+				lines.append("{color}#{id:<2} {name:<12}  {type:<4} {status:<5} |{progress:<6}| " \
 					  "{date:<10} {money:>4} {money_year:>3}kE {pi:<12} {ref:<12} {end_color}".format(**project_context))
 			
-		print("-" * settings.WIDTH)
+		lines.append("-" * settings.WIDTH)
+		return lines
 
 	
+	# Fields of the dashboard in JSON and CSV
+	STATUS_FIELDS = [
+		'id', 'name', 'type', 'status', 'done', 'date', 'stale', 'comment',
+		'money', 'money_year', 'pi', 'ref'
+	]
+
+	def status_records(self, all=None, key='status', limit=None, offset=0, where=None, top=None):
+		"""Return the projects of the dashboard as records of STATUS_FIELDS, with full texts"""
+		now = self.today()
+		return [{
+			'id': project.id,
+			'name': project.name,
+			'type': project.type,
+			'status': project.status,
+			'done': project.done,
+			'date': project.last_date.isoformat(),
+			'stale': (now - project.last_date).days,
+			'comment': project.history[-1]['comment'],
+			'money': project.money,
+			'money_year': project.money_year,
+			'pi': project.pi,
+			'ref': project.ref
+		} for project in self.select(
+			all=all, key=key, where=where, top=top, limit=limit, offset=offset
+		)]
+
+
+	def dump_status(self, format, file, **options):
+		"""Write the dashboard in format 'json' or 'csv' (options of status_records)"""
+		records = self.status_records(**options)
+		if format == 'json':
+			json.dump(records, file, indent=4)
+			file.write('\n')
+		else:
+			writer = csv.DictWriter(file, fieldnames=self.STATUS_FIELDS, lineterminator='\n')
+			writer.writeheader()
+			writer.writerows(records)
+
+
 	@staticmethod
 	def truncate(txt, width=settings.WIDTH, indent=32):
-		import pdb
-		tmp = ''
-		output = []
-		for index, word in enumerate(txt.split()):
-			if len(tmp) + len(word) < width - indent:
-				tmp += ' ' + word
-				if index == len(txt.split()) - 1:
-					output.append(tmp.strip())
-					break
-			else:
-				output.append(tmp.strip()) 
-				tmp = word
-		return ('\n' + (' ' * indent)).join(output)
+		"""Wrap a comment in lines of the width of the dashboard"""
+		return render.wrap(txt, width, indent)
 
 
 
-	def add_project(self, name, type, money):
-		# Find id available
-		ids = [project.id for project in self.projects + self.projects_done]
-		new_id = max(ids) + 1 if ids else 1
+	def next_id(self):
+		"""Find id available"""
+		ids = self.index if self.lazy else self.by_id
+		return max(ids) + 1 if ids else 1
 
+
+	def add_project(self, name, type, money):
 		# Create new project
-		new_project = Project(name, type, money, id=new_id, history=[])
-		self.projects.append(new_project)
-		self.sort_projects()
-		self.save()
+		new_project = Project(name, type, money, id=self.next_id(), history=[])
+		self.append(new_project)
+		self.commit({'op': 'add_project', 'project': new_project.dumps()})
 
 
 	def save(self):
 		"""Write to database"""
-		self.json["projects"] = [
-			project.dumps() for project in self.projects + self.projects_done
-		]
-		with open(self.db_path, 'w') as db:
-			json.dump(self.json, db, sort_keys=True, indent=4)	# Write JSON format to database
+		with self.lock, timing.phase('save'):
+			self.refresh()
+			# Projects changed, for the search index
+			changed = self.record_ids(self.pending) | {
+				id for id, project in self.by_id.items() if project.dirty
+			}
+			if self.seq:
+				self.json["journal_seq"] = self.seq
+			if self.lazy:
+				# Projects not built are left untouched by the storage
+				for id, project in self.by_id.items():
+					self.index[id].update(name=project.name, type=project.type, done=project.done)
+				self.storage.save(self.json, list(self.by_id.values()), list(self.index))
+			else:
+				projects = self.projects + self.projects_done
+				self.storage.save(self.json, projects, [project.id for project in projects])
+
+			# The snapshot now includes every record of the journal
+			self.journal.clear()
+			self.journal_size = 0
+			self.pending = []
+			before, self.stamp = self.stamp, self.file_stamp()
+			self.log_changes(before, changed)
 
 
 	def rm(self, id):
 		"""Delete project of the database"""
-		projects = [self.projects, self.projects_done]
-		for project_data in projects:
-			for project in project_data:
-				if project.id == id:
-					project_data.remove(project)
-					self.save()
-					print("{} was deleted".format(project))
-					break
-					break
+		project = self.find_project(id)
+		if project:
+			self.remove(project)
+			self.commit({'op': 'rm', 'id': id})
+			print("{} was deleted".format(project))
 
 
 	def add_action(self, id, status="", comment="-"):
 		project = self.find_project(id)
 		if project:
 			if not status:
-				status = project.history[-1]["status"]
-			project.add_action(status, comment)
-			self.save()
+				status = project.status
+			hist = project.add_action(status, comment)
+			self.reindex(project)
+			self.commit({
+				'op': 'add_action', 'id': id, 'status': status,
+				'comment': comment, 'date': hist['date'].isoformat()
+			})
 			if status == "Done":
 				print("Congrats, one more project done !")
 			else:
@@ -211,11 +773,13 @@ class Workflow:
 		project = self.find_project(project_id)
 		if project:
 			if node:
-				project.del_action(int(node))
+				node = int(node)
 			else:
 				# Delete last action
-				project.del_action(project.history[-1]["node"])
-			self.save()
+				node = project.history[-1]["node"]
+			project.del_action(node)
+			self.reindex(project)
+			self.commit({'op': 'rm_action', 'id': project_id, 'node': node})
 			self.history(project_id)
 			print("Commit removed.")
 
@@ -224,70 +788,164 @@ class Workflow:
 		project = self.find_project(project_id)
 		if project:
 			if node:
-				project.update_action(int(node), params)
+				node = int(node)
 			else:
 				# Update last action
-				project.update_action(project.history[-1]['node'], params)
-			self.save()
+				node = project.history[-1]['node']
+			project.update_action(node, params)
+			self.reindex(project)
+			record_params = dict(params)
+			if 'date' in record_params:
+				record_params['date'] = record_params['date'].isoformat()
+			self.commit({
+				'op': 'update_action', 'id': project_id, 'node': node,
+				'params': record_params
+			})
 			self.history(project_id)
 			print("Commit updated.")
 
 
-	def history_api(self, id):
-		for project in self.projects + self.projects_done:
-			if project.id == id:
-				context = {
-					'name': project.name,
-					'type': project.type,
-					'id': project.id,
-					'money': project.money,
-					'duration': self.duration(
-						project.history[0]["date"], project.history[-1]["date"]
+	def update_project(self, id, params):
+		"""Update the information of a project"""
+		project = self.find_project(id)
+		if project:
+			for key, value in params.items():
+				setattr(project, key, value)
+			project.touch()
+			self.reindex(project)
+			self.commit({'op': 'update', 'id': id, 'params': params})
+
+
+	def migrate(self, storage):
+		"""Copy all projects, with the records of the journal, to another storage"""
+		with self.lock:
+			self.refresh()
+			projects = self.projects + self.projects_done
+			if self.seq:
+				self.json["journal_seq"] = self.seq
+			with FileLock(storage.path + settings.LOCK_EXT):
+				storage.save(self.json, projects, [project.id for project in projects], full=True)
+				# A journal left next to the storage predates the copy, not to be replayed on it
+				if storage.JOURNAL:
+					Journal(storage.path + settings.JOURNAL_EXT).clear()
+
+
+	def check(self, rebuild=False):
+		"""Verify the fields derived from the history, and rebuild them"""
+		errors = 0
+		with self.lock:
+			# Check the last version of the database
+			self.refresh()
+			for project in sorted(self.projects + self.projects_done, key=lambda k: k.id):
+				fields = project.verify()
+				if fields:
+					errors += 1
+					print("#{0:<3} {1:<12} wrong {2}".format(
+						project.id, project.name[:12], ', '.join(fields))
 					)
-				}
-				if project.pi or project.money_year:
-					context['pi'] = project.pi
-					context['money_year'] = project.money_year
-				if project.ref:
-					context['ref'] = project.ref
-				if project.summary:
-					context['summary'] = project.summary
-
-				context['history'] = []
-				for index, hist in enumerate(project.history):
-					if index == 0:
-						days = '--'
-					else:
-						diff = hist['date'] - project.history[index-1]['date']
-						days = str(diff.days) + 'd'
-					context['history'].append({
-						'date': datetime.datetime.strftime(hist['date'], '%d/%m/%Y'),
-						'status': hist['status'],
-						'comment': self.truncate(hist['comment'], indent=42),
-						'progress': settings.PROGRESS[hist['status']],
-						'days': days,
-						'node': hist["node"]
-					})
-				break
+					if rebuild:
+						project.rebuild()
+						project.touch()
+			if rebuild:
+				self._intervals = None
+				self.views = {}
+				self.classify()
+				self.save()
+				print("Database rebuilt.")
+			elif not errors:
+				print("Database OK.")
+		return errors
+
+
+	def history_api(self, id):
+		project = self.find_project(id)
+		if project:
+			return self.project_history_api(project)
+
+
+	def history_all_api(self, limit=None, offset=0):
+		"""Yield the history context of every project, by id, of the limit projects from offset"""
+		self.hydrate()
+		ids = sorted(self.by_id)[offset:None if limit is None else offset + limit]
+		for id in ids:
+			yield self.project_history_api(self.by_id[id])
+
+
+	def project_history_api(self, project):
+		"""Return the history context of a project"""
+		context = {
+			'name': project.name,
+			'type': project.type,
+			'id': project.id,
+			'money': project.money,
+			'duration': self.duration(project.first_date, project.last_date)
+		}
+		if project.pi or project.money_year:
+			context['pi'] = project.pi
+			context['money_year'] = project.money_year
+		if project.ref:
+			context['ref'] = project.ref
+		if project.summary:
+			context['summary'] = project.summary
+
+		context['history'] = []
+		for index, hist in enumerate(project.history):
+			if index == 0:
+				days = '--'
+			else:
+				diff = hist['date'] - project.history[index-1]['date']
+				days = str(diff.days) + 'd'
+			context['history'].append({
+				'date': datetime.datetime.strftime(hist['date'], '%d/%m/%Y'),
+				'status': hist['status'],
+				'comment': self.truncate(hist['comment'], indent=42),
+				'progress': settings.PROGRESS[hist['status']],
+				'days': days,
+				'node': hist["node"]
+			})
 		return context
 
 
 	def history(self, id):
 		context = self.history_api(id)
-		print("-" * settings.WIDTH)
-		print("Project #{id:<2}  {name:<10} {type:<3}  {money:>4} " \
+		if context is None:
+			print("Error: project #{0} not found".format(id))
+		else:
+			self.print_history(context)
+
+
+	def history_all(self, limit=None, offset=0):
+		"""Display the history of every project, each one written once computed"""
+		with timing.phase('render'):
+			render.write(
+				line for context in self.history_all_api(limit=limit, offset=offset) \
+				for line in self.history_lines(context)
+			)
+
+
+	@staticmethod
+	def print_history(context):
+		render.write(Workflow.history_lines(context))
+
+
+	@staticmethod
+	def history_lines(context):
+		"""Lines of the history dashboard of a project"""
+		lines = ["-" * settings.WIDTH]
+		lines.append("Project #{id:<2}  {name:<10} {type:<3}  {money:>4} " \
 			  "kEUR  Duration:{duration:<9}".format(**context))
 		if context.get('pi') or context.get('money_year'):
-			print("             Current year:  {money_year:>5} kEUR  PI: {pi:<7}".format(**context))
+			lines.append("             Current year:  {money_year:>5} kEUR  PI: {pi:<7}".format(**context))
 		if context.get('ref'):
-			print("             Ref: {ref:<12}".format(**context))
+			lines.append("             Ref: {ref:<12}".format(**context))
 		if context.get('summary'):
-			print("             {summary}".format(**context))
-			print("-" * settings.WIDTH)
+			lines.append("             {summary}".format(**context))
+			lines.append("-" * settings.WIDTH)
 		for hist in context['history']:
-			print("  {node:>2}   {date:<11} {days:>5}  {status:<5} "\
+			lines.append("  {node:>2}   {date:<11} {days:>5}  {status:<5} "\
 				  "|{progress:<6}|  {comment:<35}".format(**hist))
-		print("-" * settings.WIDTH)
+		lines.append("-" * settings.WIDTH)
+		return lines
 
 
 	@staticmethod
@@ -304,254 +962,377 @@ class Workflow:
 			return "{:2.0f} months".format(days/30)
 
 
-	def stats(self, start_date=None, end_date=None):
+	def stats_periods(self, periods):
+		"""Compute the statistics of several periods in one pass and returns a context per period"""
+		if self.lazy and self.storage.INDEXED:
+			# Aggregated by the storage, without building the projects
+			aggregation = Aggregation(['family', 'done'], ['money', 'money_year', 'days'])
+			for period, (start_date, end_date) in enumerate(periods):
+				for type, done, count, money, money_year, days in \
+					self.storage.groups(start_date, end_date):
+					aggregation.merge(
+						(period, settings.CONTRACT_FAMILIES.get(type), done),
+						count, [money, money_year, days]
+					)
+		else:
+			done = set(self.projects_done)
+			aggregation = Aggregation(
+				dimensions={
+					'family': lambda project: settings.CONTRACT_FAMILIES.get(project.type),
+					'done': lambda project: project in done
+				},
+				metrics={
+					'money': lambda project: project.money,
+					'money_year': lambda project: project.money_year,
+					'days': lambda project: (project.last_date - project.first_date).days
+				},
+				periods=periods,
+				index=self.intervals
+			).run()
+
+		contexts = []
+		for period, (start_date, end_date) in enumerate(periods):
+			nb_projects = aggregation.count(period=period)
+			nb_active_projects = aggregation.count(period=period, done=False)
+			nb_license = aggregation.count(period=period, family='license')
+			nb_license_ongoing = aggregation.count(
+				period=period, family='license', done=False
+			)
+			nb_rnd = aggregation.count(period=period, family='rnd')
+			nb_rnd_ongoing = aggregation.count(period=period, family='rnd', done=False)
+			contexts.append({
+				'start_date': start_date,
+				'end_date': end_date,
+
+				# Number of projects
+				'nb_projects': nb_projects,
+				'nb_active_projects': nb_active_projects,
+				'nb_done_projects': nb_projects - nb_active_projects,
+				'nb_license': nb_license,
+				'nb_license_ongoing': nb_license_ongoing,
+				'nb_license_done': nb_license - nb_license_ongoing,
+				'nb_rnd': nb_rnd,
+				'nb_rnd_ongoing': nb_rnd_ongoing,
+				'nb_rnd_done': nb_rnd - nb_rnd_ongoing,
+
+				# Money
+				'total_money_done': aggregation.sum('money', period=period, done=True),
+				'total_money_ongoing': aggregation.sum('money', period=period, done=False),
+				'total_money_year': aggregation.sum('money_year', period=period, done=True),
+				'total_money_license_signed': aggregation.sum(
+					'money', period=period, family='license', done=True
+				),
+				'total_money_license_ongoing': aggregation.sum(
+					'money', period=period, family='license', done=False
+				),
+				'total_money_rnd_signed': aggregation.sum(
+					'money', period=period, family='rnd', done=True
+				),
+				'total_money_rnd_ongoing': aggregation.sum(
+					'money', period=period, family='rnd', done=False
+				),
 
-		# Make calculation of stats
-		# Start and end date
-		if not start_date:
-			start_date = min([
-				min([hist["date"] for hist in project.history]) \
-				for project in self.projects + self.projects_done
-			])
-		if not end_date:
-			end_date = max([
-				max([hist["date"] for hist in project.history]) \
-				for project in self.projects + self.projects_done
-			])
+				# Performance
+				'time_to_done': aggregation.average('days', period=period, done=True),
+				'cash_per_project': aggregation.average('money', period=period),
+				'cash_per_license': aggregation.average(
+					'money', period=period, family='license'
+				),
+				'cash_per_rnd': aggregation.average('money', period=period, family='rnd')
+			})
+		return contexts
 
-		# Number of projects
-		nb_projects = len([
-			project for project in self.projects+self.projects_done \
-			if start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date']
-		])
-		nb_active_projects = len([
-			project for project in self.projects \
-			if start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date']
-		])
-		nb_license = len([
-			project.type for project in self.projects + self.projects_done \
-			if (project.type == "Lic" or project.type == "aLic") \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-		nb_license_ongoing = len([
-			project.type for project in self.projects \
-			if (project.type == "Lic" or project.type == "aLic") \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-		nb_rnd = len([
-			project.type for project in self.projects + self.projects_done \
-			if (project.type == "R&D" or project.type == "aR&D" \
-			or project.type == 'MTA' or project.type == 'aMTA') \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-		nb_rnd_ongoing = len([
-			project.type for project in self.projects \
-			if (project.type == "R&D" or project.type == "aR&D" \
-			or project.type == 'MTA' or project.type == 'aMTA') \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-
-		# Money
-		total_money_done = sum([
-			project.money for project in self.projects_done \
-			if start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date']
-		])
-		total_money_ongoing = sum([
-			project.money for project in self.projects \
-			if start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date']
-		])
-		total_money_year = sum([
-			project.money_year for project in self.projects_done \
-			if start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date']
-		])
-		total_money_license_signed = sum([
-			project.money for project in self.projects_done \
-			if (project.type == "Lic" or project.type == 'aLic') \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-		total_money_license_ongoing = sum([
-			project.money for project in self.projects \
-			if (project.type == "Lic" or project.type == 'aLic') \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-		total_money_rnd_signed = sum([
-			project.money for project in self.projects_done \
-			if (project.type == "R&D" or project.type == 'aR&D' \
-			or project.type == 'MTA' or project.type == 'aMTA') \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-		total_money_rnd_ongoing = sum([
-			project.money for project in self.projects \
-			if (project.type == "R&D" or project.type == 'aR&D' \
-			or project.type == 'MTA' or project.type == 'aMTA') \
-			and (start_date <= project.history[-1]['date'] \
-			and end_date >= project.history[0]['date'])
-		])
-
-		# Deal with Zerodivision
-		if nb_projects > 0 and (nb_projects - nb_active_projects) > 0:
-
-			# Time to done performance
-			time_to_done = sum([
-				(project.history[-1]["date"] -  project.history[0]["date"]).days \
-				for project in self.projects_done \
-				if start_date <= project.history[-1]['date'] \
-				or end_date <= project.history[0]['date']
-			]) / (nb_projects - nb_active_projects)
-
-			cash_per_project = (total_money_done + total_money_ongoing) / nb_projects
-			cash_per_license = (total_money_license_signed + total_money_license_ongoing) / nb_license
-			cash_per_rnd = (total_money_rnd_signed + total_money_rnd_ongoing) / nb_rnd
 
-		else:
-			time_to_done = 0.0
-			cash_per_project = 0.0
-			cash_per_license = 0.0
-			cash_per_rnd = 0.0
+	def stats_api(self, start_date=None, end_date=None):
+		"""Compute the statistics between two dates and returns a context"""
+		# Start and end date, of the projects if not given
+		if not start_date or not end_date:
+			if self.lazy and self.storage.INDEXED:
+				# None in an empty database
+				first_date, last_date = [date and parse_date(date) for date in self.storage.span()]
+			else:
+				first_date, last_date = self.intervals.min_start(), self.intervals.max_end()
+			start_date = start_date or first_date
+			end_date = end_date or last_date
+		return self.stats_periods([(start_date, end_date)])[0]
+
+
+	def stats(self, start_date=None, end_date=None):
+		"""Display the statistics dashboard"""
+		with timing.phase('stats_api'):
+			context = self.stats_api(start_date=start_date, end_date=end_date)
 
 		# Print
 		WIDTH = settings.WIDTH - 30
+		lines = []
 		
-		print("-" * WIDTH)
+		lines.append("-" * WIDTH)
 		
-		print("  User: S.CARLIOZ")
-		print("  Stats from {0} to {1}".format(
-			datetime.datetime.strftime(start_date, '%d/%m/%Y'),
-			datetime.datetime.strftime(end_date, '%d/%m/%Y'))
+		lines.append("  User: S.CARLIOZ")
+		lines.append("  Stats from {0} to {1}".format(
+			datetime.datetime.strftime(context['start_date'], '%d/%m/%Y'),
+			datetime.datetime.strftime(context['end_date'], '%d/%m/%Y'))
 		)
 
-		print("-" * WIDTH)
+		lines.append("-" * WIDTH)
 
-		print("  Total amount signed........ {0:>4} kEUR".format(total_money_done))
-		print("     * Licenses.............. {0:>4} kEUR".format(total_money_license_signed))
-		print("     * R&D/MTA............... {0:>4} kEUR".format(total_money_rnd_signed))
-		print("  Total invoiced this year... {0:>4} kEUR".format(total_money_year))
+		lines.append("  Total amount signed........ {total_money_done:>4} kEUR".format(**context))
+		lines.append("     * Licenses.............. {total_money_license_signed:>4} kEUR".format(**context))
+		lines.append("     * R&D/MTA............... {total_money_rnd_signed:>4} kEUR".format(**context))
+		lines.append("  Total invoiced this year... {total_money_year:>4} kEUR".format(**context))
 
-		print("  Total amount in nego....... {0:>4} kEUR".format(total_money_ongoing))
-		print("     * Licenses.............. {0:>4} kEUR".format(total_money_license_ongoing))
-		print("     * R&D/MTA............... {0:>4} kEUR".format(total_money_rnd_ongoing))
+		lines.append("  Total amount in nego....... {total_money_ongoing:>4} kEUR".format(**context))
+		lines.append("     * Licenses.............. {total_money_license_ongoing:>4} kEUR".format(**context))
+		lines.append("     * R&D/MTA............... {total_money_rnd_ongoing:>4} kEUR".format(**context))
 
 		
 		
-		print("-" * WIDTH)
-
-		print("  Cash per project........... {0:>4.0f} kEUR".format(cash_per_project))
-		print("  Cash per license........... {0:>4.0f} kEUR".format(cash_per_license))
-		print("  Cash per R&D............... {0:>4.0f} kEUR".format(cash_per_rnd))
-
-		print("-" * WIDTH)
-
-		print("  Number of projects")
-		print("     * Total.................. {0}".format(nb_projects))
-		print("     * Signed................. {0}".format(nb_projects-nb_active_projects))
-		print("     * Active................. {0}".format(nb_active_projects))
-		print("  Number of licenses")
-		print("     * Total.................. {0}".format(nb_license))
-		print("     * Signed................. {0}".format(nb_license-nb_license_ongoing))
-		print("     * Active................. {0}".format(nb_license_ongoing))
-		print("  Number of R&D")
-		print("     * Total.................. {0}".format(nb_rnd))
-		print("     * Signed................. {0}".format(nb_rnd-nb_rnd_ongoing))
-		print("     * Active................. {0}".format(nb_rnd_ongoing))
-		print("-" * WIDTH)
-		print("  Average time to Done........ {0}".format(
-			self.days_or_months(time_to_done)
+		lines.append("-" * WIDTH)
+
+		lines.append("  Cash per project........... {cash_per_project:>4.0f} kEUR".format(**context))
+		lines.append("  Cash per license........... {cash_per_license:>4.0f} kEUR".format(**context))
+		lines.append("  Cash per R&D............... {cash_per_rnd:>4.0f} kEUR".format(**context))
+
+		lines.append("-" * WIDTH)
+
+		lines.append("  Number of projects")
+		lines.append("     * Total.................. {nb_projects}".format(**context))
+		lines.append("     * Signed................. {nb_done_projects}".format(**context))
+		lines.append("     * Active................. {nb_active_projects}".format(**context))
+		lines.append("  Number of licenses")
+		lines.append("     * Total.................. {nb_license}".format(**context))
+		lines.append("     * Signed................. {nb_license_done}".format(**context))
+		lines.append("     * Active................. {nb_license_ongoing}".format(**context))
+		lines.append("  Number of R&D")
+		lines.append("     * Total.................. {nb_rnd}".format(**context))
+		lines.append("     * Signed................. {nb_rnd_done}".format(**context))
+		lines.append("     * Active................. {nb_rnd_ongoing}".format(**context))
+		lines.append("-" * WIDTH)
+		lines.append("  Average time to Done........ {0}".format(
+			self.days_or_months(context['time_to_done'])
 		))
-		print("-" * WIDTH)
-
-
-
-class Project:
-
-	def __init__(self, name, type, money,
-				 money_year=0, id=0, history=[], pi="", summary="", ref=""):
-		self.id = id
-		self.ref = ref
-		self.name = name
-		self.type = type
-		self.money = money
-		self.money_year = money_year
-		self.pi = pi
-		self.summary = summary
-		self.history = history
-		if self.history:
-			for hist in self.history:
-				pattern = '%Y-%m-%dT%H:%M:%S.%f' if '.' in hist['date'] else '%Y-%m-%dT%H:%M:%S'
-				hist['date'] = datetime.datetime.strptime(hist['date'], pattern)
-		else:
-			self.history.append({
-				"node": 1,
-				"status": "Start",
-				"date": datetime.datetime.now(),
-				"comment": "-"
-			})
-
-
-	def __repr__(self):
-		return "Project: {name:<10} {type:<3} {money:>5} kEUR".format(
-			name=self.name, type=self.type, money=self.money
-		)
-
-
-	def dumps(self):
-		"""Convert Project object to JSON"""
-		# Copy history
-		history = copy.deepcopy(self.history)	# Slow method
-		for hist in history:
-			hist['date'] = hist['date'].isoformat()
-
-		#JSON
-		return {
-			"id": self.id,
-			"name": self.name,
-			"type": self.type,
-			"money": self.money,
-			"money_year": self.money_year,
-			"pi": self.pi,
-			"ref": self.ref,
-			"summary": self.summary,
-			"history": history
-		}
-
+		lines.append("-" * WIDTH)
+		with timing.phase('render'):
+			render.write(lines)
+
+
+	def rollup(self, unit):
+		"""
+		Rollups of the projects per period of unit (see Series), read from
+		their file and brought up to date with the projects changed since, or
+		built from all the projects if missing.
+		"""
+		if not self.rollups and self.as_of_date is None:
+			self.load_rollups()
+		rollup = self.rollups.get(unit)
+		if rollup is None:
+			self.hydrate()
+			rollup = self.rollups[unit] = Series(unit, self._projects + self._projects_done)
+		if self.as_of_date is None:
+			self.store_rollups()
+		return rollup
+
+
+	def load_rollups(self):
+		"""Read the rollups stored, and update the contributions of the projects changed since"""
+		path = self.db_path + settings.SERIES_EXT
+		stored = series.load(path)
+		if stored is None:
+			return
+		stamp, rollups = stored
+		ids = search.since(stamp, self.stamp, search.changes(path + settings.JOURNAL_EXT))
+		if ids is None:
+			# Changed in an unknown way: computed again
+			return
+		with timing.phase('rollups'):
+			for id in ids:
+				project = self.find_project(id)
+				for rollup in rollups.values():
+					if project:
+						rollup.update(project)
+					else:
+						rollup.remove(id)
+		self.rollups.update(rollups)
+		if not ids:
+			self.rollups_stored = (stamp, sorted(rollups))
 
-	def add_action(self, status, comment):
-		"""Add an action to the project"""
-		new_node = self.history[-1]['node'] + 1
-		self.history.append({
-			"node": new_node,
-			"status": status,
-			"date": datetime.datetime.now(),
-			"comment": comment
-		})
 
+	def store_rollups(self):
+		"""Write the rollups if they changed, unless the database changed meanwhile"""
+		stored = (search.key(self.stamp), sorted(self.rollups))
+		if stored == self.rollups_stored:
+			return
+		path = self.db_path + settings.SERIES_EXT
+		with self.lock:
+			if self.file_stamp() != self.stamp:
+				return
+			series.store(path, stored[0], self.rollups)
+			if os.path.exists(path + settings.JOURNAL_EXT):
+				os.remove(path + settings.JOURNAL_EXT)
+		self.rollups_stored = stored
 
-	def del_action(self, node):
-		for hist in self.history:
-			if hist["node"] == node:
-				self.history.remove(hist)
-				break
 
-	def update_action(self, node, params):
-		for hist in self.history:
-			if hist['node'] == node:
-				for key, value in params.items():
-					if key in hist.keys():
-						hist[key] = value
-				break
+	def series_api(self, unit, start_date=None, end_date=None):
+		"""Return the statistics of each period of unit, between two dates if given"""
+		return self.rollup(unit).rows(start_date, end_date)
 
 
+	def series(self, unit, start_date=None, end_date=None):
+		"""Display the statistics of each period of unit"""
+		with timing.phase('series_api'):
+			rows = self.series_api(unit, start_date=start_date, end_date=end_date)
 
+		# Print
+		lines = []
+		line = "{0:<10} {1:>5} {2:>7} {3:>12} {4:>12} {5:>7} {6:>14}"
+		lines.append("-" * settings.WIDTH)
+		lines.append(line.format(
+			'Period', 'New', 'Closed', 'Signed kEUR', 'Nego kEUR', 'Active', 'Time to Done'
+		))
+		lines.append("-" * settings.WIDTH)
+		for row in rows:
+			lines.append(line.format(
+				row['period'], row['new'], row['closed'], row['signed'], row['nego'],
+				row['active'], self.days_or_months(row['time_to_done']) if row['closed'] else '-'
+			))
+		lines.append("-" * settings.WIDTH)
+		with timing.phase('render'):
+			render.write(lines)
+
+
+	# Groups of the drop-off of the funnel
+	FUNNEL_GROUPS = {
+		'type': lambda project: project.type,
+		'pi': lambda project: project.pi or '-'
+	}
+
+	def funnel_api(self, by='type'):
+		"""Return the time in each status, the conversions and the drop-off per group of by"""
+		if self._funnel is None:
+			# NumPy is only needed by the funnel
+			from lib.funnel import Funnel
+			with timing.phase('arrays'):
+				self._funnel = Funnel(self.projects + self.projects_done)
+		return self._funnel.context(by, self.FUNNEL_GROUPS[by])
+
+
+	def funnel(self, by='type'):
+		"""Display the funnel dashboard"""
+		with timing.phase('funnel_api'):
+			context = self.funnel_api(by=by)
 
+		# Print
+		lines = []
+		lines.append("-" * settings.WIDTH)
+		lines.append("  {nb_projects} projects, {nb_nodes} actions".format(**context))
+		lines.append("-" * settings.WIDTH)
+		lines.append("  {0:<8} {1:>8} {2:>10} {3:>11} {4:>10} {5:>10} {6:>10}".format(
+			'Status', 'Reached', 'Conversion', 'Drop-off', 'Stays', 'Median', '90%'
+		))
+		for conversion, stage in zip(context['conversion'], context['time_in_stage'] + [None]):
+			lines.append("  {0:<8} {1:>8} {2:>9.0%} {3:>11} {4:>10} {5:>10} {6:>10}".format(
+				conversion['status'], conversion['reached'], conversion['conversion'],
+				conversion['drop_off'] if stage else '',
+				stage['count'] if stage else '',
+				self.days_or_months(stage['median']) if stage and stage['count'] else '',
+				self.days_or_months(stage['p90']) if stage and stage['count'] else ''
+			))
+		lines.append("  Median time to Done: {0}".format(
+			self.days_or_months(context['time_to_done'])
+		))
+		lines.append("-" * settings.WIDTH)
+		statuses = [conversion['status'] for conversion in context['conversion']]
+		lines.append("  {0:<14} {1:>6} ".format(context['by'].upper(), 'Nb') \
+			+ ''.join("{0:>7}".format(status) for status in statuses) + "  Time to Done")
+		for group in context['groups']:
+			lines.append("  {0:<14} {1:>6} ".format(group['group'][:14], group['count']) \
+				+ ''.join("{0:>7.0%}".format(share) for share in group['reached']) \
+				+ "  {0}".format(
+					self.days_or_months(group['time_to_done']) if group['reached'][-1] else '-'
+				)
+			)
+		lines.append("-" * settings.WIDTH)
+		with timing.phase('render'):
+			render.write(lines)
+
+
+	def search_index(self):
+		"""
+		Inverted index of the texts of the projects (see SearchIndex), read
+		from its file and brought up to date with the projects changed since.
+		"""
+		if self._search is None:
+			path = self.db_path + settings.SEARCH_EXT
+			index = SearchIndex.load(path)
+			ids = index.outdated(self.stamp, search.changes(path + settings.JOURNAL_EXT)) \
+				if index else None
+			if ids is None:
+				# Missing, or changed in an unknown way: every project is compared
+				index = index or SearchIndex()
+				index.sync(self.projects + self.projects_done)
+			else:
+				for id in ids:
+					project = self.find_project(id)
+					if project:
+						index.update(project)
+					else:
+						index.remove(id)
+			self._search = index
+		return self._search
+
+
+	def store_search_index(self):
+		"""Write the search index if it changed, unless the database changed meanwhile"""
+		path = self.db_path + settings.SEARCH_EXT
+		if not self._search.changed and self._search.stamp == search.key(self.stamp):
+			return
+		with self.lock:
+			if self.file_stamp() != self.stamp:
+				return
+			self._search.store(path, self.stamp)
+			if os.path.exists(path + settings.JOURNAL_EXT):
+				os.remove(path + settings.JOURNAL_EXT)
+
+
+	def search_api(self, query, start_date=None, end_date=None, status=None, limit=None):
+		"""Return the actions and projects matching the query, the best first"""
+		with timing.phase('search_index'):
+			index = self.search_index()
+			self.store_search_index()
+		results = index.search(
+			query, start_date=start_date, end_date=end_date, status=status, limit=limit
+		)
+		return [{
+			'id': id,
+			'name': index.names.get(id, ''),
+			'node': node,
+			'date': date,
+			'status': status,
+			'text': text,
+			'score': score
+		} for score, id, node, date, status, text in results]
+
+
+	def search(self, query, start_date=None, end_date=None, status=None, limit=None):
+		"""Display the actions and projects matching the query"""
+		with timing.phase('search_api'):
+			results = self.search_api(
+				query, start_date=start_date, end_date=end_date, status=status, limit=limit
+			)
 
+		# Print
+		lines = []
+		lines.append("-" * settings.WIDTH)
+		for result in results:
+			lines.append("#{0:<5} {1:<15} {2:>3}  {3:<10} {4:<5}  {5}".format(
+				result['id'], result['name'][:15],
+				result['node'] or '',
+				result['date'].strftime('%d/%m/%Y') if result['date'] else '',
+				result['status'],
+				self.truncate(result['text'].replace('\n', ' / '), indent=46)
+			))
+		if not results:
+			lines.append("  No match.")
+		lines.append("-" * settings.WIDTH)
+		with timing.phase('render'):
+			render.write(lines)
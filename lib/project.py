@@ -0,0 +1,263 @@
+"""
+Project object of the management project system MP.
+"""
+
+import copy
+import datetime
+
+
+def parse_date(date):
+	"""Convert a date in ISO format to a datetime"""
+	if isinstance(date, datetime.datetime):
+		return date
+	pattern = '%Y-%m-%dT%H:%M:%S.%f' if '.' in date else '%Y-%m-%dT%H:%M:%S'
+	return datetime.datetime.strptime(date, pattern)
+
+
+class Project:
+
+	# Fields derived from the history, stored in the database
+	FIELDS = ['first_date', 'last_date', 'status', 'done']
+
+	def __init__(self, name, type, money,
+				 money_year=0, id=0, history=[], pi="", summary="", ref="",
+				 fields=None):
+		self.id = id
+		self.ref = ref
+		self.name = name
+		self.type = type
+		self.money = money
+		self.money_year = money_year
+		self.pi = pi
+		self.summary = summary
+		self.history = history
+		if self.history:
+			for hist in self.history:
+				hist['date'] = parse_date(hist['date'])
+		else:
+			self.history.append({
+				"node": 1,
+				"status": "Start",
+				"date": datetime.datetime.now(),
+				"comment": "-"
+			})
+		# Index of the history by node
+		self.nodes = {hist['node']: hist for hist in self.history}
+		self.last_node = max(self.nodes, default=0)
+		if fields:
+			self.first_date, self.last_date, self.status, self.done = fields
+		else:
+			self.rebuild()
+		# Changed since it was read from or written to the storage
+		self.dirty = True
+		# JSON fragment of the project in the database, reused while not dirty
+		self.fragment = None
+
+
+	@classmethod
+	def loads(cls, project):
+		"""Convert JSON to Project object"""
+		project_history_sorted = sorted(
+			project['history'], key=lambda k: k['date']
+		)
+		fields = None
+		if 'status' in project:
+			fields = (
+				parse_date(project['first_date']), parse_date(project['last_date']),
+				project['status'], project['done']
+			)
+		project = cls(
+			project['name'], project['type'], project['money'],
+			id=project['id'], history=project_history_sorted,
+			money_year=project['money_year'], pi=project['pi'],
+			summary=project['summary'], ref=project['ref'], fields=fields
+		)
+		# Derived fields missing in the database must be written
+		project.dirty = fields is None
+		return project
+
+
+	def pack(self):
+		"""Convert Project object to the compact form of the cache"""
+		return (
+			self.id, self.name, self.type, self.money, self.money_year,
+			self.pi, self.summary, self.ref,
+			[(hist['node'], hist['status'], hist['date'], hist['comment'])
+			 for hist in self.history],
+			(self.first_date, self.last_date, self.status, self.done)
+		)
+
+
+	@classmethod
+	def unpack(cls, project):
+		"""Convert the compact form of the cache to Project object"""
+		id, name, type, money, money_year, pi, summary, ref, history, fields = project
+		# Dates are already parsed and the history already sorted
+		history = [
+			{'node': node, 'status': status, 'date': date, 'comment': comment}
+			for node, status, date, comment in history
+		]
+		project = cls(name, type, money, money_year=money_year, id=id,
+					  history=history, pi=pi, summary=summary, ref=ref, fields=fields)
+		project.dirty = False
+		return project
+
+
+	def __repr__(self):
+		return "Project: {name:<10} {type:<3} {money:>5} kEUR".format(
+			name=self.name, type=self.type, money=self.money
+		)
+
+
+	def dumps(self, iso=True):
+		"""
+		Convert Project object to JSON. Without iso, the dates are left as
+		datetime and the history is the one of the project, not copied, for
+		jsondb.encode.
+		"""
+		if iso:
+			# Shallow copy of each node with the date in ISO format
+			history = [dict(hist, date=hist['date'].isoformat()) for hist in self.history]
+		else:
+			history = self.history
+
+		#JSON
+		return {
+			"id": self.id,
+			"name": self.name,
+			"type": self.type,
+			"money": self.money,
+			"money_year": self.money_year,
+			"pi": self.pi,
+			"ref": self.ref,
+			"summary": self.summary,
+			"history": history,
+			"first_date": self.first_date.isoformat() if iso else self.first_date,
+			"last_date": self.last_date.isoformat() if iso else self.last_date,
+			"status": self.status,
+			"done": self.done
+		}
+
+
+	def touch(self):
+		"""Mark the project as changed, its fragment must be encoded again"""
+		self.dirty = True
+		self.fragment = None
+
+
+	def span(self):
+		"""First and last date of the project"""
+		return self.first_date, self.last_date
+
+
+	def compute(self):
+		"""Compute the fields derived from the history"""
+		return (
+			self.history[0]['date'], self.history[-1]['date'],
+			self.history[-1]['status'],
+			'Done' in [hist['status'] for hist in self.history]
+		)
+
+
+	def rebuild(self):
+		"""Recompute the fields derived from the history"""
+		self.first_date, self.last_date, self.status, self.done = self.compute()
+
+
+	def verify(self):
+		"""Return the derived fields that do not match the history"""
+		stored = (self.first_date, self.last_date, self.status, self.done)
+		return [
+			field for field, value, expected in zip(self.FIELDS, stored, self.compute()) \
+			if value != expected
+		]
+
+
+	def add_action(self, status, comment, date=None):
+		"""Add an action to the project, in the order of the dates"""
+		self.last_node += 1
+		hist = {
+			"node": self.last_node,
+			"status": status,
+			"date": date or datetime.datetime.now(),
+			"comment": comment
+		}
+		if not self.history or hist['date'] >= self.history[-1]['date']:
+			self.history.append(hist)
+			self.last_date = hist['date']
+			self.status = status
+		else:
+			# Action dated before the last one
+			self.history.insert(self.position(hist['date']), hist)
+			self.first_date = self.history[0]['date']
+		self.done = self.done or status == 'Done'
+		self.nodes[hist['node']] = hist
+		self.touch()
+		return hist
+
+
+	def as_of(self, date):
+		"""
+		Return the project as it was at date, sharing the actions of the
+		project, or None if it did not start yet.
+		"""
+		position = self.position(date)
+		if position == len(self.history):
+			return self
+		if not position:
+			return None
+		project = copy.copy(self)
+		project.history = self.history[:position]
+		project.rebuild()
+		return project
+
+
+	def position(self, date):
+		"""Index of the history where an action of the date is inserted"""
+		low, high = 0, len(self.history)
+		while low < high:
+			middle = (low + high) // 2
+			if date < self.history[middle]['date']:
+				high = middle
+			else:
+				low = middle + 1
+		return low
+
+
+	def del_action(self, node):
+		hist = self.nodes.pop(node, None)
+		if hist:
+			if node == self.last_node:
+				self.last_node = max(self.nodes, default=0)
+			for index, item in enumerate(self.history):
+				if item is hist:
+					del self.history[index]
+					break
+			if self.history:
+				self.first_date = self.history[0]['date']
+				self.last_date = self.history[-1]['date']
+				self.status = self.history[-1]['status']
+				if hist['status'] == 'Done':
+					self.done = 'Done' in [hist['status'] for hist in self.history]
+			self.touch()
+
+	def update_action(self, node, params):
+		hist = self.nodes.get(node)
+		if hist:
+			for key, value in params.items():
+				if key in hist.keys():
+					hist[key] = value
+			if 'date' in params:
+				# The history stays in the order of the dates
+				self.history.sort(key=lambda k: k['date'])
+			if 'node' in params or 'date' in params:
+				self.nodes = {hist['node']: hist for hist in self.history}
+				self.last_node = max(self.nodes, default=0)
+			if 'date' in params or 'status' in params:
+				self.rebuild()
+			self.touch()
+
+
+
+
+
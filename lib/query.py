@@ -0,0 +1,95 @@
+"""
+Filter expressions of the dashboard, as in pm status type=Lic status>=Contr stale>30d.
+
+An expression compares a field of the projects with a value. The conditions
+are given as (key, operator, value), the key being the key of the sorted
+view of the field (see Workflow.SORTS), so the projects matching can be
+found by bisection in the view.
+"""
+
+import datetime
+import operator
+import re
+
+import settings
+
+
+EXPRESSION = re.compile(r'^(\w+)(>=|<=|!=|=|>|<|~)(.*)$')
+DURATION = re.compile(r'^(\d+)([dwmy]?)$')
+
+OPERATORS = {
+	'=': operator.eq,
+	'!=': operator.ne,
+	'>': operator.gt,
+	'>=': operator.ge,
+	'<': operator.lt,
+	'<=': operator.le,
+	# Contains, without case
+	'~': lambda value, text: text.lower() in (value or '').lower()
+}
+
+# Operators found by bisection in a sorted view
+RANGES = ['=', '>', '>=', '<', '<=']
+
+# Comparison of the date of the last action for a comparison of its age
+INVERSE = {'>': '<', '>=': '<=', '<': '>', '<=': '>='}
+
+DAYS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+
+FIELDS = ['id', 'name', 'type', 'status', 'pi', 'ref', 'money', 'money_year', 'date', 'stale']
+
+
+class QueryError(ValueError):
+	"""Invalid filter expression"""
+
+
+
+def parse(expressions, now=None):
+	"""Return the list of conditions (key, operator, value) of the expressions"""
+	now = now or datetime.datetime.now()
+	conditions = []
+	for expression in expressions:
+		match = EXPRESSION.match(expression)
+		if not match:
+			raise QueryError("invalid filter {0}, expected FIELD=VALUE, FIELD>VALUE...".format(expression))
+		field, op, text = match.groups()
+		if field not in FIELDS:
+			raise QueryError("unknown field {0} in {1}, fields are {2}".format(
+				field, expression, ', '.join(FIELDS))
+			)
+		if op == '~' and field not in ['name', 'type', 'pi', 'ref']:
+			raise QueryError("{0} only applies to a text field".format(expression))
+		conditions.append(condition(field, op, text, now, expression))
+	return conditions
+
+
+def condition(field, op, text, now, expression):
+	"""Convert the value of an expression to the value of the key of the field"""
+	if field == 'stale' and op not in INVERSE:
+		raise QueryError("stale only compares with >, >=, < or <=")
+	try:
+		if field == 'status':
+			statuses = {status.lower(): status for status in settings.PROGRESS}
+			# The key of the status view is the progress of the status
+			return ('status', op, len(settings.PROGRESS[statuses[text.lower()]]))
+		if field in ['id', 'money', 'money_year']:
+			return (field, op, int(text))
+		if field == 'date':
+			return ('date', op, datetime.datetime.strptime(text, '%d/%m/%Y'))
+		if field == 'stale':
+			match = DURATION.match(text)
+			if not match:
+				raise ValueError
+			days = int(match.group(1)) * DAYS[match.group(2) or 'd']
+			# Older than the days given: last action before now - days
+			return ('date', INVERSE[op], now - datetime.timedelta(days=days))
+	except (KeyError, ValueError):
+		raise QueryError("invalid value in {0}".format(expression))
+	return (field, op, text)
+
+
+def test(conditions, keys, project):
+	"""Whether the project matches every condition, keys giving the key function of each field"""
+	return all(
+		OPERATORS[op](keys[key](project), value) for key, op, value in conditions
+	)
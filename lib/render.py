@@ -0,0 +1,119 @@
+"""
+Rendering of the dashboards in the terminal.
+
+A dashboard is built as lines, written at once when it fits in the
+terminal, streamed to a pager when it does not, or written over the
+previous one for a live dashboard.
+"""
+
+import contextlib
+import functools
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import settings
+
+
+# Escape sequences of the colors, not displayed
+ESCAPE = re.compile(r'\033\[[0-9;]*[A-Za-z]')
+
+
+@functools.lru_cache(maxsize=4096)
+def wrap(text, width=settings.WIDTH, indent=32):
+	"""Wrap the words of text in lines of width - indent, the next lines indented"""
+	limit = width - indent
+	lines = []
+	words = []
+	length = 0
+	for word in text.split():
+		if words and length + len(word) >= limit:
+			lines.append(' '.join(words))
+			words = []
+			length = 0
+		# A space is counted before each word, except the first one of the next lines
+		length += len(word) + 1 if words or not lines else len(word)
+		words.append(word)
+	if words:
+		lines.append(' '.join(words))
+	return ('\n' + ' ' * indent).join(lines)
+
+
+def rows(line, columns):
+	"""Number of rows of the terminal taken by a line, wrapped by the terminal if too long"""
+	return sum(
+		max(-(-len(ESCAPE.sub('', part)) // columns), 1) for part in line.split('\n')
+	)
+
+
+def write(lines):
+	"""
+	Write the lines, at once when they fit in the terminal. Otherwise the
+	pager is started as soon as they fill the terminal, and given the next
+	ones as they come.
+	"""
+	lines = iter(lines)
+	head = []
+	if settings.PAGER and sys.stdout.isatty():
+		size = shutil.get_terminal_size()
+		height = 0
+		for line in lines:
+			head.append(line)
+			height += rows(line, size.columns)
+			if height >= size.lines:
+				if page(itertools.chain(head, lines)):
+					return
+				break
+	try:
+		sys.stdout.write(''.join(line + '\n' for line in head))
+		for line in lines:
+			sys.stdout.write(line + '\n')
+		sys.stdout.flush()
+	except BrokenPipeError:
+		# Reader quit before the end (pm history | head): the rest is dropped
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def page(lines):
+	"""Write the lines through the pager, return False if it cannot be started"""
+	try:
+		pager = subprocess.Popen(
+			os.environ.get('PAGER', 'less -R'), shell=True,
+			stdin=subprocess.PIPE, universal_newlines=True
+		)
+	except OSError:
+		return False
+	try:
+		for line in lines:
+			pager.stdin.write(line + '\n')
+	except BrokenPipeError:
+		# Quit before the end
+		pass
+	with contextlib.suppress(BrokenPipeError):
+		pager.stdin.close()
+	pager.wait()
+	return True
+
+
+def redraw(lines):
+	"""Write the lines over the ones written before, from the top of the terminal"""
+	if not sys.stdout.isatty():
+		sys.stdout.write('\n'.join(lines) + '\n\n')
+		sys.stdout.flush()
+		return
+	# Cut to the height of the terminal, a scroll would move the top line
+	size = shutil.get_terminal_size()
+	kept = []
+	height = 0
+	for line in '\n'.join(lines).split('\n'):
+		height += rows(line, size.columns)
+		if height >= size.lines:
+			break
+		kept.append(line)
+	lines = kept
+	# Cursor at the top, end of each line and rest of the screen cleared
+	sys.stdout.write('\033[H' + '\033[K\n'.join(lines) + '\033[K\n\033[J')
+	sys.stdout.flush()
@@ -0,0 +1,364 @@
+"""
+Full-text search over the names, summaries, PIs, refs and comments.
+
+The texts are kept in an inverted index: the sorted numbers of the documents
+containing each word, a document being the fields of a project (node 0) or
+the comment of an action (its node). The documents are numbered in the order
+they are indexed, so a new document is appended to the arrays of its words.
+The index is stored next to the database, with the stamp of the database it
+was built from. Each process writing the database
+appends the ids of the projects changed to a log next to the index, so the
+index is brought up to date by indexing these projects only.
+"""
+
+from array import array
+import bisect
+import datetime
+import heapq
+import json
+import math
+import os
+import pickle
+import re
+import unicodedata
+
+import settings
+
+
+WORD = re.compile(r'\w+')
+QUERY = re.compile(r'"([^"]*)"|(\S+)')
+
+STATUSES = list(settings.PROGRESS)
+EPOCH = datetime.datetime(1970, 1, 1)
+# Date of the projects without action
+NO_DATE = float('-inf')
+
+
+def words(text):
+	"""Words of text, in lower case and without accents"""
+	text = text.lower()
+	if not text.isascii():
+		text = unicodedata.normalize('NFKD', text)
+		text = ''.join(char for char in text if not unicodedata.combining(char))
+	return WORD.findall(text)
+
+
+def seconds(date):
+	return (date - EPOCH).total_seconds() if date else NO_DATE
+
+
+def key(stamp):
+	"""Comparable form of a stamp of the database (see Workflow.file_stamp)"""
+	return json.dumps(stamp)
+
+
+def log(path, before, after, ids):
+	"""Append to the log the ids of the projects changed from the stamp before to after"""
+	with open(path, 'a') as changes:
+		changes.write(json.dumps([key(before), key(after), sorted(ids)]) + '\n')
+
+
+def changes(path):
+	"""Return the list of (stamp before, stamp after, ids) of the log"""
+	lines = []
+	if not os.path.exists(path):
+		return lines
+	with open(path, 'r') as changes:
+		for line in changes:
+			try:
+				lines.append(json.loads(line))
+			except ValueError:
+				# Last line truncated: the stamps do not follow each other anymore
+				break
+	return lines
+
+
+def since(built, stamp, lines):
+	"""
+	Return the ids of the projects changed from the key built of a stamp to
+	the stamp, from the lines of a log of changes, or None if they cannot be
+	known: the database was changed by another way, or a line is missing.
+	"""
+	ids = set()
+	expected = built
+	for before, after, changed in lines:
+		if before != expected:
+			return None
+		ids.update(changed)
+		expected = after
+	if expected != key(stamp):
+		return None
+	return ids
+
+
+
+class SearchIndex:
+	"""
+	SearchIndex maps each word to the documents containing it.
+
+	The documents are described by arrays indexed by their number, written
+	and read at once by pickle. A removed document keeps its number, without
+	text, until the index is built again.
+	"""
+
+	VERSION = 2
+
+	def __init__(self):
+		"""Initialization of the instance"""
+		self.stamp = None				# Key of the stamp of the database indexed
+		self.texts = []					# Text of each document, None once removed
+		self.ids = array('l')			# Project id of each document
+		self.nodes = array('l')			# Node of each document, 0 for the project fields
+		self.dates = array('d')			# Date in seconds of each document
+		self.statuses = array('b')		# Status code of each document, -1 if none
+		self.lengths = array('l')		# Number of words of each document
+		self.postings = {}				# Sorted numbers of the documents by word
+		self.names = {}					# Name by project id
+		self.removed = 0				# Number of documents removed
+		self.size = 0					# Number of words of the documents not removed
+		self.changed = False
+		self.numbers = {}				# {node: number} by project id
+		self.terms = None				# Words sorted, for the prefix queries
+
+
+	@classmethod
+	def load(cls, path):
+		"""Return the index stored in path, or None if missing or corrupt"""
+		try:
+			with open(path, 'rb') as file:
+				version, index = pickle.load(file)
+			return index if version == cls.VERSION else None
+		except Exception:
+			return None
+
+
+	def store(self, path, stamp):
+		"""Write the index for the stamp of the database"""
+		self.stamp = key(stamp)
+		try:
+			tmp_path = path + '.tmp'
+			with open(tmp_path, 'wb') as file:
+				pickle.dump((self.VERSION, self), file, pickle.HIGHEST_PROTOCOL)
+			os.replace(tmp_path, path)
+		except OSError:
+			# The index is built again next time
+			return
+		self.changed = False
+
+
+	def __getstate__(self):
+		# The numbers by project are found again from the arrays
+		state = dict(self.__dict__)
+		state['numbers'] = None
+		state['terms'] = None
+		return state
+
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.numbers = {}
+		for number, (id, node) in enumerate(zip(self.ids, self.nodes)):
+			if self.texts[number] is not None:
+				self.numbers.setdefault(id, {})[node] = number
+
+
+	def outdated(self, stamp, lines):
+		"""
+		Return the ids of the projects changed since the index was built, from
+		the lines of the log of changes, or None if they cannot be known.
+		"""
+		return since(self.stamp, stamp, lines)
+
+
+	@staticmethod
+	def project_documents(project):
+		"""Return {node: (date in seconds, status code, text)} of the documents of a project"""
+		fields = [project.name, project.summary, project.pi, project.ref]
+		documents = {0: (
+			seconds(project.last_date) if project.history else NO_DATE,
+			STATUSES.index(project.status) if project.history else -1,
+			'\n'.join(field for field in fields if field)
+		)}
+		for hist in project.history:
+			if hist['comment'] and hist['comment'] != '-':
+				documents[hist['node']] = (
+					seconds(hist['date']), STATUSES.index(hist['status']), hist['comment']
+				)
+		return documents
+
+
+	def update(self, project):
+		"""Index the documents of a project which changed"""
+		documents = self.project_documents(project)
+		self.names[project.id] = project.name
+		numbers = self.numbers.setdefault(project.id, {})
+		for node, number in list(numbers.items()):
+			document = (self.dates[number], self.statuses[number], self.texts[number])
+			if documents.get(node) != document:
+				self.remove_document(number)
+				del numbers[node]
+		for node, document in documents.items():
+			if node not in numbers:
+				numbers[node] = self.add_document(project.id, node, document)
+
+
+	def remove(self, id):
+		"""Remove the documents of the project id"""
+		for number in self.numbers.pop(id, {}).values():
+			self.remove_document(number)
+		self.names.pop(id, None)
+
+
+	def sync(self, projects):
+		"""Index the projects which changed, and remove the projects not given"""
+		if self.removed > len(self.texts) // 2:
+			# Mostly removed documents: numbered again from scratch
+			self.__init__()
+		ids = set()
+		for project in projects:
+			ids.add(project.id)
+			self.update(project)
+		for id in set(self.numbers) - ids:
+			self.remove(id)
+
+
+	def add_document(self, id, node, document):
+		"""Index a document and return its number"""
+		date, status, text = document
+		number = len(self.texts)
+		self.texts.append(text)
+		self.ids.append(id)
+		self.nodes.append(node)
+		self.dates.append(date)
+		self.statuses.append(status)
+		found = words(text)
+		self.lengths.append(len(found))
+		self.size += len(found)
+		for word in set(found):
+			posting = self.postings.get(word)
+			if posting is None:
+				posting = self.postings[word] = array('l')
+				self.terms = None
+			# The largest number, the posting stays sorted
+			posting.append(number)
+		self.changed = True
+		return number
+
+
+	def remove_document(self, number):
+		text = self.texts[number]
+		if text is None:
+			return
+		self.texts[number] = None
+		self.removed += 1
+		self.size -= self.lengths[number]
+		for word in set(words(text)):
+			posting = self.postings.get(word)
+			if posting is None:
+				continue
+			position = bisect.bisect_left(posting, number)
+			if position < len(posting) and posting[position] == number:
+				del posting[position]
+			if not posting:
+				del self.postings[word]
+				self.terms = None
+		self.changed = True
+
+
+	def prefixed(self, prefix):
+		"""Words starting with prefix"""
+		if self.terms is None:
+			self.terms = sorted(self.postings)
+		start = bisect.bisect_left(self.terms, prefix)
+		end = bisect.bisect_left(self.terms, prefix + '\uffff')
+		return self.terms[start:end]
+
+
+	def match(self, clause):
+		"""Return the set of the numbers of the documents matching a clause"""
+		kind, terms = clause
+		if kind == 'prefix':
+			found = set()
+			for word in self.prefixed(terms[0]):
+				found.update(self.postings[word])
+			return found
+		postings = sorted((self.postings.get(word, ()) for word in terms), key=len)
+		found = set(postings[0])
+		for posting in postings[1:]:
+			found.intersection_update(posting)
+		if len(terms) > 1:
+			# Phrase: the words must follow each other in the text
+			found = {
+				number for number in found \
+				if self.contains(words(self.texts[number]), terms)
+			}
+		return found
+
+
+	@staticmethod
+	def contains(found, terms):
+		"""Whether the list of words found contains the list of words terms in a row"""
+		size = len(terms)
+		return any(
+			found[index:index + size] == terms \
+			for index in range(len(found) - size + 1) if found[index] == terms[0]
+		)
+
+
+	@staticmethod
+	def parse(query):
+		"""Return the clauses of a query: words, "phrases" and prefix*"""
+		clauses = []
+		for phrase, term in QUERY.findall(query):
+			if phrase:
+				terms = words(phrase)
+				if terms:
+					clauses.append(('words', terms))
+			elif term.endswith('*') and words(term):
+				clauses.append(('prefix', words(term)[:1]))
+			else:
+				clauses.extend(('words', [word]) for word in words(term))
+		return clauses
+
+
+	def search(self, query, start_date=None, end_date=None, status=None, limit=None):
+		"""
+		Return the documents matching every clause of the query, the best
+		first: (score, project id, node, date, status, text). The documents
+		can be filtered on the date and the status of the action.
+		"""
+		clauses = self.parse(query)
+		if not clauses:
+			return []
+		matches = sorted((self.match(clause) for clause in clauses), key=len)
+		if not matches[0]:
+			return []
+		found = matches[0]
+		for match in matches[1:]:
+			found = found & match
+		if status:
+			code = STATUSES.index(status)
+			found = [number for number in found if self.statuses[number] == code]
+		if start_date or end_date:
+			start, end = seconds(start_date) if start_date else NO_DATE, seconds(end_date)
+			found = [
+				number for number in found \
+				if start <= self.dates[number] and (not end_date or self.dates[number] <= end)
+			]
+
+		# Rare clauses count more, and short documents more than long ones (BM25)
+		total = len(self.texts) - self.removed
+		weight = sum(math.log(1 + total / len(match)) for match in matches)
+		average = self.size / total if self.size else 1
+		def rank(number):
+			score = weight * 2.2 / (1 + 1.2 * (0.25 + 0.75 * self.lengths[number] / average))
+			return score, self.dates[number]
+		best = heapq.nlargest(limit, found, key=rank) if limit else sorted(found, key=rank, reverse=True)
+
+		return [(
+			rank(number)[0], self.ids[number], self.nodes[number],
+			EPOCH + datetime.timedelta(seconds=self.dates[number]) \
+				if self.dates[number] != NO_DATE else None,
+			STATUSES[self.statuses[number]] if self.statuses[number] >= 0 else '',
+			self.texts[number]
+		) for number in best]
@@ -0,0 +1,184 @@
+"""
+Time series of the pipeline, rolled up per month, quarter or year.
+
+The rollups are stored next to the database with the stamp of the database
+they were computed from. As for the search index, each process writing the
+database appends the ids of the projects changed to a log next to them, so
+only the contributions of these projects are computed again.
+"""
+
+import csv
+import datetime
+import os
+import pickle
+
+
+UNITS = ['month', 'quarter', 'year']
+
+COLUMNS = ['period', 'new', 'closed', 'signed', 'nego', 'active', 'time_to_done']
+
+
+def period(date, unit):
+	"""Number of the period of unit containing date"""
+	if unit == 'month':
+		return date.year * 12 + date.month - 1
+	if unit == 'quarter':
+		return date.year * 4 + (date.month - 1) // 3
+	return date.year
+
+
+def load(path):
+	"""Return the (key of the stamp, rollups by unit) stored in path, or None if missing or corrupt"""
+	try:
+		with open(path, 'rb') as file:
+			version, stamp, rollups = pickle.load(file)
+		return (stamp, rollups) if version == Series.VERSION else None
+	except Exception:
+		return None
+
+
+def store(path, stamp, rollups):
+	"""Write the rollups by unit for the key of the stamp of the database"""
+	try:
+		tmp_path = path + '.tmp'
+		with open(tmp_path, 'wb') as file:
+			pickle.dump((Series.VERSION, stamp, rollups), file, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, path)
+	except OSError:
+		# Computed again next time
+		pass
+
+
+def label(number, unit):
+	"""Name of the period number of unit"""
+	if unit == 'month':
+		return '{0}-{1:02d}'.format(number // 12, number % 12 + 1)
+	if unit == 'quarter':
+		return '{0}-Q{1}'.format(number // 4, number % 4 + 1)
+	return str(number)
+
+
+
+class Series:
+	"""
+	Series keeps the rollups of the projects per period.
+
+	Each project adds to the period of its first action (new), to the period
+	it was done (closed, signed, days to done), and to every period it was
+	still open at the end: the open projects are kept as differences, +1 on
+	the first period and -1 on the period it was done, summed when the rows
+	are read. A change of a project only moves its own contribution, so the
+	rollups are never computed again from all the projects.
+	"""
+
+	VERSION = 1
+
+	def __init__(self, unit, projects=()):
+		"""
+		Initialization of the instance
+		- unit: 'month', 'quarter' or 'year';
+		- projects: projects of the series.
+		"""
+		self.unit = unit
+		self.contributions = {}		# Contribution of each project by id
+		self.totals = {}			# [new, closed, signed, days, open, open money] by period
+		for project in projects:
+			self.add(project)
+
+
+	def contribution(self, project):
+		"""Return (first period, done period or None, money, days to done) of the project"""
+		first_date = project.first_date
+		# Closed by the first action Done, the actions after it do not move it
+		done_date = next(
+			(hist['date'] for hist in project.history if hist['status'] == 'Done'), None
+		) if project.done else None
+		return (
+			period(first_date, self.unit),
+			period(done_date, self.unit) if done_date else None,
+			project.money,
+			(done_date - first_date).days if done_date else 0
+		)
+
+
+	def apply(self, contribution, sign):
+		"""Add (sign 1) or subtract (sign -1) a contribution to the totals"""
+		first, done, money, days = contribution
+		self.total(first)[0] += sign
+		self.total(first)[4] += sign
+		self.total(first)[5] += sign * money
+		if done is not None:
+			total = self.total(done)
+			total[1] += sign
+			total[2] += sign * money
+			total[3] += sign * days
+			total[4] -= sign
+			total[5] -= sign * money
+
+
+	def total(self, number):
+		total = self.totals.get(number)
+		if total is None:
+			total = self.totals[number] = [0] * 6
+		return total
+
+
+	def add(self, project):
+		"""Add a project, or move its contribution if it changed"""
+		contribution = self.contribution(project)
+		previous = self.contributions.get(project.id)
+		if previous == contribution:
+			return
+		if previous is not None:
+			self.apply(previous, -1)
+		self.contributions[project.id] = contribution
+		self.apply(contribution, 1)
+
+
+	update = add
+
+
+	def remove(self, id):
+		"""Remove the contribution of the project id"""
+		contribution = self.contributions.pop(id, None)
+		if contribution is not None:
+			self.apply(contribution, -1)
+
+
+	def rows(self, start_date=None, end_date=None):
+		"""
+		Return a dict per period from the first one to the current one (or
+		the last one with an action), between start_date and end_date if given.
+		"""
+		numbers = [number for number, total in self.totals.items() if any(total)]
+		if not numbers:
+			return []
+		last = max(max(numbers), period(datetime.datetime.now(), self.unit))
+		start = period(start_date, self.unit) if start_date else None
+		end = period(end_date, self.unit) if end_date else last
+		rows = []
+		active = money = 0
+		for number in range(min(numbers), min(last, end) + 1):
+			new, closed, signed, days, opened, opened_money = self.totals.get(number, [0] * 6)
+			active += opened
+			money += opened_money
+			if start is not None and number < start:
+				continue
+			rows.append({
+				'period': label(number, self.unit),
+				'new': new,
+				'closed': closed,
+				'signed': signed,
+				'nego': money,
+				'active': active,
+				'time_to_done': days / closed if closed else 0.0
+			})
+		return rows
+
+
+def write_csv(rows, file):
+	"""Write the rows in CSV format"""
+	writer = csv.DictWriter(file, fieldnames=COLUMNS, lineterminator='\n')
+	writer.writeheader()
+	for row in rows:
+		writer.writerow(dict(row, time_to_done=round(row['time_to_done'])))
@@ -0,0 +1,366 @@
+"""
+Storage backends of the workflow.
+
+A storage reads and writes the projects of the workflow:
+- JsonStorage keeps the database in a single JSON file (default);
+- SqliteStorage keeps it in a SQLite database with indexes, and answers
+  the queries on a single project or on a range of dates without loading
+  every project.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+
+import settings
+from lib.cache import Cache
+from lib.project import Project
+import lib.jsondb as jsondb
+
+
+def open_storage(name=settings.STORAGE, cache=settings.CACHE):
+	"""Return the storage configured in the settings"""
+	if name == 'sqlite':
+		return SqliteStorage(settings.SQLITE_PATH)
+	return JsonStorage(settings.DATABASE_PATH, cache=cache)
+
+
+class JsonStorage:
+	"""
+	JsonStorage keeps the database in a JSON file.
+	"""
+
+	# The journal can be used on top of this storage
+	JOURNAL = True
+	# Queries are answered from the projects in memory
+	INDEXED = False
+
+	# Fields of the light description of the projects in lazy mode
+	INDEX = ['id', 'name', 'type', 'done']
+
+	def __init__(self, path, cache=settings.CACHE):
+		"""Initialization of the instance"""
+		self.path = path
+		self.cache = Cache(self.path + settings.CACHE_EXT, self.path) if cache else None
+		self.text = None		# Text of the database read in lazy mode
+		self.offsets = {}		# Position in the text of the projects not built yet by id
+
+
+	def load(self):
+		"""Return the top level data and the list of all projects"""
+		data = self.cache.load() if self.cache else None
+		if data:
+			meta, entries = data
+			projects = []
+			for id, entry in entries:
+				packed, fragment = pickle.loads(entry)
+				project = Project.unpack(packed)
+				project.fragment = fragment
+				# Read without the derived fields, still to be written
+				project.dirty = fragment is None
+				projects.append(project)
+			return meta, projects
+		meta, records = self.read()
+		projects = []
+		for fragment, record in records:
+			project = Project.loads(record)
+			if not project.dirty:
+				project.fragment = fragment
+			projects.append(project)
+		self.store_cache(meta, projects)
+		return meta, projects
+
+
+	def read(self):
+		"""Return the top level data and the (fragment, project) of each project"""
+		with open(self.path, 'r') as db:
+			text = db.read()
+		return jsondb.scan(text)
+
+
+	def load_index(self):
+		"""
+		Return the top level data and a light description of each project,
+		read from the text without decoding the projects.
+		"""
+		with open(self.path, 'r') as db:
+			self.text = db.read()
+		meta, positions = jsondb.locate(self.text)
+		index = {}
+		self.offsets = {}
+		for start, end in positions:
+			entry = jsondb.fields(self.text, start, end, self.INDEX)
+			if len(entry) < len(self.INDEX):
+				# Written without the derived fields, or not by pm
+				project = json.loads(self.text[start:end])
+				entry = {
+					'id': project['id'],
+					'name': project['name'],
+					'type': project['type'],
+					'done': project['done'] if 'done' in project else \
+						'Done' in [hist['status'] for hist in project['history']]
+				}
+			index[entry['id']] = entry
+			self.offsets[entry['id']] = (start, end)
+		return meta, index
+
+
+	def fetch(self, ids):
+		"""Return the projects of the list of ids"""
+		projects = []
+		for id in ids:
+			position = self.offsets.pop(id, None)
+			if position is not None:
+				fragment = self.text[position[0]:position[1]]
+				project = Project.loads(json.loads(fragment))
+				if not project.dirty:
+					project.fragment = fragment
+				projects.append(project)
+		return projects
+
+
+	def save(self, meta, projects, ids, full=False):
+		"""
+		Write the database with the projects given, in the order of ids.
+		Projects of ids not given were not built and are written back verbatim,
+		as the projects not changed since they were read.
+		"""
+		projects = {project.id: project for project in projects}
+		# Cache of the database written over, to update in lazy mode
+		cached = self.cache.load() if self.cache and len(projects) < len(ids) else None
+
+		def fragments():
+			for id in ids:
+				project = projects.get(id)
+				if project is None:
+					start, end = self.offsets[id]
+					yield self.text[start:end]
+					continue
+				if project.dirty or project.fragment is None:
+					project.fragment = jsondb.encode(project.dumps(iso=False))
+					project.dirty = False
+				yield project.fragment
+
+		# Written aside then renamed, the database is never left half written
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'w') as db:
+			jsondb.dump(meta, fragments(), db)	# Write JSON format to database
+			# On disk before the rename, a crash cannot leave an empty database
+			db.flush()
+			os.fsync(db.fileno())
+		os.replace(tmp_path, self.path)
+		if len(projects) == len(ids):
+			self.store_cache(meta, [projects[id] for id in ids])
+		elif cached:
+			# Only the entries of the projects built are replaced
+			entries = dict(cached[1])
+			if all(id in projects or id in entries for id in ids):
+				self.cache.store((meta, [
+					(id, self.entry(projects[id]) if id in projects else entries[id]) for id in ids
+				]))
+
+
+	def store_cache(self, meta, projects):
+		"""Write the binary snapshot of the database"""
+		if self.cache:
+			self.cache.store((meta, [(project.id, self.entry(project)) for project in projects]))
+
+
+	@staticmethod
+	def entry(project):
+		"""
+		Entry of a project in the cache: its compact form and its fragment, to
+		write it back, pickled apart to be replaced without reading the others.
+		"""
+		return pickle.dumps((project.pack(), project.fragment), pickle.HIGHEST_PROTOCOL)
+
+
+
+class SqliteStorage:
+	"""
+	SqliteStorage keeps the database in SQLite, with a table of projects and
+	a table of history nodes.
+	"""
+
+	JOURNAL = False
+	INDEXED = True
+
+	SCHEMA = """
+		CREATE TABLE IF NOT EXISTS meta (
+			key TEXT PRIMARY KEY,
+			value TEXT
+		);
+		CREATE TABLE IF NOT EXISTS projects (
+			id INTEGER PRIMARY KEY,
+			name TEXT,
+			type TEXT,
+			money INTEGER,
+			money_year INTEGER,
+			pi TEXT,
+			ref TEXT,
+			summary TEXT,
+			first_date TEXT,
+			last_date TEXT,
+			status TEXT,
+			done INTEGER
+		);
+		CREATE TABLE IF NOT EXISTS history (
+			project_id INTEGER,
+			node INTEGER,
+			status TEXT,
+			date TEXT,
+			comment TEXT
+		);
+		CREATE INDEX IF NOT EXISTS projects_status ON projects (status);
+		CREATE INDEX IF NOT EXISTS projects_type ON projects (type);
+		CREATE INDEX IF NOT EXISTS projects_done ON projects (done, status);
+		CREATE INDEX IF NOT EXISTS projects_dates ON projects (first_date, last_date);
+		CREATE INDEX IF NOT EXISTS history_project ON history (project_id, date);
+		CREATE INDEX IF NOT EXISTS history_date ON history (date);
+	"""
+
+	PROJECT_COLUMNS = [
+		'id', 'name', 'type', 'money', 'money_year', 'pi', 'ref', 'summary',
+		'first_date', 'last_date', 'status', 'done'
+	]
+
+	# Maximum number of parameters in a query
+	CHUNK = 500
+
+	def __init__(self, path):
+		"""Initialization of the instance"""
+		self.path = path
+		self.db = sqlite3.connect(self.path)
+		self.db.executescript(self.SCHEMA)
+
+
+	def load(self):
+		"""Return the top level data and the list of all projects"""
+		return self.load_meta(), self.fetch(None)
+
+
+	def load_meta(self):
+		return {
+			key: json.loads(value) for key, value in self.db.execute(
+				"SELECT key, value FROM meta"
+			)
+		}
+
+
+	def load_index(self):
+		"""Return the top level data and a light description of each project"""
+		index = {}
+		for id, name, type, done in self.db.execute(
+			"SELECT id, name, type, done FROM projects ORDER BY id"
+		):
+			index[id] = {'id': id, 'name': name, 'type': type, 'done': bool(done)}
+		return self.load_meta(), index
+
+
+	def fetch(self, ids):
+		"""Return the projects of the list of ids, or all projects if ids is None"""
+		if ids is None:
+			return self.select("", "", [])
+		projects = []
+		ids = list(ids)
+		for index in range(0, len(ids), self.CHUNK):
+			chunk = ids[index:index + self.CHUNK]
+			marks = ', '.join('?' * len(chunk))
+			projects += self.select(
+				"WHERE id IN ({0})".format(marks),
+				"WHERE project_id IN ({0})".format(marks),
+				chunk
+			)
+		return projects
+
+
+	def select(self, where, history_where, params):
+		"""Build the projects matching the where clauses of both tables"""
+		records = {}
+		for row in self.db.execute(
+			"SELECT {0} FROM projects {1} ORDER BY id".format(
+				', '.join(self.PROJECT_COLUMNS), where
+			), params
+		):
+			record = dict(zip(self.PROJECT_COLUMNS, row))
+			record['done'] = bool(record['done'])
+			record['history'] = []
+			records[record['id']] = record
+		if not records:
+			return []
+		for project_id, node, status, date, comment in self.db.execute(
+			"SELECT project_id, node, status, date, comment FROM history {0} " \
+			"ORDER BY project_id, date".format(history_where), params
+		):
+			records[project_id]['history'].append({
+				'node': node, 'status': status, 'date': date, 'comment': comment
+			})
+		return [Project.loads(record) for record in records.values()]
+
+
+	def span(self):
+		"""First and last date of all projects"""
+		return self.db.execute(
+			"SELECT MIN(first_date), MAX(last_date) FROM projects"
+		).fetchone()
+
+
+	def groups(self, start_date, end_date):
+		"""
+		Aggregate the projects overlapping a period, by type and done.
+		Return rows of (type, done, count, money, money_year, days).
+		"""
+		return [
+			(type, bool(done), count, money or 0, money_year or 0, days or 0)
+			for type, done, count, money, money_year, days in self.db.execute(
+				"SELECT type, done, COUNT(*), SUM(money), SUM(money_year), " \
+				"SUM(CAST(julianday(last_date) - julianday(first_date) AS INTEGER)) " \
+				"FROM projects WHERE first_date <= ? AND last_date >= ? " \
+				"GROUP BY type, done",
+				(end_date.isoformat(), start_date.isoformat())
+			)
+		]
+
+
+	def save(self, meta, projects, ids, full=False):
+		"""
+		Write the projects changed, or all projects given if full, and delete
+		the projects not in ids.
+		Projects of ids not given were not built and are left untouched.
+		"""
+		with self.db:
+			self.db.execute("DELETE FROM meta")
+			self.db.executemany(
+				"INSERT INTO meta (key, value) VALUES (?, ?)",
+				[(key, json.dumps(value)) for key, value in meta.items()]
+			)
+			existing = set(id for id, in self.db.execute("SELECT id FROM projects"))
+			deleted = list(existing - set(ids))
+			for index in range(0, len(deleted), self.CHUNK):
+				chunk = deleted[index:index + self.CHUNK]
+				marks = ', '.join('?' * len(chunk))
+				self.db.execute("DELETE FROM projects WHERE id IN ({0})".format(marks), chunk)
+				self.db.execute("DELETE FROM history WHERE project_id IN ({0})".format(marks), chunk)
+			for project in projects:
+				if full or project.dirty:
+					self.write(project)
+					project.dirty = False
+
+
+	def write(self, project):
+		"""Insert or replace a project and its history"""
+		record = project.dumps()
+		record['done'] = int(record['done'])
+		self.db.execute(
+			"INSERT OR REPLACE INTO projects ({0}) VALUES ({1})".format(
+				', '.join(self.PROJECT_COLUMNS), ', '.join('?' * len(self.PROJECT_COLUMNS))
+			), [record[column] for column in self.PROJECT_COLUMNS]
+		)
+		self.db.execute("DELETE FROM history WHERE project_id = ?", (project.id,))
+		self.db.executemany(
+			"INSERT INTO history (project_id, node, status, date, comment) " \
+			"VALUES (?, ?, ?, ?, ?)",
+			[(project.id, hist['node'], hist['status'], hist['date'], hist['comment'])
+			 for hist in record['history']]
+		)
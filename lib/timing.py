@@ -0,0 +1,90 @@
+"""
+Timing of the phases of a command (pm --profile).
+
+The phases are timed with their wall time, CPU time and peak of memory
+allocated (tracemalloc). The hooks stay in the code: while the timing is
+disabled, phase() returns a shared context manager doing nothing.
+"""
+
+import contextlib
+import sys
+import time
+import tracemalloc
+
+
+enabled = False
+records = []		# (depth, name, wall, cpu, peak) of the phases, in order of start
+stack = []			# Phases in progress
+
+NULL = contextlib.nullcontext()
+
+
+def enable(start=None):
+	"""Start the timing, and record the startup since the time start if given"""
+	global enabled
+	enabled = True
+	if start is not None:
+		# CPU time of the process so far, interpreter startup included
+		records.append((0, 'startup', time.perf_counter() - start, time.process_time(), 0))
+	tracemalloc.start()
+
+
+def phase(name):
+	"""Context manager timing a phase of the command"""
+	if not enabled:
+		return NULL
+	return Phase(name)
+
+
+
+class Phase:
+	"""
+	Phase measures a block of code, nested in the phase in progress.
+	"""
+
+	def __init__(self, name):
+		"""Initialization of the instance"""
+		self.name = name
+
+
+	def __enter__(self):
+		if stack:
+			# The peak of the parent before this phase
+			stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+		tracemalloc.reset_peak()
+		self.peak = 0
+		self.depth = len(stack)
+		self.index = len(records)
+		records.append(None)
+		stack.append(self)
+		self.wall = time.perf_counter()
+		self.cpu = time.process_time()
+		return self
+
+
+	def __exit__(self, *exc):
+		wall = time.perf_counter() - self.wall
+		cpu = time.process_time() - self.cpu
+		self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+		stack.pop()
+		if stack:
+			stack[-1].peak = max(stack[-1].peak, self.peak)
+		records[self.index] = (self.depth, self.name, wall, cpu, self.peak)
+
+
+
+def report(file=None):
+	"""Write the table of the phases timed"""
+	file = file or sys.stderr
+	lines = ["-" * 66, "{0:<32} {1:>10} {2:>10} {3:>10}".format(
+		'Phase', 'Wall ms', 'CPU ms', 'Peak KiB')]
+	for record in records:
+		if record is None:
+			# Phase still in progress
+			continue
+		depth, name, wall, cpu, peak = record
+		lines.append("{0:<32} {1:>10.1f} {2:>10.1f} {3:>10}".format(
+			'  ' * depth + name, wall * 1000, cpu * 1000, peak // 1024 if peak else '-')
+		)
+	lines.append("-" * 66)
+	file.write('\n'.join(lines) + '\n')
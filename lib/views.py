@@ -0,0 +1,91 @@
+"""
+Sorted views of the projects, kept up to date when the projects change.
+"""
+
+import bisect
+
+
+INFINITY = float('inf')
+
+
+class SortedView:
+	"""
+	SortedView keeps the projects sorted on a key.
+
+	Projects are added, removed or moved by bisection in a list sorted on
+	(key, id), so the order never needs to be computed again. Projects with
+	the same key are in the order of their ids.
+	"""
+
+	def __init__(self, key, reverse=False, projects=()):
+		"""
+		Initialization of the instance
+		- key: function(project) returning the value to sort on;
+		- reverse: largest values first;
+		- projects: projects of the view.
+		"""
+		self.key = key
+		self.reverse = reverse
+		self.entries = {}		# Sort key of each project of the view
+		self.keys = []
+		self.projects = []
+		for project in sorted(projects, key=self.sort_key):
+			self.entries[project] = self.sort_key(project)
+			self.keys.append(self.entries[project])
+			self.projects.append(project)
+
+
+	def sort_key(self, project):
+		return (self.key(project), -project.id if self.reverse else project.id)
+
+
+	def __len__(self):
+		return len(self.projects)
+
+
+	def __iter__(self):
+		return reversed(self.projects) if self.reverse else iter(self.projects)
+
+
+	def __contains__(self, project):
+		return project in self.entries
+
+
+	def add(self, project):
+		"""Insert a project at its place"""
+		if project in self.entries:
+			self.remove(project)
+		key = self.entries[project] = self.sort_key(project)
+		position = bisect.bisect_left(self.keys, key)
+		self.keys.insert(position, key)
+		self.projects.insert(position, project)
+
+
+	def remove(self, project):
+		"""Remove a project of the view"""
+		key = self.entries.pop(project, None)
+		if key is None:
+			return
+		position = bisect.bisect_left(self.keys, key)
+		del self.keys[position]
+		del self.projects[position]
+
+
+	def update(self, project):
+		"""Move a project whose key changed"""
+		if self.entries.get(project) != self.sort_key(project):
+			self.add(project)
+
+
+	def bounds(self, low=None, high=None, include_low=True, include_high=True):
+		"""
+		Return (start, stop) of the projects with a key between low and high
+		in self.projects, found by bisection.
+		"""
+		# (value,) is before and (value, inf) after every key (value, id)
+		start, stop = 0, len(self.keys)
+		if low is not None:
+			start = bisect.bisect_left(self.keys, (low,) if include_low else (low, INFINITY))
+		if high is not None:
+			stop = bisect.bisect_left(self.keys, (high, INFINITY) if include_high else (high,))
+		return start, max(start, stop)
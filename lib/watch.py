@@ -0,0 +1,157 @@
+"""
+Live dashboard of pm watch.
+
+The workflow stays loaded, and the database and its journal are checked
+every few seconds: their modification time and size first, then the
+content of the database compared with the copy read last. Only the
+projects between the first and the last difference are decoded again, and
+only the new records of the journal are applied, so a refresh costs in
+proportion to the change, not to the size of the database.
+"""
+
+import datetime
+import json
+import shutil
+import sys
+import time
+
+import settings
+import lib.jsondb as jsondb
+import lib.render as render
+
+
+class Watcher:
+	"""
+	Watcher brings the workflow up to date with the files of the database.
+	"""
+
+	def __init__(self, workflow):
+		"""Initialization of the instance"""
+		self.workflow = workflow
+		self.stamp = None			# Stamp of the files read (see Workflow.file_stamp)
+		self.data = None			# Content of the database read
+		self.offset = 0				# Bytes of the journal read
+		self.start()
+
+
+	def start(self):
+		"""Read the files the workflow was loaded from"""
+		with self.workflow.lock.shared():
+			if self.workflow.file_stamp() != self.workflow.stamp:
+				self.workflow.reload()
+			self.stamp = self.workflow.stamp
+			self.data = self.read()
+			self.offset = self.stamp[1][1] if self.stamp[1] else 0
+
+
+	def read(self):
+		"""Content of the database, None if it is not a JSON file"""
+		if not self.workflow.storage.JOURNAL:
+			return None
+		with open(self.workflow.db_path, 'rb') as db:
+			return db.read()
+
+
+	def poll(self):
+		"""
+		Apply the changes of the files since the last poll, and return the ids
+		of the projects changed, or None if the files did not change.
+		"""
+		stamp = self.workflow.file_stamp()
+		if stamp == self.stamp:
+			return None
+		with self.workflow.lock.shared():
+			stamp = self.workflow.file_stamp()
+			changed = set()
+			try:
+				if stamp[0] != self.stamp[0]:
+					changed |= self.read_database()
+				changed |= self.read_journal(stamp[1])
+			except (OSError, ValueError, KeyError):
+				# Not written by pm: read again entirely
+				self.workflow.reload()
+				self.start()
+				return set(self.workflow.by_id)
+			self.stamp = self.workflow.stamp = stamp
+		return changed
+
+
+	def read_database(self):
+		"""Build again the projects which changed in the database"""
+		data = self.read()
+		if data is not None and data == self.data:
+			# Only touched
+			return set()
+		found = jsondb.diff(self.data, data) if data is not None and self.data is not None else None
+		if found is None:
+			raise ValueError("database not written by pm")
+		meta, old, new = found
+		if meta.get('journal_seq', 0) < self.workflow.seq:
+			raise ValueError("records of the journal missing in the database")
+
+		# Projects around the differences may not have changed
+		old, new = set(old), set(new)
+		records = [(fragment, json.loads(fragment)) for fragment in new - old]
+		ids = {record['id'] for _, record in records}
+		removed = {json.loads(fragment)['id'] for fragment in old - new} - ids
+		self.workflow.replace(records, removed)
+
+		# The journal was merged in the database
+		self.workflow.json = meta
+		self.workflow.seq = meta.get('journal_seq', 0)
+		self.workflow.journal_size = 0
+		self.data = data
+		self.offset = 0
+		return ids | removed
+
+
+	def read_journal(self, stamp):
+		"""Apply the records appended to the journal"""
+		if stamp is None:
+			self.offset = 0
+			return set()
+		if stamp[1] < self.offset:
+			raise ValueError("journal written again")
+		with open(self.workflow.journal.path, 'rb') as log:
+			log.seek(self.offset)
+			data = log.read()
+		# A record being appended is read next time
+		end = data.rfind(b'\n') + 1
+		self.offset += end
+		changed = set()
+		for line in data[:end].splitlines():
+			record = json.loads(line)
+			if record['seq'] <= self.workflow.seq:
+				continue
+			self.workflow.apply(record)
+			self.workflow.seq = record['seq']
+			self.workflow.journal_size += 1
+			changed |= self.workflow.record_ids([record])
+		return changed
+
+
+
+def run(workflow, dashboard, interval=settings.WATCH_INTERVAL):
+	"""
+	Display the lines of dashboard(workflow, limit), again each time the
+	database or the day changes, until interrupted. In a terminal, limit is
+	the number of projects fitting in it.
+	"""
+	watcher = Watcher(workflow)
+	changed = None
+	day = None
+	try:
+		while True:
+			now = datetime.datetime.now()
+			if changed or now.date() != day:
+				day = now.date()
+				header = "  Updated {0:%d/%m/%Y %H:%M:%S}{1}, every {2}s (Ctrl-C to quit)".format(
+					now, ", {0} project(s) changed".format(len(changed)) if changed else '', interval
+				)
+				# Header and the rulers above and below the projects
+				limit = shutil.get_terminal_size().lines - 4 if sys.stdout.isatty() else None
+				render.redraw([header] + dashboard(workflow, limit))
+			time.sleep(interval)
+			changed = watcher.poll()
+	except KeyboardInterrupt:
+		pass
@@ -3,18 +3,35 @@
 Runtime module to handle the command and interact with the pmlib.
 """
 
-import argparse, os, datetime
+import time
+START = time.perf_counter()
 
-import lib.pmlib as pmlib
-import lib.export as export
+import argparse, os, sys, datetime
+
+import lib.daemon as daemon
+import lib.timing as timing
 import settings
 
 
 
-def main():
+def end_of_day(text):
+	"""Convert a date dd/mm/yyyy to the last moment of the day"""
+	try:
+		date = datetime.datetime.strptime(text, '%d/%m/%Y')
+	except ValueError:
+		raise argparse.ArgumentTypeError("invalid date {0}, expected dd/mm/yyyy".format(text))
+	return date + datetime.timedelta(days=1, microseconds=-1)
+
+
+
+def build_parser():
 
 	# Parser options
 	parser = argparse.ArgumentParser()
+	parser.add_argument('--profile', action='store_true', default=False,
+						help="display the time and memory of each phase of the command (or PM_PROFILE=1)")
+	parser.add_argument('--profile-output', default=None, metavar='FILE',
+						help="also write the cProfile statistics in FILE (or PM_PROFILE_OUTPUT=FILE)")
 	subparsers = parser.add_subparsers(help='all commands to interact with pm', dest='command')
 
 	# Subparser status
@@ -25,6 +42,35 @@ def main():
 							   help="sort project by key")
 	status_parser.add_argument('-e', '--extended', action='store_true', default=False,
 							   help="display extended project dashboard")
+	status_parser.add_argument('--limit', type=int, default=None,
+							   help="display only this number of projects")
+	status_parser.add_argument('--offset', type=int, default=0,
+							   help="skip this number of projects")
+	status_parser.add_argument('where', nargs='*', metavar='FILTER',
+							   help="display only the projects matching every filter, " \
+									"ex: type=Lic status>=Contr pi=Dupont stale>30d money>100")
+	status_parser.add_argument('--top', type=int, default=None,
+							   help="display only the first N projects of the sort")
+	status_parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text',
+							   help="write the dashboard in JSON or CSV format")
+	status_parser.add_argument('--as-of', type=end_of_day, default=None, metavar='DATE',
+							   help="dashboard as it was at the end of DATE (dd/mm/yyyy)")
+
+	# Subparser watch
+	watch_parser = subparsers.add_parser('watch', help="display the status dashboard, updated when the database changes")
+	watch_parser.add_argument('-l', '--all', action='store_true', default=False,
+							  help="display ongoing and done project dashboard")
+	watch_parser.add_argument('-o', '--sort', action='store', dest='sort_key', default='status',
+							  help="sort project by key")
+	watch_parser.add_argument('-e', '--extended', action='store_true', default=False,
+							  help="display extended project dashboard")
+	watch_parser.add_argument('where', nargs='*', metavar='FILTER',
+							  help="display only the projects matching every filter, as pm status")
+	watch_parser.add_argument('--top', type=int, default=None,
+							  help="display only the first N projects of the sort")
+	watch_parser.add_argument('-n', '--interval', type=float, default=settings.WATCH_INTERVAL,
+							  help="seconds between two checks of the database ({0} by default)".format(
+								  settings.WATCH_INTERVAL))
 
 	# Subparser stats
 	stats_parser = subparsers.add_parser('stats', help="display statistics")
@@ -36,10 +82,38 @@ def main():
 							  help='stats for the indicated year: starting at 1/01, end 31/12')
 	stats_parser.add_argument('--all-year', action='store_true', default=False,
 							  help='stats for all years in database')
+	stats_parser.add_argument('--series', choices=['month', 'quarter', 'year'], default=None,
+							  help='stats of each month, quarter or year, from the first project')
+	stats_parser.add_argument('--csv', action='store', default=None, metavar='FILE',
+							  help='with --series, write the stats in CSV format (- for the standard output)')
+	stats_parser.add_argument('--as-of', type=end_of_day, default=None, metavar='DATE',
+							  help='stats of the projects as they were at the end of DATE (dd/mm/yyyy)')
 	
+	# Subparser funnel
+	funnel_parser = subparsers.add_parser('funnel', help="display the time in each status and the conversions")
+	funnel_parser.add_argument('--by', choices=['type', 'pi'], default='type',
+							   help="drop-off per type of contract or per PI")
+
 	# Subparser history
 	history_parser = subparsers.add_parser('history', help="display the history of a project")
 	history_parser.add_argument('id', type=int)
+	history_parser.add_argument('--limit', type=int, default=None,
+								help="with id 0, display only this number of projects")
+	history_parser.add_argument('--offset', type=int, default=0,
+								help="with id 0, skip this number of projects")
+
+	# Subparser search
+	search_parser = subparsers.add_parser('search', help="search the names, summaries, PIs, refs and comments")
+	search_parser.add_argument('query', nargs='+',
+							   help='words, "phrases" and prefix* the results all contain')
+	search_parser.add_argument('-S', '--start', action='store', dest='start_date', default=None,
+							   help='only the actions from this date (dd/mm/yyyy)')
+	search_parser.add_argument('-E', '--end', action='store', dest='end_date', default=None,
+							   help='only the actions until this date (dd/mm/yyyy)')
+	search_parser.add_argument('-s', '--status', choices=list(settings.PROGRESS), default=None,
+							   help="only the actions with this status")
+	search_parser.add_argument('-n', '--limit', type=int, default=20,
+							   help="number of results displayed (20 by default)")
 
 	# Subparser add project
 	add_parser = subparsers.add_parser('add', help="add a new project in the workflow")
@@ -75,34 +149,208 @@ def main():
 							   dest='amend', help='amend a node in the history of the project. ' \
 							                      'Ex: --amend [NODE_ID] date:12/01/2015 name:Sanofi')
 
+	# Bulk import
+	import_parser = subparsers.add_parser('import', help="import projects and actions from a file")
+	import_parser.add_argument('file', type=str, help="CSV or JSON lines file, - for the standard input")
+	import_parser.add_argument('-f', '--format', choices=['csv', 'jsonl'], default=None,
+							   help="format of the file, guessed from its extension by default")
+
 	# Reports in word
 	report = subparsers.add_parser('report', help="Export the report in word format")
 	report.add_argument('--excel', action='store_true', default=False,
 						help="Generate a report in Excel")
+	report.add_argument('--split', choices=['status', 'type', 'pi'], default=None,
+						help="Split the word report in sections rendered in parallel")
+	report.add_argument('--files', action='store_true', default=False,
+						help="Write one word file per section instead of merging them")
+	report.add_argument('--detail', action='store_true', default=False,
+						help="Add the history of each project after the projects")
+	report.add_argument('--force', action='store_true', default=False,
+						help="Generate the report even if nothing changed since the last one")
+	report.add_argument('--as-of', type=end_of_day, default=None, metavar='DATE',
+						help="Report of the projects as they were at the end of DATE (dd/mm/yyyy)")
+	report.add_argument('--list', action='store_true', default=False,
+						help="List the reports generated")
+	report.add_argument('--prune', type=int, nargs='?', const=90, default=None, metavar='DAYS',
+						help="Delete the reports generated more than DAYS days ago (90 by default)")
+
+	# Merge the journal in the database
+	checkpoint = subparsers.add_parser('checkpoint', help="merge the journal in the database")
+
+	# Verify the database
+	check = subparsers.add_parser('check', help="verify the fields derived from the history")
+	check.add_argument('--rebuild', action='store_true', default=False,
+					   help="recompute the fields derived from the history and save")
+
+	# Convert the database to another storage
+	migrate = subparsers.add_parser('migrate', help="convert the database to another storage")
+	migrate.add_argument('to', choices=['json', 'sqlite'],
+						 help="storage to convert the database to")
+
+	# Resident process keeping the workflow in memory
+	daemon_parser = subparsers.add_parser('daemon', help="run pm in the background to answer commands faster")
+	daemon_parser.add_argument('--stop', action='store_true', default=False,
+							   help="stop the daemon running")
 
 	# Display readme file
 	readme = subparsers.add_parser('readme', help="display readme file with instructions")
 
+	return parser
+
+
+
+def main():
+
 	# Parse arguments
+	parser = build_parser()
 	args = parser.parse_args()
 
+	profile_output = args.profile_output or os.environ.get('PM_PROFILE_OUTPUT')
+	if not (args.profile or os.environ.get('PM_PROFILE', '') not in ['', '0'] or profile_output):
+		execute(args, parser)
+		return
+
+	# Profiling: the command runs here, not in the daemon
+	timing.enable(START)
+	profiler = None
+	if profile_output:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+	try:
+		execute(args, parser, forward=False)
+	finally:
+		if profiler:
+			profiler.disable()
+			profiler.dump_stats(profile_output)
+		timing.report()
+
+
+
+def execute(args, parser, forward=True):
+	"""Execute the command, in the daemon if it is running and forward is True"""
+
+	# Forward the command to the daemon if it is running, except the exports to a file
+	if forward and args.command in daemon.FORWARDED and getattr(args, 'csv', None) in [None, '-']:
+		output = daemon.forward(sys.argv[1:])
+		if output is not None:
+			sys.stdout.write(output)
+			return
+
+	# Convert the database
+	if args.command == 'migrate':
+		import lib.pmlib as pmlib
+		import lib.storage as storage
+		source = 'json' if args.to == 'sqlite' else 'sqlite'
+		source_storage = storage.open_storage(source)
+		wf = pmlib.Workflow(source_storage.path, storage=source_storage)
+		wf.migrate(storage.open_storage(args.to, cache=False))
+		print("Database converted from {0} to {1}.".format(source, args.to))
+		return
+
+	# Run or stop the daemon
+	if args.command == 'daemon':
+		if args.stop:
+			print("Daemon stopped." if daemon.stop() else "No daemon running.")
+		else:
+			print("Daemon listening on {0}".format(settings.DAEMON_SOCKET))
+			daemon.serve(load_workflow, run, parser)
+		return
+
 	# Load library
-	wf = pmlib.Workflow(settings.DATABASE_PATH)
+	wf = load_workflow(args)
+	with timing.phase('run'):
+		run(args, wf)
+
+
+
+def load_workflow(args=None):
+	"""Load the workflow from the storage configured"""
+	with timing.phase('import'):
+		import lib.pmlib as pmlib
+		import lib.storage as storage
+	db = storage.open_storage()
+	# Commands working on a single project only build the projects they touch,
+	# the series only the projects changed since their rollups were stored
+	lazy = args is not None and (
+		args.command in ['commit', 'update', 'rm', 'search'] \
+		or (args.command == 'history' and args.id != 0) \
+		or (args.command in ['status', 'stats'] and db.INDEXED) \
+		or (args.command == 'stats' and args.series and not args.as_of \
+			and os.path.exists(db.path + settings.SERIES_EXT))
+	)
+	return pmlib.Workflow(db.path, lazy=lazy, storage=db)
+
+
+
+def run(args, wf):
+	"""Execute the command on the workflow"""
+
+	# Projects as they were at a date, the workflow itself is left unchanged
+	if getattr(args, 'as_of', None):
+		wf = wf.as_of(args.as_of)
 
 	# Parse commands
 	if args.command == 'status':
-		wf.status(all=args.all, key=args.sort_key, extended=args.extended)
+		import lib.query as query
+		try:
+			where = query.parse(args.where, now=wf.today())
+		except query.QueryError as error:
+			print("Error: {0}.".format(error))
+			return
+		options = {
+			'all': args.all, 'key': args.sort_key, 'limit': args.limit, 'offset': args.offset,
+			'where': where, 'top': args.top
+		}
+		if args.format == 'text':
+			wf.status(extended=args.extended, **options)
+		else:
+			wf.dump_status(args.format, sys.stdout, **options)
+
+
+	elif args.command == 'watch':
+		import lib.query as query
+		import lib.watch as watch
+		try:
+			query.parse(args.where)
+		except query.QueryError as error:
+			print("Error: {0}.".format(error))
+			return
+		def dashboard(workflow, limit):
+			# Parsed again, stale>30d moves with the day
+			return workflow.status_lines(
+				all=args.all, key=args.sort_key, extended=args.extended, limit=limit,
+				where=query.parse(args.where, now=workflow.today()), top=args.top
+			)
+		watch.run(wf, dashboard, interval=args.interval)
+
+
+	elif args.command == 'funnel':
+		try:
+			wf.funnel(by=args.by)
+		except ImportError as error:
+			print("Error: pm funnel needs NumPy ({0}).".format(error))
 
 
 	elif args.command == 'history':
 		if args.id == 0:
-			max_id = max([project.id for project in wf.projects + wf.projects_done])
-			for i in range(1, max_id):
-				wf.history(i)
+			wf.history_all(limit=args.limit, offset=args.offset)
 		else:
 			wf.history(args.id)
 
 
+	elif args.command == 'search':
+		start_date, end_date = [
+			datetime.datetime.strptime(date, '%d/%m/%Y') if date else None \
+			for date in [args.start_date, args.end_date]
+		]
+		if end_date:
+			# Until the end of the day
+			end_date += datetime.timedelta(days=1, microseconds=-1)
+		wf.search(' '.join(args.query), start_date=start_date, end_date=end_date,
+				  status=args.status, limit=args.limit)
+
+
 	elif args.command == 'add':
 		if args.type in settings.TYPE_OF_CONTRACTS:
 			wf.add_project(args.name, args.type, args.money)
@@ -117,6 +365,27 @@ def main():
 		wf.rm(args.id)
 
 
+	elif args.command == 'stats' and args.series:
+		import lib.series as series
+		# All the periods unless dates are given
+		if args.year:
+			args.start_date = '01/01/' + str(args.year)
+			args.end_date = '31/12/' + str(args.year)
+		start_date, end_date = [
+			datetime.datetime.strptime(date, '%d/%m/%Y') if date else None \
+			for date in [args.start_date, args.end_date]
+		]
+		end_date = end_date or wf.as_of_date
+		if args.csv == '-':
+			series.write_csv(wf.series_api(args.series, start_date, end_date), sys.stdout)
+		elif args.csv:
+			with open(args.csv, 'w', newline='') as file:
+				series.write_csv(wf.series_api(args.series, start_date, end_date), file)
+			print("Stats written in {0}".format(args.csv))
+		else:
+			wf.series(args.series, start_date=start_date, end_date=end_date)
+
+
 	elif args.command == 'stats':
 		if args.all_year:
 			args.start_date = None
@@ -125,7 +394,7 @@ def main():
 			args.start_date = datetime.datetime.strptime('01/01/'+str(args.year), '%d/%m/%Y')
 			args.end_date = datetime.datetime.strptime('31/12/'+str(args.year), '%d/%m/%Y')
 		if not args.year and not args.all_year:
-			year = datetime.date.today().year
+			year = wf.today().year
 			if args.start_date:
 				args.start_date = datetime.datetime.strptime(args.start_date, '%d/%m/%Y')
 			else:
@@ -168,32 +437,68 @@ def main():
 				wf.add_action(args.id, status=args.status, comment=args.commit)
 
 
+	elif args.command == 'import':
+		import lib.importer as importer
+		format = args.format or ('csv' if args.file.lower().endswith('.csv') else 'jsonl')
+		try:
+			if args.file == '-':
+				count = importer.run(wf, importer.read(sys.stdin, format))
+			else:
+				with open(args.file, 'r', newline='') as file:
+					count = importer.run(wf, importer.read(file, format))
+		except (OSError, importer.RowError) as error:
+			print("Error: {0}. Nothing was imported.".format(error))
+		except UnicodeDecodeError as error:
+			print("Error: the text of {0} could not be decoded ({1}). Nothing was imported.".format(
+				args.file, error.reason)
+			)
+		else:
+			print("{0} rows imported.".format(count))
+
+
 	elif args.command == 'report':
-		if args.excel:
-			export.report_excel(wf)
+		with timing.phase('import'):
+			import lib.export as export
+		if args.list:
+			export.list_reports()
+		elif args.prune is not None:
+			export.prune_reports(args.prune)
+		elif args.excel:
+			export.report_excel(wf, force=args.force)
 		else:
-			export.report_word(wf)
+			export.report_word(
+				wf, split=args.split, files=args.files, detail=args.detail, force=args.force
+			)
 
 
 	elif args.command == 'update':
-		project = wf.find_project(args.id)
+		params = {}
 		if args.name:
-			project.name = args.name
+			params['name'] = args.name
 		if args.type:
-			project.type = args.type
+			params['type'] = args.type
 		if args.money:
-			project.money = args.money
+			params['money'] = args.money
 		if args.money_year:
-			project.money_year = args.money_year
+			params['money_year'] = args.money_year
 		if args.summary:
-			project.summary = args.summary
+			params['summary'] = args.summary
 		if args.pi:
-			project.pi = args.pi
+			params['pi'] = args.pi
 		if args.ref:
-			project.ref = args.ref
-		wf.save()
+			params['ref'] = args.ref
+		wf.update_project(args.id, params)
+
+
+	elif args.command == 'checkpoint':
+		wf.checkpoint()
+
+
+	elif args.command == 'check':
+		wf.check(rebuild=args.rebuild)
 
 	elif args.command == 'readme':
+		import lib.export as export
 		export.open_file(settings.DIR + '/readme.md')
 
 if __name__ == '__main__':
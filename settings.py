@@ -18,17 +18,62 @@ PROGRESS = {
 
 TYPE_OF_CONTRACTS = ['R&D', 'aR&D', 'Lic', 'aLic', 'MTA']
 
+# Families of contracts used by the statistics
+CONTRACT_FAMILIES = {
+	'Lic': 'license',
+	'aLic': 'license',
+	'R&D': 'rnd',
+	'aR&D': 'rnd',
+	'MTA': 'rnd',
+	'aMTA': 'rnd'
+}
+
 WIDTH = 85
 
 WARN_TIME = 7
 
+# Page the dashboards taller than the terminal ($PAGER, less by default)
+PAGER = True
+
 DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_FILE = 'db.json'
 DATABASE_PATH = DIR + '/database/' + DATABASE_FILE
 
+# Storage of the database: 'json' or 'sqlite'
+STORAGE = 'json'
+SQLITE_FILE = 'db.sqlite'
+SQLITE_PATH = DIR + '/database/' + SQLITE_FILE
+
+# Append mutations to a journal instead of rewriting the whole database
+JOURNAL = False
+JOURNAL_EXT = '.log'
+JOURNAL_CHECKPOINT = 100
+
+# Lock of the database shared by the pm processes writing it
+LOCK_EXT = '.lock'
+
+# Socket of the daemon keeping the workflow in memory (pm daemon)
+DAEMON_SOCKET = DIR + '/database/pm.sock'
+
+# Seconds between two checks of the database by pm watch
+WATCH_INTERVAL = 2
+
+# Binary copy of the database for fast loading
+CACHE = True
+CACHE_EXT = '.cache'
+
+# Inverted index of the texts for pm search, and log of the projects changed since
+SEARCH_EXT = '.search'
+
+# Rollups of pm stats --series, and log of the projects changed since
+SERIES_EXT = '.series'
+
 WORD_TEMPLATE = 'Templates/Report_template.docx'
 
 WORD_COLOR_CELL = 'd7e2f7'
 
+# Fingerprint of the data of a report, stored next to it to skip unchanged reports
+REPORT_FINGERPRINT_EXT = '.fingerprint'
+
 MAX_LEN_NAME = 15
 
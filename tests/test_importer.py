@@ -0,0 +1,86 @@
+"""
+Tests of the bulk import.
+"""
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib.importer as importer
+import lib.pmlib as pmlib
+
+
+def project_json(id, name):
+	return {
+		'id': id, 'name': name, 'type': 'R&D', 'money': 100, 'money_year': 0,
+		'pi': '', 'summary': '', 'ref': '',
+		'history': [
+			{'node': 1, 'status': 'Start', 'date': '2015-01-10T00:00:00', 'comment': '-'}
+		]
+	}
+
+
+class ImportTest(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.path = os.path.join(directory, 'db.json')
+		with open(self.path, 'w') as db:
+			json.dump({'projects': [project_json(1, 'Servier')]}, db, sort_keys=True, indent=4)
+
+
+	def workflow(self):
+		return pmlib.Workflow(self.path, journal=False, cache=False)
+
+
+	def run_import(self, text, format='jsonl'):
+		return importer.run(self.workflow(), importer.read(io.StringIO(text), format))
+
+
+	def test_failing_row_leaves_the_database_untouched(self):
+		for journal in [False, True]:
+			with self.subTest(journal=journal):
+				with open(self.path) as db:
+					before = db.read()
+				workflow = pmlib.Workflow(self.path, journal=journal, cache=False)
+				rows = importer.read(io.StringIO(
+					'{"op": "add", "name": "Roche", "type": "Lic", "money": 50}\n'
+					'{"op": "commit", "id": 1, "status": "Progr", "comment": "meeting"}\n'
+					'{"op": "commit", "id": 3, "status": "Unknown"}\n'
+				), 'jsonl')
+				with self.assertRaises(importer.RowError) as context:
+					importer.run(workflow, rows)
+				self.assertEqual(context.exception.line, 3)
+
+				with open(self.path) as db:
+					self.assertEqual(db.read(), before)
+				self.assertFalse(os.path.exists(self.path + '.log'))
+				# The projects in memory are read again
+				self.assertEqual(sorted(workflow.by_id), [1])
+				self.assertEqual(len(workflow.find_project(1).history), 1)
+
+
+	def test_date_with_time_zone_is_rejected(self):
+		with self.assertRaises(importer.RowError) as context:
+			self.run_import('{"op": "commit", "id": 1, "date": "2024-01-01T00:00:00+02:00"}\n')
+		self.assertEqual(context.exception.line, 1)
+		self.assertEqual(len(self.workflow().find_project(1).history), 1)
+
+
+	def test_values_are_imported_as_text(self):
+		self.assertEqual(self.run_import(
+			'{"op": "commit", "id": 1, "status": "Progr", "date": "2016-02-01", "comment": 5}\n'
+		), 1)
+		hist = self.workflow().find_project(1).history[-1]
+		self.assertEqual((hist['status'], hist['comment']), ('Progr', '5'))
+
+
+if __name__ == '__main__':
+	unittest.main()
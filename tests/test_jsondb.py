@@ -0,0 +1,86 @@
+"""
+Tests of the JSON database read and written project by project.
+"""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib.jsondb as jsondb
+from lib.project import Project
+
+
+def project_json(id, comment='-'):
+	return {
+		'id': id, 'name': 'Project {0}'.format(id), 'type': 'R&D', 'done': False,
+		'history': [{'node': 1, 'status': 'Start', 'date': '2015-01-10T00:00:00', 'comment': comment}]
+	}
+
+
+def text(projects, **data):
+	return jsondb.dumps(data, [jsondb.encode(project) for project in projects])
+
+
+class JsonDbTest(unittest.TestCase):
+
+	def test_dump_writes_as_json(self):
+		projects = [project_json(id) for id in range(1, 4)]
+		for fragments in [projects, []]:
+			self.assertEqual(
+				text(fragments, journal_seq=2),
+				json.dumps({'journal_seq': 2, 'projects': fragments}, sort_keys=True, indent=4)
+			)
+
+
+	def test_encode_as_json(self):
+		record = dict(project_json(1, comment='caf\u00e9 "quoted"'), money=10, money_year=0)
+		project = Project.loads(dict(record, pi='', summary='', ref=''))
+		self.assertEqual(
+			jsondb.encode(project.dumps(iso=False)),
+			json.dumps(project.dumps(), sort_keys=True, indent=4).replace('\n', '\n' + jsondb.INDENT * 2)
+		)
+		value = {'list': [1.5, True, None, [], {}, 'a\nb'], 'nested': {'key': [{'a': -1}]}}
+		self.assertEqual(jsondb.encode(value), json.dumps(value, sort_keys=True, indent=4).replace(
+			'\n', '\n' + jsondb.INDENT * 2
+		))
+
+
+	def test_locate_without_decoding(self):
+		projects = [project_json(id, comment='a "quoted"\nline') for id in range(1, 4)]
+		database = text(projects, journal_seq=2)
+		data, positions = jsondb.locate(database)
+		self.assertEqual(data, {'journal_seq': 2})
+		self.assertEqual([json.loads(database[start:end]) for start, end in positions], projects)
+		start, end = positions[1]
+		self.assertEqual(
+			jsondb.fields(database, start, end, ['id', 'name', 'done']),
+			{'id': 2, 'name': 'Project 2', 'done': False}
+		)
+		# Laid out another way, the projects are decoded to be found
+		other = json.dumps({'projects': projects})
+		self.assertEqual(
+			[json.loads(other[start:end]) for start, end in jsondb.locate(other)[1]], projects
+		)
+
+
+	def test_diff_returns_the_projects_around_the_changes(self):
+		projects = [project_json(id) for id in range(1, 101)]
+		old = text(projects).encode()
+		projects[49] = project_json(50, comment='changed')
+		del projects[59]
+		data, before, after = jsondb.diff(old, text(projects, journal_seq=1).encode())
+		self.assertEqual(data, {'journal_seq': 1})
+		before = {json.loads(fragment)['id']: fragment for fragment in before}
+		after = {json.loads(fragment)['id']: fragment for fragment in after}
+		changed = {id for id in set(before) | set(after) if before.get(id) != after.get(id)}
+		self.assertEqual(changed, {50, 60})
+		self.assertEqual(json.loads(after[50])['history'][0]['comment'], 'changed')
+		self.assertEqual(jsondb.diff(old, old)[1:], ([], []))
+		self.assertIsNone(jsondb.diff(old, json.dumps({'projects': []}).encode()))
+
+
+if __name__ == '__main__':
+	unittest.main()
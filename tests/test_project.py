@@ -0,0 +1,62 @@
+"""
+Tests of the history of the projects.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib.pmlib as pmlib
+from lib.project import Project
+
+
+def project_json():
+	return {
+		'id': 1, 'name': 'Servier', 'type': 'R&D', 'money': 100, 'money_year': 0,
+		'pi': '', 'summary': '', 'ref': '',
+		'history': [
+			{'node': 1, 'status': 'Start', 'date': '2015-01-10T00:00:00', 'comment': '-'},
+			{'node': 2, 'status': 'Progr', 'date': '2015-03-10T00:00:00', 'comment': 'meeting'},
+			{'node': 3, 'status': 'Contr', 'date': '2015-06-10T00:00:00', 'comment': 'draft'}
+		]
+	}
+
+
+class UpdateActionTest(unittest.TestCase):
+
+	def test_amended_date_keeps_history_sorted(self):
+		project = Project.loads(project_json())
+		project.update_action(1, {'date': datetime.datetime(2016, 1, 1)})
+		self.assertEqual([hist['node'] for hist in project.history], [2, 3, 1])
+		self.assertEqual(project.first_date, datetime.datetime(2015, 3, 10))
+		self.assertEqual(project.last_date, datetime.datetime(2016, 1, 1))
+		self.assertEqual(project.status, 'Start')
+		self.assertEqual(project.verify(), [])
+		self.assertIs(project.nodes[1], project.history[-1])
+		self.assertEqual(project.last_node, 3)
+
+
+	def test_amended_date_passes_check(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		path = os.path.join(directory, 'db.json')
+		with open(path, 'w') as db:
+			json.dump({'projects': [project_json()]}, db)
+
+		workflow = pmlib.Workflow(path, journal=False, cache=False)
+		workflow.update_action(1, {'date': datetime.datetime(2014, 12, 1)}, node=3)
+		workflow = pmlib.Workflow(path, journal=False, cache=False)
+		project = workflow.find_project(1)
+		self.assertEqual(project.span(), (datetime.datetime(2014, 12, 1), datetime.datetime(2015, 3, 10)))
+		self.assertEqual(project.status, 'Progr')
+		self.assertEqual(workflow.check(), 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,65 @@
+"""
+Tests of the rendering of the dashboards.
+"""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib.render as render
+
+
+class Terminal(io.StringIO):
+
+	def isatty(self):
+		return True
+
+
+class WriteTest(unittest.TestCase):
+
+	def write(self, lines, size=(80, 24)):
+		"""Return the text written on the terminal and the text given to the pager"""
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		path = os.path.join(directory, 'paged')
+		terminal = Terminal()
+		with mock.patch.object(sys, 'stdout', terminal), \
+			mock.patch.dict(os.environ, {'PAGER': 'cat > ' + path}), \
+			mock.patch.object(shutil, 'get_terminal_size', return_value=os.terminal_size(size)):
+			render.write(lines)
+		paged = None
+		if os.path.exists(path):
+			with open(path) as file:
+				paged = file.read()
+		return terminal.getvalue(), paged
+
+
+	def test_rows_of_wrapped_and_colored_lines(self):
+		self.assertEqual(render.rows('\033[91m' + 'x' * 85 + '\033[0m', 80), 2)
+		self.assertEqual(render.rows('first\n' + ' ' * 32 + 'second', 80), 2)
+		self.assertEqual(render.rows('', 80), 1)
+
+
+	def test_lines_fitting_are_written_at_once(self):
+		self.assertEqual(self.write(['x' * 20] * 10), (('x' * 20 + '\n') * 10, None))
+
+
+	def test_long_lines_wrapped_by_the_terminal_are_paged(self):
+		written, paged = self.write(['x' * 200] * 10)
+		self.assertEqual(written, '')
+		self.assertEqual(paged, ('x' * 200 + '\n') * 10)
+
+
+	def test_lines_are_streamed_to_the_pager(self):
+		written, paged = self.write(str(number) for number in range(1000))
+		self.assertEqual(paged, ''.join('{0}\n'.format(number) for number in range(1000)))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,75 @@
+"""
+Tests of the storages of the database.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib.pmlib as pmlib
+from lib.storage import JsonStorage, SqliteStorage
+
+
+def project_json(id, name):
+	return {
+		'id': id, 'name': name, 'type': 'R&D', 'money': 100, 'money_year': 0,
+		'pi': '', 'summary': '', 'ref': '',
+		'history': [
+			{'node': 1, 'status': 'Start', 'date': '2015-01-10T00:00:00', 'comment': '-'}
+		]
+	}
+
+
+class MigrateTest(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.json_path = os.path.join(directory, 'db.json')
+		self.sqlite_path = os.path.join(directory, 'db.sqlite')
+		with open(self.json_path, 'w') as db:
+			json.dump({'projects': [project_json(1, 'Servier'), project_json(2, 'Sanofi')]}, db)
+
+
+	def workflow(self, storage):
+		return pmlib.Workflow(storage.path, journal=True, storage=storage)
+
+
+	def test_round_trip_keeps_journaled_actions_once(self):
+		workflow = self.workflow(JsonStorage(self.json_path, cache=False))
+		workflow.add_action(2, status='Progr', comment='journaled')
+		self.assertTrue(os.path.exists(self.json_path + '.log'))
+
+		workflow.migrate(SqliteStorage(self.sqlite_path))
+		workflow = self.workflow(SqliteStorage(self.sqlite_path))
+		self.assertEqual(len(workflow.find_project(2).history), 2)
+
+		workflow.migrate(JsonStorage(self.json_path, cache=False))
+		self.assertFalse(os.path.exists(self.json_path + '.log'))
+		workflow = self.workflow(JsonStorage(self.json_path, cache=False))
+		history = workflow.find_project(2).history
+		self.assertEqual([hist['comment'] for hist in history], ['-', 'journaled'])
+		self.assertEqual(workflow.check(), 0)
+
+
+
+class SqliteStatsTest(unittest.TestCase):
+
+	def test_stats_of_an_empty_database(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		storage = SqliteStorage(os.path.join(directory, 'db.sqlite'))
+		workflow = pmlib.Workflow(storage.path, lazy=True, storage=storage)
+		context = workflow.stats_api(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 12, 31))
+		self.assertEqual(context['nb_projects'], 0)
+		self.assertEqual(context['total_money_done'], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,211 @@
+"""
+Tests of the persistence of the workflow: journal, lock and readers
+following the changes of the other processes.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings
+import lib.pmlib as pmlib
+import lib.search as search
+from lib.journal import Journal
+from lib.search import SearchIndex
+from lib.watch import Watcher
+
+
+def project_json(id, name):
+	return {
+		'id': id, 'name': name, 'type': 'R&D', 'money': 100, 'money_year': 0,
+		'pi': '', 'summary': '', 'ref': '',
+		'history': [
+			{'node': 1, 'status': 'Start', 'date': '2015-01-10T00:00:00', 'comment': '-'}
+		]
+	}
+
+
+class Crash(Exception):
+	"""Process stopped in the middle of a write"""
+
+
+class WorkflowTest(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.path = os.path.join(directory, 'db.json')
+		with open(self.path, 'w') as db:
+			json.dump(
+				{'projects': [project_json(1, 'Servier'), project_json(2, 'Sanofi')]},
+				db, sort_keys=True, indent=4
+			)
+		# Written again by pm, with the fields derived from the history
+		self.workflow().save()
+
+
+	def workflow(self, journal=False, lazy=False):
+		return pmlib.Workflow(self.path, journal=journal, cache=False, lazy=lazy)
+
+
+	def comments(self, workflow, id):
+		return [hist['comment'] for hist in workflow.find_project(id).history]
+
+
+
+class JournalTest(WorkflowTest):
+
+	def test_records_are_replayed_on_load(self):
+		workflow = self.workflow(journal=True)
+		workflow.add_action(1, status='Progr', comment='first')
+		workflow.add_project('Roche', 'Lic', 50)
+		workflow.rm(2)
+		self.assertEqual(len(Journal(self.path + settings.JOURNAL_EXT).records()), 3)
+
+		workflow = self.workflow(journal=True)
+		self.assertEqual(self.comments(workflow, 1), ['-', 'first'])
+		self.assertEqual(sorted(workflow.by_id), [1, 3])
+		self.assertEqual(workflow.seq, 3)
+
+
+	def test_checkpoint_merges_the_journal(self):
+		workflow = self.workflow(journal=True)
+		workflow.add_action(1, comment='first')
+		workflow.checkpoint()
+		self.assertFalse(os.path.exists(self.path + settings.JOURNAL_EXT))
+		with open(self.path) as db:
+			self.assertEqual(json.load(db)['journal_seq'], 1)
+
+		workflow = self.workflow(journal=True)
+		workflow.add_action(1, comment='second')
+		self.assertEqual(Journal(self.path + settings.JOURNAL_EXT).records()[0]['seq'], 2)
+		self.assertEqual(self.comments(self.workflow(journal=True), 1), ['-', 'first', 'second'])
+
+
+	def test_crash_between_database_write_and_journal_clear(self):
+		workflow = self.workflow(journal=True)
+		workflow.add_action(1, comment='first')
+		workflow.add_action(2, comment='second')
+		with mock.patch.object(Journal, 'clear', side_effect=Crash):
+			with self.assertRaises(Crash):
+				workflow.checkpoint()
+		# The database has the records, and the journal is still there
+		self.assertTrue(os.path.exists(self.path + settings.JOURNAL_EXT))
+
+		workflow = self.workflow(journal=True)
+		self.assertEqual(self.comments(workflow, 1), ['-', 'first'])
+		self.assertEqual(self.comments(workflow, 2), ['-', 'second'])
+		self.assertEqual(workflow.journal_size, 0)
+
+
+	def test_truncated_record_is_ignored(self):
+		workflow = self.workflow(journal=True)
+		workflow.add_action(1, comment='first')
+		with open(self.path + settings.JOURNAL_EXT, 'a') as log:
+			log.write('{"op": "add_action", "id": 1, "sta')
+		self.assertEqual(self.comments(self.workflow(journal=True), 1), ['-', 'first'])
+
+
+
+class ConcurrencyTest(WorkflowTest):
+
+	def test_two_writers_adding_a_project(self):
+		for journal in [False, True]:
+			with self.subTest(journal=journal):
+				self.setUp()
+				first, second = self.workflow(journal), self.workflow(journal)
+				first.add_project('Roche', 'Lic', 50)
+				# Same id available when the second one was loaded
+				second.add_project('Pfizer', 'MTA', 20)
+				self.assertEqual(second.find_project(4).name, 'Pfizer')
+				second.add_action(4, comment='on Pfizer')
+
+				workflow = self.workflow(journal)
+				names = {id: project.name for id, project in workflow.by_id.items()}
+				self.assertEqual(names, {1: 'Servier', 2: 'Sanofi', 3: 'Roche', 4: 'Pfizer'})
+				self.assertEqual(self.comments(workflow, 3), ['-'])
+				self.assertEqual(self.comments(workflow, 4), ['-', 'on Pfizer'])
+
+
+	def test_two_writers_on_the_same_project(self):
+		first, second = self.workflow(lazy=True), self.workflow()
+		first.add_action(1, comment='first')
+		second.add_action(1, comment='second')
+		second.update_project(2, {'pi': 'Dupont'})
+
+		workflow = self.workflow()
+		self.assertEqual(self.comments(workflow, 1), ['-', 'first', 'second'])
+		self.assertEqual(workflow.find_project(2).pi, 'Dupont')
+		self.assertEqual(workflow.check(), 0)
+
+
+
+class FollowTest(WorkflowTest):
+
+	def test_watcher_reads_only_the_changes(self):
+		for journal in [False, True]:
+			with self.subTest(journal=journal):
+				self.setUp()
+				workflow = self.workflow(journal)
+				watcher = Watcher(workflow)
+				self.assertIsNone(watcher.poll())
+				unchanged = workflow.find_project(2)
+
+				writer = self.workflow(journal)
+				writer.add_action(1, status='Progr', comment='first')
+				writer.add_project('Roche', 'Lic', 50)
+				self.assertEqual(watcher.poll(), {1, 3})
+				self.assertEqual(self.comments(workflow, 1), ['-', 'first'])
+				self.assertEqual(workflow.find_project(1).status, 'Progr')
+				self.assertEqual(workflow.find_project(3).name, 'Roche')
+				self.assertIs(workflow.find_project(2), unchanged)
+
+				writer.rm(3)
+				self.assertEqual(watcher.poll(), {3})
+				self.assertIsNone(workflow.find_project(3))
+
+
+	def test_search_index_catches_up_with_the_log_of_changes(self):
+		workflow = self.workflow()
+		self.assertEqual(workflow.search_api('Servier')[0]['id'], 1)
+		path = self.path + settings.SEARCH_EXT
+
+		writer = self.workflow(lazy=True)
+		writer.add_action(2, comment='licence negotiated')
+		workflow = self.workflow()
+		index = SearchIndex.load(path)
+		self.assertEqual(index.outdated(workflow.stamp, search.changes(path + settings.JOURNAL_EXT)), {2})
+
+		results = workflow.search_api('negotiated')
+		self.assertEqual([(result['id'], result['node']) for result in results], [(2, 2)])
+		# Stored again up to date, the log is not needed anymore
+		self.assertFalse(os.path.exists(path + settings.JOURNAL_EXT))
+
+
+
+	def test_rollups_catch_up_with_the_log_of_changes(self):
+		self.workflow().series_api('month')
+		path = self.path + settings.SERIES_EXT
+		self.assertTrue(os.path.exists(path))
+
+		writer = self.workflow(lazy=True)
+		writer.add_action(2, status='Done', comment='signed')
+		writer.add_project('Roche', 'Lic', 50)
+		workflow = self.workflow(lazy=True)
+		rows = workflow.series_api('month')
+		# Only the projects changed are built
+		self.assertEqual(sorted(workflow.by_id), [2, 3])
+		# Same rows as computed from all the projects
+		os.remove(path)
+		self.assertEqual(rows, self.workflow().series_api('month'))
+		self.assertEqual(sum(row['closed'] for row in rows), 1)
+
+
+if __name__ == '__main__':
+	unittest.main()